@@ -1,8 +1,23 @@
+from page_timing import PageTimer
+_timer = PageTimer("01_对账自动化Demo")   # 先于重模块导入，冷启动计入导入耗时
+import hashlib
 import io
 import numpy as np
 import pandas as pd
 import streamlit as st
 import json
+from contextlib import closing
+from datetime import date
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import recon_core
+import session_store
+from recon_core import NORM_COLS, aggregate_duplicates, fuzzy_match, normalize_df, outcome_index, reconcile
+from recon_history import HISTORY_DB, carry_forward, connect as history_connect, save_run, undo_carry, valid_period
+from invoice_match import DEFAULT_SEPARATORS
+from recon_ingest import (CSV_ENGINE, ENCODINGS, detect_encoding, ingest, is_excel, read_source,
+                          sheet_names, source_columns)
 
 # ---------- Page config ----------
 st.set_page_config(page_title="对账自动化 Demo（发票×账单）", page_icon="✅", layout="wide")
@@ -12,16 +27,29 @@ rule_file = st.sidebar.file_uploader("上传 rules.json（可选）", type=["jso
 
 # 若没有上传，也可以从仓库内置文件读取
 def load_rules():
-    if rule_file is not None:
-        return json.load(rule_file)
     try:
-        with open("rules.json", "r", encoding="utf-8") as f:
+        if rule_file is not None:
+            return json.load(rule_file)
+        with open("rules.json", "r", encoding="utf-8-sig") as f:   # 规则配置器导出的文件带 BOM
             return json.load(f)
-    except:
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        st.sidebar.warning(f"rules.json 解析失败（{e}），按未配置规则处理。")
         return None
 
 rules = load_rules()
 
+# 金额精度：按 rules.json 的 rounding.amount_decimals 换算为整数“最小货币单位”存储与比较，结果精确
+AMOUNT_DECIMALS = int(((rules or {}).get("rounding") or {}).get("amount_decimals", 2))
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMALS
+
+def to_minor(values) -> pd.Series:
+    return recon_core.to_minor(values, AMOUNT_SCALE)
+
+def to_major(df: pd.DataFrame) -> pd.DataFrame:
+    return recon_core.to_major(df, AMOUNT_SCALE)
+
 # 使用示例：容差
 def amounts_equal(a: float, b: float, ccy: str) -> bool:
     """
@@ -85,18 +113,23 @@ def df_to_excel_bytes(sheets: dict):
             df.to_excel(writer, index=False, sheet_name=name[:31] or "Sheet1")
     return output.getvalue()
 
+@st.cache_data(show_spinner=False)
+def sample_xlsx(kind: str) -> bytes:
+    """示例文件为静态资源：每个进程只生成一次，不随每次交互重建。"""
+    return df_to_excel_bytes({kind: build_sample_df(kind)})
+
 col_samp1, col_samp2, col_samp3 = st.columns(3)
 with col_samp1:
     st.download_button(
         "下载示例发票表（invoices.xlsx）",
-        data=df_to_excel_bytes({"invoices": build_sample_df("invoices")}),
+        data=sample_xlsx("invoices"),
         file_name="invoices_sample.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 with col_samp2:
     st.download_button(
         "下载示例账单表（bills.xlsx）",
-        data=df_to_excel_bytes({"bills": build_sample_df("bills")}),
+        data=sample_xlsx("bills"),
         file_name="bills_sample.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
@@ -113,25 +146,62 @@ with st.sidebar:
     normalize_currency = st.checkbox("忽略币种大小写", value=True)
     group_duplicates = st.checkbox("合并重复行（vendor+invoice_no+currency 汇总）", value=True)
     show_raw = st.checkbox("显示原始数据", value=False)
+    save_history = st.checkbox(f"保存结果到历史库（{HISTORY_DB}）", value=True,
+                               help="同一天内相同结果只保存一次；在『对账历史查询』页检索")
+    use_carry = st.checkbox("跨期结转未达项", value=True,
+                            help="本期单边行先与往期未达项（open items 索引）匹配；本期仍未匹配的行挂入索引供下期核销")
+    # 期间不预填：上传即对账，默认当月会把往期文件挂到错误期间
+    period = st.text_input("对账期间（YYYY-MM）", "", placeholder=date.today().strftime("%Y-%m"),
+                           disabled=not use_carry, help="结转前须填写本批文件所属期间").strip()
+    carry_on = use_carry and valid_period(period)
+    if use_carry and not carry_on:
+        st.warning("填写对账期间（YYYY-MM）后才结转未达项；此前不读写未达项索引。")
+    inv_rules = (rules or {}).get("invoice_no") or {}
+    canon_on = st.checkbox("发票号规范化（去分隔符 / 前缀）", value=bool(inv_rules.get("canonicalize", True)),
+                           help="如 INV-001、INV 001、INV/001 统一为 INV001 后再匹配")
+    separators = st.text_input("分隔符（逐字符）", inv_rules.get("separators", DEFAULT_SEPARATORS), disabled=not canon_on)
+    prefixes = st.text_input("去除前缀（逗号分隔，如 NO,№）", ",".join(inv_rules.get("prefixes", [])),
+                             disabled=not canon_on)
+    fuzzy_edits = st.selectbox("发票号容错（编辑距离）", [0, 1, 2], index=min(max(int(inv_rules.get("fuzzy_max_edits", 1)), 0), 2),
+                               format_func=lambda k: "关闭" if k == 0 else f"≤ {k} 处差异",
+                               help="精确匹配后剩余的单边行，在同一供应商+币种内按编辑距离配对（如 1NV001 ↔ INV001）")
+    fuzzy_amount = st.checkbox("容错配对须金额在容差内", value=bool(inv_rules.get("fuzzy_require_amount", True)),
+                               disabled=fuzzy_edits == 0)
+    csv_encoding = st.selectbox("CSV 编码", ["自动识别"] + ENCODINGS,
+                                help="cp932 = Shift_JIS（日文 ERP），gb18030 = GBK（中文 ERP）；自动识别按文件前 64KB 判断")
+    csv_encoding = None if csv_encoding == "自动识别" else csv_encoding
 
 # ---------- File uploaders ----------
+def side_sources(files, side):
+    """上传文件 → [(文件名, bytes, 工作表), ...]；Excel 按所选工作表展开（默认全部）。"""
+    sources = []
+    for i, f in enumerate(files):
+        data = f.getvalue()
+        if not is_excel(f.name):
+            st.caption(f"{f.name}：编码 {csv_encoding or detect_encoding(data)}（解析器 {CSV_ENGINE}）")
+        sheets = sheet_names(f.name, data)
+        if len(sheets) > 1:
+            sheets = st.multiselect(f"{f.name} 的工作表", sheets, default=sheets, key=f"sheets_{side}_{i}_{f.name}")
+        sources += [(f.name, data, sh) for sh in sheets]
+    return sources
+
 c1, c2 = st.columns(2)
 with c1:
-    f_inv = st.file_uploader("上传发票表（invoices：.xlsx/.xls/.csv）", type=["xlsx","xls","csv"], key="inv")
+    f_inv = st.file_uploader("上传发票表（invoices：.xlsx/.xls/.csv，可多选）", type=["xlsx","xls","csv"],
+                             key="inv", accept_multiple_files=True)
+    inv_sources = side_sources(f_inv or [], "inv")
 with c2:
-    f_bill = st.file_uploader("上传账单表（bills：.xlsx/.xls/.csv）", type=["xlsx","xls","csv"], key="bill")
+    f_bill = st.file_uploader("上传账单表（bills：.xlsx/.xls/.csv，可多选）", type=["xlsx","xls","csv"],
+                              key="bill", accept_multiple_files=True)
+    bill_sources = side_sources(f_bill or [], "bill")
 
-# ---------- Parser ----------
-def read_any(file):
-    name = file.name.lower()
-    if name.endswith(".csv"):
-        return pd.read_csv(file)
-    else:
-        return pd.read_excel(file)
+def session_id() -> str:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
 
 # ---------- Column mapping UI ----------
-def guess_columns(df):
-    cols_lower = {c.lower(): c for c in df.columns}
+def guess_columns(columns):
+    cols_lower = {str(c).lower(): c for c in columns}
     def get(*cands):
         for c in cands:
             if c in cols_lower:
@@ -143,127 +213,192 @@ def guess_columns(df):
     curr   = get("currency","币种","curr","iso","ccy")
     return vendor, invno, amt, curr
 
-def normalize_df(df, mapping):
-    vendor, invno, amt, curr = mapping
-    # 复制一份，避免修改原 DataFrame
-    df = df.copy()
-    # 转换基础列
-    df[vendor] = df[vendor].astype(str).str.strip().str.upper()
-    df[invno]  = df[invno].astype(str).str.strip().str.upper()
-    df[curr]   = df[curr].astype(str).str.strip().str.upper()
-    df[amt]    = pd.to_numeric(df[amt], errors="coerce").fillna(0.0)
-    # 统一列名
-    df = df.rename(columns={vendor:"vendor", invno:"invoice_no", amt:"amount", curr:"currency"})
-    return df[["vendor","invoice_no","amount","currency"]]
-
-def aggregate_duplicates(df):
-    # 记录重复（用于报告）
-    dup_mask = df.duplicated(subset=["vendor","invoice_no","currency"], keep=False)
-    dups = df.loc[dup_mask].sort_values(["vendor","invoice_no","currency"])
-    # 聚合
-    agg = df.groupby(["vendor","invoice_no","currency"], as_index=False)["amount"].sum()
-    return agg, dups
-
-def reconcile(inv_df, bill_df, abs_thr=0.0, pct_thr=0.0):
-    # 外连接对账
-    merged = inv_df.merge(bill_df, on=["vendor","invoice_no","currency"], how="outer", suffixes=("_inv","_bill"))
-    merged["amount_inv"] = merged["amount_inv"].fillna(0.0)
-    merged["amount_bill"] = merged["amount_bill"].fillna(0.0)
-
-    # 计算差异与阈值（绝对值 或 百分比，取更宽松的一方作为容忍）
-    base = merged[["amount_inv","amount_bill"]].abs().max(axis=1)
-    tol = np.maximum(abs_thr, base * pct_thr)
-    merged["diff"] = merged["amount_inv"] - merged["amount_bill"]
-    merged["within_tolerance"] = merged["diff"].abs() <= tol
-
-    # 分类
-    cond_missing_inv  = (merged["amount_inv"]  == 0.0) & (merged["amount_bill"] != 0.0)
-    cond_missing_bill = (merged["amount_bill"] == 0.0) & (merged["amount_inv"]  != 0.0)
-    cond_mismatch     = (~cond_missing_inv) & (~cond_missing_bill) & (~merged["within_tolerance"])
-
-    matched  = merged[(~cond_missing_inv) & (~cond_missing_bill) & (merged["within_tolerance"])].copy()
-    missing_in_invoices = merged[cond_missing_inv].copy()
-    missing_in_bills    = merged[cond_missing_bill].copy()
-    mismatches          = merged[cond_mismatch].copy()
-
-    return merged, matched, mismatches, missing_in_invoices, missing_in_bills
-
 # ---------- Main logic ----------
-if f_inv is not None and f_bill is not None:
-    inv_raw = read_any(f_inv)
-    bill_raw = read_any(f_bill)
+if inv_sources and bill_sources:
+    # 列映射只需表头（多来源取并集）；原始整表不在页面中常驻
+    try:
+        inv_cols = source_columns(inv_sources, csv_encoding)
+        bill_cols = source_columns(bill_sources, csv_encoding)
+        if show_raw:
+            inv_head = read_source(*inv_sources[0], nrows=100, encoding=csv_encoding)
+            bill_head = read_source(*bill_sources[0], nrows=100, encoding=csv_encoding)
+    except ValueError as e:      # 如手动指定的 CSV 编码与文件不符
+        st.error(f"读取失败：{e}")
+        _timer.done()
+        st.stop()
 
     # 显示原始数据
     if show_raw:
         st.subheader("原始数据预览")
-        st.write("发票表（前100行）：")
-        st.dataframe(inv_raw.head(100), use_container_width=True, height=240)
-        st.write("账单表（前100行）：")
-        st.dataframe(bill_raw.head(100), use_container_width=True, height=240)
+        st.write(f"发票表（{inv_sources[0][0]} {inv_sources[0][2] or ''}，前100行）：")
+        st.dataframe(inv_head, use_container_width=True, height=240)
+        st.write(f"账单表（{bill_sources[0][0]} {bill_sources[0][2] or ''}，前100行）：")
+        st.dataframe(bill_head, use_container_width=True, height=240)
 
     # 猜列名 + UI 映射
-    inv_guess = guess_columns(inv_raw)
-    bill_guess = guess_columns(bill_raw)
+    inv_guess = guess_columns(inv_cols)
+    bill_guess = guess_columns(bill_cols)
     st.subheader("列名映射")
     mcol1, mcol2 = st.columns(2)
 
     with mcol1:
         st.markdown("**发票表列映射**")
-        inv_vendor = st.selectbox("vendor(发票)", inv_raw.columns, index=inv_raw.columns.get_loc(inv_guess[0]) if inv_guess[0] in inv_raw.columns else 0)
-        inv_invno  = st.selectbox("invoice_no(发票)", inv_raw.columns, index=inv_raw.columns.get_loc(inv_guess[1]) if inv_guess[1] in inv_raw.columns else 0)
-        inv_amt    = st.selectbox("amount(发票)", inv_raw.columns, index=inv_raw.columns.get_loc(inv_guess[2]) if inv_guess[2] in inv_raw.columns else 0)
-        inv_curr   = st.selectbox("currency(发票)", inv_raw.columns, index=inv_raw.columns.get_loc(inv_guess[3]) if inv_guess[3] in inv_raw.columns else 0)
+        inv_vendor = st.selectbox("vendor(发票)", inv_cols, index=inv_cols.get_loc(inv_guess[0]) if inv_guess[0] in inv_cols else 0)
+        inv_invno  = st.selectbox("invoice_no(发票)", inv_cols, index=inv_cols.get_loc(inv_guess[1]) if inv_guess[1] in inv_cols else 0)
+        inv_amt    = st.selectbox("amount(发票)", inv_cols, index=inv_cols.get_loc(inv_guess[2]) if inv_guess[2] in inv_cols else 0)
+        inv_curr   = st.selectbox("currency(发票)", inv_cols, index=inv_cols.get_loc(inv_guess[3]) if inv_guess[3] in inv_cols else 0)
 
     with mcol2:
         st.markdown("**账单表列映射**")
-        bill_vendor = st.selectbox("vendor(账单)", bill_raw.columns, index=bill_raw.columns.get_loc(bill_guess[0]) if bill_guess[0] in bill_raw.columns else 0)
-        bill_invno  = st.selectbox("invoice_no(账单)", bill_raw.columns, index=bill_raw.columns.get_loc(bill_guess[1]) if bill_guess[1] in bill_raw.columns else 0)
-        bill_amt    = st.selectbox("amount(账单)", bill_raw.columns, index=bill_raw.columns.get_loc(bill_guess[2]) if bill_guess[2] in bill_raw.columns else 0)
-        bill_curr   = st.selectbox("currency(账单)", bill_raw.columns, index=bill_raw.columns.get_loc(bill_guess[3]) if bill_guess[3] in bill_raw.columns else 0)
-
-    # 规范化
-    inv_df = normalize_df(inv_raw, (inv_vendor, inv_invno, inv_amt, inv_curr))
-    bill_df = normalize_df(bill_raw, (bill_vendor, bill_invno, bill_amt, bill_curr))
-
-    if normalize_currency:
-        inv_df["currency"]  = inv_df["currency"].str.upper()
-        bill_df["currency"] = bill_df["currency"].str.upper()
-
-    # 合并重复
-    inv_dups = pd.DataFrame()
-    bill_dups = pd.DataFrame()
-    if group_duplicates:
-        inv_df, inv_dups = aggregate_duplicates(inv_df)
-        bill_df, bill_dups = aggregate_duplicates(bill_df)
-
-    # 对账
-    merged, matched, mismatches, missing_in_invoices, missing_in_bills = reconcile(inv_df, bill_df, abs_thr=abs_thr, pct_thr=pct_thr)
+        bill_vendor = st.selectbox("vendor(账单)", bill_cols, index=bill_cols.get_loc(bill_guess[0]) if bill_guess[0] in bill_cols else 0)
+        bill_invno  = st.selectbox("invoice_no(账单)", bill_cols, index=bill_cols.get_loc(bill_guess[1]) if bill_guess[1] in bill_cols else 0)
+        bill_amt    = st.selectbox("amount(账单)", bill_cols, index=bill_cols.get_loc(bill_guess[2]) if bill_guess[2] in bill_cols else 0)
+        bill_curr   = st.selectbox("currency(账单)", bill_cols, index=bill_cols.get_loc(bill_guess[3]) if bill_guess[3] in bill_cols else 0)
+    inv_map = (inv_vendor, inv_invno, inv_amt, inv_curr)
+    bill_map = (bill_vendor, bill_invno, bill_amt, bill_curr)
+
+    # 省内存模式（服务器以 RECON_MEMORY_MODE 统一开启）：输入（文件内容 + 映射 + 参数）不变时，
+    # 直接复用会话数据仓中的结果
+    memory_mode = session_store.ENABLED
+    sid = session_id()
+    input_key = hashlib.sha1(repr((
+        [(name, hashlib.sha1(data).hexdigest(), sheet) for name, data, sheet in inv_sources + bill_sources],
+        len(inv_sources), inv_map, bill_map, normalize_currency, group_duplicates, abs_thr, pct_thr,
+        csv_encoding, canon_on and (separators, prefixes), fuzzy_edits, fuzzy_amount,
+        AMOUNT_DECIMALS)).encode()).hexdigest()
+    recon_key = hashlib.sha1(repr((input_key, carry_on and period)).encode()).hexdigest()
+    reuse = memory_mode and st.session_state.get("recon_key") == recon_key
+    if reuse:
+        stored = {name: session_store.get(sid, name) for name in ("merged", "inv_dups", "bill_dups", "carried", "fuzzy")}
+        reuse = all(v is not None for v in stored.values())
+
+    if reuse:
+        # 数据仓中的表视为只读：下方仅按索引取行、生成展示/导出用的新表
+        merged, inv_dups, bill_dups, carried, fuzzy = (stored[n] for n in ("merged", "inv_dups", "bill_dups", "carried", "fuzzy"))
+        parts = outcome_index(merged)
+        st.caption("输入未变化，已复用本会话的对账结果（未重复计算、未重复写入历史库）")
+    else:
+        # 读取 + 规范化：各来源并行解析、只读映射列（键列按文本读），拼接后即规范化释放
+        invoice_canon = (separators, prefixes.split(",")) if canon_on else None
+        try:
+            inv_raw = ingest(inv_sources, inv_map, text_cols=inv_map[:2] + inv_map[3:], encoding=csv_encoding)
+            bill_raw = ingest(bill_sources, bill_map, text_cols=bill_map[:2] + bill_map[3:], encoding=csv_encoding)
+        except ValueError as e:
+            st.error(f"读取失败：{e}")
+            _timer.done()
+            st.stop()
+        inv_df = normalize_df(inv_raw, inv_map, invoice_canon, AMOUNT_SCALE)
+        bill_df = normalize_df(bill_raw, bill_map, invoice_canon, AMOUNT_SCALE)
+        del inv_raw, bill_raw
+
+        if normalize_currency:
+            inv_df["currency"]  = inv_df["currency"].str.upper()
+            bill_df["currency"] = bill_df["currency"].str.upper()
+
+        # 合并重复
+        inv_dups = pd.DataFrame(columns=NORM_COLS)
+        bill_dups = pd.DataFrame(columns=NORM_COLS)
+        if group_duplicates:
+            inv_df, inv_dups = aggregate_duplicates(inv_df)
+            bill_df, bill_dups = aggregate_duplicates(bill_df)
+
+        # 对账
+        merged, parts = reconcile(inv_df, bill_df, abs_thr=abs_thr, pct_thr=pct_thr, scale=AMOUNT_SCALE)
+        del inv_df, bill_df
+
+        # 发票号容错：精确匹配剩下的单边行按编辑距离配对（对称删除索引，候选查找与键数无关）
+        fuzzy = pd.DataFrame()
+        if fuzzy_edits:
+            merged, fuzzy_idx = fuzzy_match(merged, parts, fuzzy_edits, abs_thr=abs_thr, pct_thr=pct_thr,
+                                            require_amount=fuzzy_amount, scale=AMOUNT_SCALE)
+            if len(fuzzy_idx):
+                fuzzy = merged.loc[fuzzy_idx, ["vendor", "currency", "invoice_no", "fuzzy_from", "edit_distance",
+                                               "amount_inv", "amount_bill", "diff", "status"]]
+                parts = outcome_index(merged)
+
+        # 跨期结转：往期未达项与本期单边行配对，回填合并表并重新归类（历史库金额为常规单位）
+        # 同一输入（recon_key）只结转一次：点选其它控件引起的重跑不再改写 open_items
+        # 同一批文件改了期间（如先按错误期间结转）：先撤回上次按旧期间写入的结转
+        carried = pd.DataFrame()
+        if carry_on:
+            if st.session_state.get("carry_key") == recon_key:
+                carried = st.session_state["carried"]
+            else:
+                posted = st.session_state.get("carry_posted")
+                # 未达项索引按匹配键登记（跨期也按规范化后的发票号核销），展示时换回原发票号
+                with closing(history_connect()) as con:
+                    if posted and posted[0] == input_key and posted[1] != period:
+                        undo_carry(con, posted[1], posted[2])
+                    carried, _, _ = carry_forward(
+                        con, period, to_major(merged.loc[parts["Missing_Invoice"]]).assign(invoice_no=lambda d: d["match_key"]),
+                        to_major(merged.loc[parts["Missing_Bill"]]).assign(invoice_no=lambda d: d["match_key"]),
+                        abs_thr=abs_thr, pct_thr=pct_thr,
+                        vendors=merged["vendor"].unique())
+                carried["invoice_no"] = merged.loc[carried.index, "invoice_no"]
+                st.session_state["carry_key"], st.session_state["carried"] = recon_key, carried
+                st.session_state["carry_posted"] = (input_key, period, merged["vendor"].unique().tolist())
+            if not carried.empty:
+                for c in ["amount_inv", "amount_bill", "diff"]:
+                    merged.loc[carried.index, c] = to_minor(carried[c])
+                merged.loc[carried.index, "within_tolerance"] = carried["within_tolerance"]
+                merged.loc[carried.index, "status"] = np.where(carried["within_tolerance"], "Matched", "Mismatch")
+                merged["carried_from"] = carried["carried_from"]
+                parts = outcome_index(merged)
+
+        # 写入历史库
+        if save_history:
+            if st.session_state.get("saved_run", (None,))[0] == recon_key:
+                _, run_id, created = st.session_state["saved_run"]
+            else:
+                with closing(history_connect()) as con:
+                    run_id, created = save_run(con, to_major(merged), abs_thr=abs_thr, pct_thr=pct_thr)
+                st.session_state["saved_run"] = (recon_key, run_id, created)
+            st.caption(f"已写入历史库：批次 #{run_id}" if created else f"历史库中已有相同结果（批次 #{run_id}），未重复保存")
+
+        if memory_mode:
+            for name, obj in (("merged", merged), ("inv_dups", inv_dups), ("bill_dups", bill_dups),
+                              ("carried", carried), ("fuzzy", fuzzy)):
+                session_store.put(sid, name, obj)
+            st.session_state["recon_key"] = recon_key
+
+    def outcome(name):
+        """结果分区（常规金额单位），仅在展示/导出时按索引取行。"""
+        return to_major(merged.loc[parts[name]])
 
     # 指标卡
     st.subheader("结果概览")
     k1, k2, k3, k4, k5 = st.columns(5)
     k1.metric("总条数", len(merged))
-    k2.metric("匹配条数", len(matched))
-    k3.metric("差异条数", len(mismatches))
-    k4.metric("发票缺失", len(missing_in_invoices))
-    k5.metric("账单缺失", len(missing_in_bills))
+    k2.metric("匹配条数", len(parts["Matched"]))
+    k3.metric("差异条数", len(parts["Mismatch"]))
+    k4.metric("发票缺失", len(parts["Missing_Invoice"]))
+    k5.metric("账单缺失", len(parts["Missing_Bill"]))
+
+    if not fuzzy.empty:
+        with st.expander(f"发票号容错配对（{len(fuzzy)} 条，fuzzy_from 为账单侧原发票号）"):
+            st.dataframe(to_major(fuzzy), use_container_width=True, height=200)
+
+    if not carried.empty:
+        with st.expander(f"跨期结转配对（{len(carried)} 条，对方金额来自往期未达项）"):
+            st.dataframe(carried, use_container_width=True, height=200)
 
     # 展示表格
     st.markdown("### 差异明细（超出阈值）")
+    mismatches = outcome("Mismatch")
     st.dataframe(mismatches, use_container_width=True, height=260)
 
     st.markdown("### 发票缺失（账单有、发票无）")
-    st.dataframe(missing_in_invoices, use_container_width=True, height=200)
+    st.dataframe(outcome("Missing_Invoice"), use_container_width=True, height=200)
 
     st.markdown("### 账单缺失（发票有、账单无）")
-    st.dataframe(missing_in_bills, use_container_width=True, height=200)
+    st.dataframe(outcome("Missing_Bill"), use_container_width=True, height=200)
 
     if group_duplicates:
         with st.expander("重复记录（入账或发票重复）"):
             st.write("发票重复（聚合前）")
-            st.dataframe(inv_dups, use_container_width=True, height=180)
+            st.dataframe(to_major(inv_dups), use_container_width=True, height=180)
             st.write("账单重复（聚合前）")
-            st.dataframe(bill_dups, use_container_width=True, height=180)
+            st.dataframe(to_major(bill_dups), use_container_width=True, height=180)
 
     # 导出
     st.subheader("下载结果")
@@ -272,13 +407,13 @@ if f_inv is not None and f_bill is not None:
 
     # 多表 Excel 导出
     export_bytes = df_to_excel_bytes({
-        "00_Merged": merged,
-        "01_Matched": matched,
+        "00_Merged": to_major(merged),
+        "01_Matched": outcome("Matched"),
         "02_Mismatches": mismatches,
-        "03_Missing_Invoices": missing_in_invoices,
-        "04_Missing_Bills": missing_in_bills,
-        "98_Dups_Invoices": inv_dups if not inv_dups.empty else pd.DataFrame(columns=inv_df.columns),
-        "99_Dups_Bills": bill_dups if not bill_dups.empty else pd.DataFrame(columns=bill_df.columns)
+        "03_Missing_Invoices": outcome("Missing_Invoice"),
+        "04_Missing_Bills": outcome("Missing_Bill"),
+        "98_Dups_Invoices": to_major(inv_dups),
+        "99_Dups_Bills": to_major(bill_dups)
     })
     st.download_button(
         "下载对账结果包（Excel，多Sheet）",
@@ -286,5 +421,13 @@ if f_inv is not None and f_bill is not None:
         file_name="reconciliation_results.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
+
+    if memory_mode:
+        resident, spilled = session_store.session_usage(sid)
+        st.sidebar.caption(f"本会话结果常驻 {resident / session_store.MB:.1f} MB，已落盘 {spilled / session_store.MB:.1f} MB；"
+                           f"全进程常驻 {session_store.total_resident() / session_store.MB:.0f} / "
+                           f"{session_store.MEMORY_BUDGET / session_store.MB:.0f} MB")
 else:
-    st.info("请在上方上传发票表与账单表（可先下载示例文件体验）", icon="📄")
+    st.info("请在上方上传发票表与账单表（可先下载示例文件体验；每侧可多个文件、多个工作表）", icon="📄")
+
+_timer.done()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+重复发票检测（供“财务仪表板”页面调用）。
+
+按 (供应商, 金额, 发票日期) 排序后，同一 (供应商, 金额) 组内用 searchsorted 找出
+每张发票在 window 天内的后继发票，只生成窗口内的候选对，避免两两比较。
+仅依赖 numpy 与 pandas。
+"""
+import numpy as np
+import pandas as pd
+
+DUP_COLS = ["InvoiceID", "VendorCode", "InvoiceDate", "Amount", "PaidAmount"]
+
+def _canon_invoice_id(s: pd.Series) -> pd.Series:
+    return s.astype(str).str.upper().str.replace(r"[^0-9A-Z]", "", regex=True)
+
+def detect_duplicate_invoices(df: pd.DataFrame, window_days: int) -> pd.DataFrame:
+    d = df.loc[df["InvoiceDate"].notna(), DUP_COLS + (["VendorName"] if "VendorName" in df.columns else [])]
+    cents = np.round(pd.to_numeric(d["Amount"], errors="coerce").to_numpy(dtype=float) * 100)
+    d, cents = d[~np.isnan(cents)].reset_index(drop=True), cents[~np.isnan(cents)].astype(np.int64)
+    if d.empty:
+        return pd.DataFrame()
+    day = pd.to_datetime(d["InvoiceDate"]).to_numpy(dtype="datetime64[D]").astype(np.int64)
+    vend = pd.factorize(d["VendorCode"])[0]
+
+    order = np.lexsort((day, cents, vend))
+    v, a, t = vend[order], cents[order], day[order] - day.min()
+    gid = np.cumsum(np.r_[True, (v[1:] != v[:-1]) | (a[1:] != a[:-1])])
+    key = gid * (int(t.max()) + window_days + 1) + t
+    # 每个位置在窗口内的后继数量 → 展开为候选对 (left, right)
+    n = np.searchsorted(key, key + window_days, side="right") - np.arange(len(key)) - 1
+    left = np.repeat(np.arange(len(key)), n)
+    right = left + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + 1
+    i, j = order[left], order[right]
+
+    a_, b_ = d.iloc[i].reset_index(drop=True), d.iloc[j].reset_index(drop=True)
+    same_id = a_["InvoiceID"].astype(str).to_numpy() == b_["InvoiceID"].astype(str).to_numpy()
+    near_id = _canon_invoice_id(a_["InvoiceID"]).to_numpy() == _canon_invoice_id(b_["InvoiceID"]).to_numpy()
+    paid_a = pd.to_numeric(a_["PaidAmount"], errors="coerce").fillna(0).to_numpy()
+    paid_b = pd.to_numeric(b_["PaidAmount"], errors="coerce").fillna(0).to_numpy()
+    out = pd.DataFrame({
+        "VendorCode": a_["VendorCode"],
+        "VendorName": a_.get("VendorName"),
+        "Amount": a_["Amount"],
+        "InvoiceID_1": a_["InvoiceID"], "InvoiceDate_1": a_["InvoiceDate"], "PaidAmount_1": paid_a,
+        "InvoiceID_2": b_["InvoiceID"], "InvoiceDate_2": b_["InvoiceDate"], "PaidAmount_2": paid_b,
+        "DaysApart": t[right] - t[left],
+        "MatchType": np.select([same_id, near_id], ["完全重复（发票号相同）", "发票号近似（去分隔符后相同）"],
+                               default="同供应商同金额（发票号不同）"),
+        "BothPaid": (paid_a > 0) & (paid_b > 0),
+    })
+    return out.sort_values(["BothPaid", "Amount"], ascending=[False, False], ignore_index=True)
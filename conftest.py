@@ -0,0 +1 @@
+# pytest 以本文件所在目录（仓库根）为导入根：tests/ 可直接 import 根目录下的辅助模块
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+近似去重计数（供“数据质量与数据字典”页面调用）：精确 → HyperLogLog。
+
+不同值数量先用 64 位哈希的有序集合精确统计；超过 EXACT_DISTINCT_LIMIT 后
+切换为 2^HLL_P 个寄存器的 HyperLogLog（标准误差约 1.04/sqrt(2^p) ≈ 0.8%）。仅依赖 numpy 与 pandas。
+"""
+import numpy as np
+import pandas as pd
+
+HLL_P = 14
+EXACT_DISTINCT_LIMIT = 100_000
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    n = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        hit = x >= (np.uint64(1) << np.uint64(shift))
+        n += hit * shift
+        x = np.where(hit, x >> np.uint64(shift), x)
+    return n + (x > 0)
+
+def hash_values(values: np.ndarray) -> np.ndarray:
+    # 整数/浮点统一为 float64 后哈希，避免分块间 int→float 的类型漂移导致重复计数
+    if values.dtype.kind in "iuf":
+        values = values.astype(np.float64)
+    return pd.util.hash_array(values)
+
+def distinct_init() -> dict:
+    return {"hashes": np.empty(0, dtype=np.uint64), "registers": None}
+
+def _hll_add(registers: np.ndarray, h: np.ndarray, p: int = HLL_P):
+    idx = (h >> np.uint64(64 - p)).astype(np.int64)
+    rank = 64 - _bit_length(h << np.uint64(p)) + 1
+    np.maximum.at(registers, idx, np.minimum(rank, 64 - p + 1).astype(np.uint8))
+
+def hll_fold(registers: np.ndarray, p_to: int) -> np.ndarray:
+    """把 2^p 个寄存器折叠到更低精度 2^p_to（与直接以 p_to 计算的结果一致），用于压缩快照。"""
+    d = int(np.log2(len(registers))) - p_to
+    j = np.arange(len(registers), dtype=np.uint64)
+    low = j & np.uint64((1 << d) - 1)
+    # 被并入剩余哈希位的低 d 位索引：非零时 rank 由其前导零决定，否则在原 rank 上加 d
+    rank = np.where(low > 0, d - _bit_length(low) + 1, d + registers.astype(np.int64))
+    rank = np.where(registers > 0, np.minimum(rank, 64 - p_to + 1), 0)
+    out = np.zeros(1 << p_to, dtype=np.uint8)
+    np.maximum.at(out, (j >> np.uint64(d)).astype(np.int64), rank.astype(np.uint8))
+    return out
+
+def distinct_registers(state: dict, p: int) -> np.ndarray:
+    if state["registers"] is not None:
+        return hll_fold(state["registers"], p)
+    reg = np.zeros(1 << p, dtype=np.uint8)
+    _hll_add(reg, state["hashes"], p)
+    return reg
+
+def distinct_add(state: dict, values: np.ndarray):
+    h = hash_values(values)
+    if state["registers"] is None:
+        state["hashes"] = np.union1d(state["hashes"], h)
+        if len(state["hashes"]) > EXACT_DISTINCT_LIMIT:
+            state["registers"] = np.zeros(1 << HLL_P, dtype=np.uint8)
+            _hll_add(state["registers"], state["hashes"])
+            state["hashes"] = np.empty(0, dtype=np.uint64)
+    else:
+        _hll_add(state["registers"], h)
+
+def distinct_count(state: dict) -> int:
+    reg = state["registers"]
+    if reg is None:
+        return len(state["hashes"])
+    return hll_estimate(reg)
+
+def hll_estimate(reg: np.ndarray) -> int:
+    m = float(len(reg))
+    est = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -reg.astype(np.int64)))
+    zeros = int((reg == 0).sum())
+    if est <= 2.5 * m and zeros:
+        est = m * np.log(m / zeros)   # 小基数修正（线性计数）
+    return int(round(est))
+
+def hll_overlap(a: np.ndarray, b: np.ndarray) -> tuple[int, int]:
+    """两组同精度寄存器 → (并集基数, 交集基数)。并集即逐位取最大值；交集按容斥 |A|+|B|-|A∪B| 估计，下限截为 0。"""
+    union = hll_estimate(np.maximum(a, b))
+    return union, max(hll_estimate(a) + hll_estimate(b) - union, 0)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+发票号规范化与容错匹配（供“对账自动化 Demo”页面调用）。
+规范化：去掉可配置的分隔符，再去掉一个可配置的前缀（"INV-001" / "INV001" → 同一键）。
+容错匹配：对精确匹配后剩下的单边键，按对称删除（symmetric deletion）建索引——
+每个键只登记其删去 ≤ k 个字符后的变体，查询时用同样的变体查表，候选数与总键数无关；
+候选再以编辑距离（含相邻换位）复核。仅依赖标准库与 pandas。
+"""
+import re
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+DEFAULT_SEPARATORS = "-_/. "
+FUZZY_MIN_LEN = 5                # 过短的键（如 "12" / "13"）容错匹配几乎必然误配，不参与
+
+def canonical_invoice(s: pd.Series, separators: str = DEFAULT_SEPARATORS, prefixes=()) -> pd.Series:
+    """已去空格、大写的发票号 → 规范键。前缀按最长优先只去一个，且去掉后须仍有内容。"""
+    if separators:
+        s = s.str.replace(f"[{re.escape(separators)}]", "", regex=True)
+    prefixes = sorted({p.strip().upper() for p in prefixes if p.strip()}, key=len, reverse=True)
+    if prefixes:
+        s = s.str.replace(f"^(?:{'|'.join(map(re.escape, prefixes))})(?=.)", "", regex=True)
+    return s
+
+def _deletes(key: str, k: int) -> set:
+    """删去 0..k 个字符得到的全部变体。"""
+    out = frontier = {key}
+    for _ in range(k):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out = out | frontier
+    return out
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """编辑距离（插入/删除/替换/相邻换位各计 1）；超过 limit 时返回 limit + 1（并提前结束）。"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # 去掉公共前后缀（录入错误通常只在一两处，剩下的比较量很小）
+    p = 0
+    while p < len(a) and p < len(b) and a[p] == b[p]:
+        p += 1
+    q = 0
+    while q < len(a) - p and q < len(b) - p and a[-1 - q] == b[-1 - q]:
+        q += 1
+    a, b = a[p:len(a) - q], b[p:len(b) - q]
+    if not a or not b:
+        return min(len(a) + len(b), limit + 1)
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return min(prev[-1], limit + 1)
+
+def fuzzy_pairs(left, right, max_edits: int = 1, accept=None, min_len: int = FUZZY_MIN_LEN) -> list:
+    """left / right: [(行标签, 分组, 键), ...]（分组如 (vendor, currency)，只在组内配对）
+    → [(左行标签, 右行标签, 编辑距离), ...]。
+
+    一对一配对：按距离从小到大，同一距离上左右双方都只有这一个候选时才配对，
+    有歧义（如 INV0010 同时接近 INV0011 与 INV0012）的一律不配、也不再在更大距离上配，留给人工。
+    accept(左行标签, 右行标签) 可再加业务条件（如金额在容差内）。
+    """
+    index = defaultdict(list)
+    keys = {}
+    for label, group, key in right:
+        if len(key) >= min_len:
+            keys[label] = key
+            for d in _deletes(key, max_edits):
+                index[(group, d)].append(label)
+    edges = []
+    for label, group, key in left:
+        if len(key) < min_len:
+            continue
+        cands = {r for d in _deletes(key, max_edits) for r in index.get((group, d), ())}
+        for r in cands:
+            dist = edit_distance(key, keys[r], max_edits)
+            if dist <= max_edits and (accept is None or accept(label, r)):
+                edges.append((dist, label, r))
+    # 某距离上出现过候选的行（无论配上还是有歧义）不再参与更大距离，歧义行不会被较远的候选“捡走”
+    blocked_l, blocked_r, pairs = set(), set(), []
+    for dist in range(max_edits + 1):
+        level = [(l, r) for d, l, r in edges if d == dist and l not in blocked_l and r not in blocked_r]
+        n_l, n_r = Counter(l for l, _ in level), Counter(r for _, r in level)
+        for l, r in level:
+            if n_l[l] == 1 and n_r[r] == 1:
+                pairs.append((l, r, dist))
+        blocked_l.update(n_l)
+        blocked_r.update(n_r)
+    return pairs
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+日文邮件批量差し込み（供“日文邮件模板集”页面调用）：读取对账差异 / 应付明细，按供应商分组渲染邮件，
+打包 .eml zip 或经 SMTP 分批发送。放在独立模块中便于复用与测试。
+仅依赖：pandas 与标准库（pandas 在用到时才导入，页面首开不加载）。
+"""
+import functools
+import io
+import smtplib
+import string
+import zipfile
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+UNKNOWN_VENDOR = "UNKNOWN"
+
+# 件名・本文・明細行（{lines} に明細行を連結して差し込む）
+BULK_TEMPLATES = {
+    "金額差異のご確認": (
+        "【金額差異のご確認】{myco}より（{n}件）",
+        """{vendor} {person}
+いつもお世話になっております。
+下記請求書につきまして、弊方記録との金額差異が確認されました（{n}件）。
+{lines}
+正しい金額または修正後の請求書／対帳表をご共有ください。
+よろしくお願いいたします。
+{myco}  {myper}
+{today}""",
+        "・{invoice_no}：弊方 {amount_inv} ／ 貴方 {amount_bill}（差額 {diff} {currency}）",
+    ),
+    "支払期日ご案内（柔らかめ）": (
+        "【支払期日のご案内】{myco}より（{n}件）",
+        """{vendor} {person}
+平素より大変お世話になっております。
+下記請求書につきまして、支払期日が近づいている、または超過しております（{n}件）。
+{lines}
+お手数ですが、お支払予定または不足資料の有無をご教示いただけますと幸いです。
+何卒よろしくお願い申し上げます。
+{myco}  {myper}
+{today}""",
+        "・{invoice_no}：{amount} {currency}　支払期日 {due}（{status}）",
+    ),
+}
+
+@functools.lru_cache(maxsize=None)
+def compile_template(text: str) -> tuple:
+    """テンプレートを (リテラル, フィールド名) の列に一度だけ分解する。"""
+    return tuple((lit, field) for lit, field, _, _ in string.Formatter().parse(text))
+
+def render(parts: tuple, ctx: dict) -> str:
+    return "".join(lit + (str(ctx[field]) if field is not None else "") for lit, field in parts)
+
+def _amt(x) -> str:
+    return f"{x:,.2f}" if x == x else "-"          # NaN 不等于自身
+
+def _vendor_text(s: "pd.Series") -> "pd.Series":
+    """供应商列 → 文本；缺失记为 UNKNOWN（先填再转，否则 astype(str) 得到 "nan" 并成为收件方）。"""
+    return s.fillna(UNKNOWN_VENDOR).astype(str)
+
+def mismatch_rows(file) -> "pd.DataFrame":
+    """对账结果包 02_Mismatches → vendor + 明細行フィールド"""
+    import pandas as pd
+    df = pd.read_excel(file, sheet_name="02_Mismatches")
+    out = pd.DataFrame({"vendor": _vendor_text(df["vendor"]), "invoice_no": df["invoice_no"].astype(str),
+                        "currency": df.get("currency", pd.Series("", index=df.index)).fillna("")})
+    for c in ["amount_inv", "amount_bill", "diff"]:
+        out[c] = pd.to_numeric(df[c], errors="coerce").map(_amt)
+    return out
+
+AGING_REQUIRED = ["InvoiceID", "VendorCode", "DueDate", "Amount"]
+
+def aging_rows(file, asof, within_days: int, ccy: str) -> "pd.DataFrame":
+    """应付明细（InvoiceID, VendorCode, DueDate, Amount[, PaidAmount, VendorName, Currency]）
+    → 未清且已逾期或 within_days 天内到期的行；缺少必需列时抛 ValueError。无 Currency 列时用 ccy。"""
+    import pandas as pd
+    asof = pd.Timestamp(asof)
+    df = pd.read_csv(file)
+    missing = [c for c in AGING_REQUIRED if c not in df.columns]
+    if missing:
+        raise ValueError(f"应付明细缺少必需列：{', '.join(missing)}")
+    df["DueDate"] = pd.to_datetime(df["DueDate"], errors="coerce")
+    paid = df["PaidAmount"] if "PaidAmount" in df.columns else pd.Series(0, index=df.index)
+    outstanding = (pd.to_numeric(df["Amount"], errors="coerce").fillna(0)
+                   - pd.to_numeric(paid, errors="coerce").fillna(0))
+    days = (asof - df["DueDate"]).dt.days
+    keep = (outstanding > 0) & df["DueDate"].notna() & (days >= -within_days)
+    df, days, outstanding = df[keep], days[keep].astype(int), outstanding[keep]
+    vendor = df["VendorName"].fillna(df["VendorCode"]) if "VendorName" in df.columns else df["VendorCode"]
+    return pd.DataFrame({
+        "vendor": _vendor_text(vendor), "invoice_no": df["InvoiceID"].astype(str),
+        "amount": outstanding.map(_amt),
+        "currency": df["Currency"].fillna(ccy) if "Currency" in df.columns else ccy,
+        "due": df["DueDate"].dt.strftime("%Y/%m/%d"),
+        "status": [f"{d}日超過" if d > 0 else ("本日期日" if d == 0 else f"あと{-d}日") for d in days],
+    })
+
+def load_contacts(file) -> dict:
+    """联系人表（vendor 或 VendorCode / VendorName, email[, person]）→ {vendor: (email, person)}"""
+    if file is None:
+        return {}
+    import pandas as pd
+    df = pd.read_csv(file, dtype=str).fillna("")
+    key = next((c for c in ["vendor", "VendorName", "VendorCode"] if c in df.columns), None)
+    if key is None or "email" not in df.columns:
+        return {}
+    person = df["person"] if "person" in df.columns else pd.Series("ご担当者 様", index=df.index)
+    return dict(zip(df[key], zip(df["email"], person)))
+
+def build_messages(rows: "pd.DataFrame", scene: str, sender: str, contacts: dict, meta: dict) -> list:
+    """按供应商分组并渲染 → [(vendor, EmailMessage), ...]。模板只解析一次，逐组仅做拼接。"""
+    subj_t, body_t, line_t = (compile_template(t) for t in BULK_TEMPLATES[scene])
+    rows = rows.sort_values("vendor", kind="stable", ignore_index=True)
+    vendors = rows["vendor"].to_numpy()
+    starts = [0] + [i for i in range(1, len(vendors)) if vendors[i] != vendors[i - 1]] + [len(vendors)]
+    recs = rows.to_dict("records")
+    msgs = []
+    for a, b in zip(starts[:-1], starts[1:]):
+        vendor = vendors[a]
+        email, person = contacts.get(vendor, ("", "ご担当者 様"))
+        ctx = {**meta, "vendor": vendor, "person": person, "n": b - a,
+               "lines": "\n".join(render(line_t, r) for r in recs[a:b])}
+        msg = EmailMessage()
+        msg["Subject"] = render(subj_t, ctx)
+        msg["From"] = sender
+        msg["To"] = email
+        msg["Date"] = formatdate(localtime=True)
+        msg["Message-ID"] = make_msgid()
+        msg.set_content(render(body_t, ctx))
+        msgs.append((vendor, msg))
+    return msgs
+
+def eml_zip(msgs: list) -> bytes:
+    """逐封序列化写入 zip，不在内存中另存一份全部 .eml 文本。"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i, (vendor, msg) in enumerate(msgs, 1):
+            safe = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in vendor)
+            zf.writestr(f"{i:05d}_{safe}.eml", msg.as_bytes())
+    return buf.getvalue()
+
+def send_batched(msgs: list, host: str, port: int, batch_size: int = 100, user: str = "",
+                 password: str = "", starttls: bool = False, progress=None) -> tuple:
+    """分批发送：每批复用一个 SMTP 连接（省去逐封握手/认证），批间重连以避开单会话条数上限。"""
+    sendable = [(v, m) for v, m in msgs if m["To"]]
+    sent, failed = 0, []
+    for start in range(0, len(sendable), batch_size):
+        batch = sendable[start:start + batch_size]
+        try:
+            with smtplib.SMTP(host, port, timeout=30) as smtp:
+                if starttls:
+                    smtp.starttls()
+                if user:
+                    smtp.login(user, password)
+                for vendor, msg in batch:
+                    try:
+                        smtp.send_message(msg)
+                        sent += 1
+                    except smtplib.SMTPException as e:
+                        failed.append((vendor, msg["To"], str(e)))
+        except (OSError, smtplib.SMTPException) as e:
+            failed.extend((vendor, msg["To"], f"连接失败：{e}") for vendor, msg in batch)
+        if progress: progress(min(start + batch_size, len(sendable)) / len(sendable))
+    return sent, failed
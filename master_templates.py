@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+主数据模板 / 供应商对账确认函的可复用逻辑（供“主数据模板生成器”页面调用）。
+放在独立模块中，进程池子进程才能按模块名导入 worker 函数（页面脚本本身无法被子进程导入）。
+仅依赖：xlsxwriter、openpyxl、pandas 与标准库（均在用到时才导入，页面首开不加载）。
+"""
+import io
+import multiprocessing as mp
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# -------------------- 下拉项（ref 表） --------------------
+REGIONS = ["CN", "JP", "US", "EU"]
+CURRENCY = ["CNY", "JPY", "USD", "EUR"]
+PAY_TERMS = ["30", "45", "60", "90"]
+RESPONSES = ["确认无误", "金额不符", "未收到该发票", "已付款", "其他"]
+
+def write_ref_sheet(wb):
+    """写入 ref 表：A=区域、B=币种、C=付款条件、D=供应商回复选项。"""
+    ws = wb.add_worksheet("ref")
+    for col, items in enumerate((REGIONS, CURRENCY, PAY_TERMS, RESPONSES)):
+        ws.write_column(0, col, items)
+    return ws
+
+# -------------------- 模板 Sheet 定义 --------------------
+TEMPLATE_EXAMPLES = {            # Sheet → 示例行（列顺序即模板列顺序）
+    "vendors": {"vendor_code": "V0001", "vendor_name": "示例供应商", "region": "JP", "currency": "JPY",
+                "payment_term": "30", "bank_account": "XXXX-XXXX-XXXX", "swift": "ABCDEF12"},
+    "cost_centers": {"cc_code": "CC1001", "cc_name": "销售部", "dept": "Sales", "owner": "张三",
+                     "status": "Active"},
+    "items": {"item_code": "ITM-001", "item_name": "办公用品", "uom": "PCS", "category": "Office",
+              "status": "Active"},
+}
+TEMPLATE_COLUMNS = {sheet: list(ex) for sheet, ex in TEMPLATE_EXAMPLES.items()}
+TEMPLATE_KEYS = {"vendors": "vendor_code", "cost_centers": "cc_code", "items": "item_code"}
+TEMPLATE_REQUIRED = {"vendors": ["vendor_code", "vendor_name"], "cost_centers": ["cc_code", "cc_name"],
+                     "items": ["item_code", "item_name"]}
+KEY_PATTERNS = {"vendors": r"V\d{4,}", "cost_centers": r"CC\d{4,}", "items": r"ITM-\d{3,}"}
+REF_FIELDS = {"vendors": {"region": REGIONS, "currency": CURRENCY, "payment_term": PAY_TERMS}}
+ERROR_COLS = ["file", "sheet", "row", "key", "field", "value", "error"]
+
+# -------------------- 回收模板解析与校验 --------------------
+_KEY_RE = {sheet: re.compile(p) for sheet, p in KEY_PATTERNS.items()}
+_REF_SETS = {sheet: {f: set(v) for f, v in fields.items()} for sheet, fields in REF_FIELDS.items()}
+
+def _cell(v) -> str:
+    """单元格统一为去空格字符串；Excel 把 30 存成 30.0 时还原为 "30"。"""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
+def validate_record(sheet: str, rec: dict) -> list:
+    """单行校验 → [(field, value, error), ...]；空列表表示通过。"""
+    errs = [(f, "", "必填为空") for f in TEMPLATE_REQUIRED[sheet] if not rec[f]]
+    key = TEMPLATE_KEYS[sheet]
+    if rec[key] and not _KEY_RE[sheet].fullmatch(rec[key]):
+        errs.append((key, rec[key], f"编码格式不符（应为 {KEY_PATTERNS[sheet]}）"))
+    for f, allowed in _REF_SETS.get(sheet, {}).items():
+        if rec[f] not in allowed:
+            errs.append((f, rec[f], "不在 ref 下拉项中"))
+    return errs
+
+def parse_returned_template(name: str, data: bytes) -> tuple:
+    """解析一份回收的主数据模板 → ({sheet: [记录, ...]}, [错误, ...])。
+
+    openpyxl read_only 流式逐行读取（不加载整本样式/单元格对象）；
+    原样保留的示例行与空行跳过，未通过校验的行只进错误报告、不进合并主数据。
+    """
+    import openpyxl
+    records = {sheet: [] for sheet in TEMPLATE_COLUMNS}
+    errors = []
+    try:
+        wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except Exception as e:
+        return records, [(name, "", 0, "", "", "", f"无法读取：{e}")]
+    try:
+        for sheet, cols in TEMPLATE_COLUMNS.items():
+            if sheet not in wb.sheetnames:
+                continue
+            rows = wb[sheet].iter_rows(values_only=True)
+            header = [_cell(h) for h in next(rows, ())]
+            missing = [c for c in cols if c not in header]
+            if missing:
+                errors.append((name, sheet, 1, "", ",".join(missing), "", "缺少列"))
+                continue
+            pos = [header.index(c) for c in cols]
+            example = TEMPLATE_EXAMPLES[sheet]
+            key = TEMPLATE_KEYS[sheet]
+            for r, row in enumerate(rows, start=2):
+                rec = {c: _cell(row[i]) if i < len(row) else "" for c, i in zip(cols, pos)}
+                if rec == example or not any(rec.values()):
+                    continue
+                errs = validate_record(sheet, rec)
+                if errs:
+                    errors.extend((name, sheet, r, rec[key], f, v, msg) for f, v, msg in errs)
+                else:
+                    records[sheet].append({**rec, "_file": name, "_row": r})
+    finally:
+        wb.close()
+    return records, errors
+
+def _parse_batch(batch: list) -> list:
+    return [parse_returned_template(name, data) for name, data in batch]
+
+def ingest_templates(files: list, workers: int = 4, batch_size: int = 20, progress=None) -> tuple:
+    """files: [(文件名, bytes), ...]（按提交先后）→ ({sheet: [记录, ...]}, [错误, ...])。
+
+    各文件在进程池中并行解析+校验，按批提交摊薄进程间通信；结果按原文件顺序拼接，
+    以便合并时“后提交者覆盖先提交者”的语义稳定，与完成先后无关。
+    """
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    results = [None] * len(batches)
+    if workers <= 1 or len(batches) <= 1:
+        for n, b in enumerate(batches):
+            results[n] = _parse_batch(b)
+            if progress: progress((n + 1) / len(batches))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as ex:
+            futures = {ex.submit(_parse_batch, b): n for n, b in enumerate(batches)}
+            for done, f in enumerate(as_completed(futures), 1):
+                results[futures[f]] = f.result()
+                if progress: progress(done / len(batches))
+    records = {sheet: [] for sheet in TEMPLATE_COLUMNS}
+    errors = []
+    for res in results:
+        for recs, errs in res:
+            for sheet, rows in recs.items():
+                records[sheet].extend(rows)
+            errors.extend(errs)
+    return records, errors
+
+def merge_master(records: dict) -> tuple:
+    """跨提交去重 → ({sheet: 合并后的记录列表}, [冲突错误, ...])。
+
+    同一编码内容完全相同的重复静默合并；内容不同则采用最后提交的版本，
+    被覆盖的每条版本记一条“跨文件冲突”错误，便于回头找业务确认。
+    """
+    merged, conflicts = {}, []
+    for sheet, rows in records.items():
+        cols = TEMPLATE_COLUMNS[sheet]
+        key = TEMPLATE_KEYS[sheet]
+        latest = {}
+        for rec in rows:                     # 按提交顺序，后者覆盖前者
+            prev = latest.get(rec[key])
+            if prev is not None and any(prev[c] != rec[c] for c in cols):
+                diff = [c for c in cols if prev[c] != rec[c]]
+                conflicts.append((prev["_file"], sheet, prev["_row"], rec[key], ",".join(diff),
+                                  "", f"跨文件冲突，已采用 {rec['_file']} 第 {rec['_row']} 行"))
+            latest[rec[key]] = rec
+        merged[sheet] = [{c: rec[c] for c in cols} | {"source_file": rec["_file"]}
+                         for rec in latest.values()]
+    return merged, conflicts
+
+# -------------------- 供应商对账确认函 --------------------
+STATEMENT_SOURCES = {            # 对账结果 Sheet → 确认函中的“类型”
+    "02_Mismatches": "金额差异",
+    "03_Missing_Invoices": "我方未入账（账单有、发票无）",
+    "04_Missing_Bills": "贵方未列示（发票有、账单无）",
+}
+STATEMENT_COLS = ["type", "invoice_no", "currency", "amount_inv", "amount_bill", "diff"]
+STATEMENT_HEADER = ["类型", "发票号", "币种", "我方金额", "贵方金额", "差额",
+                    "贵方确认金额", "确认币种", "回复", "备注"]
+
+def statement_groups(file) -> list:
+    """对账结果包 → [(vendor, [(类型, 发票号, 币种, 我方金额, 贵方金额, 差额), ...]), ...]"""
+    import pandas as pd
+    sheets = pd.read_excel(file, sheet_name=None)
+    parts = [sheets[name].assign(type=kind) for name, kind in STATEMENT_SOURCES.items()
+             if name in sheets and "vendor" in sheets[name].columns]
+    if not parts:
+        return []
+    # 供应商缺失先记为 UNKNOWN 再转文本（否则 astype(str) 得到 "nan"）
+    df = (pd.concat(parts, ignore_index=True).reindex(columns=["vendor"] + STATEMENT_COLS)
+            .assign(vendor=lambda d: d["vendor"].fillna("UNKNOWN").astype(str))
+            .sort_values("vendor", kind="stable", ignore_index=True))
+    df = df.astype(object).where(df.notna(), None)   # 空值写为空单元格
+    # 排序后按供应商边界切分一次性转换的行元组，避免逐组 groupby
+    vendors = df["vendor"].to_numpy()
+    starts = [0] + [i for i in range(1, len(vendors)) if vendors[i] != vendors[i - 1]] + [len(vendors)]
+    rows = list(df[STATEMENT_COLS].itertuples(index=False, name=None))
+    return [(vendors[a], rows[a:b]) for a, b in zip(starts[:-1], starts[1:])]
+
+def build_vendor_statement(vendor: str, rows: list, meta: dict) -> bytes:
+    """生成单个供应商的确认函工作簿（constant_memory 逐行写出，内存与行数无关）。"""
+    import xlsxwriter
+    if vendor is None or vendor != vendor:   # 供应商缺失（None / NaN）
+        vendor = "UNKNOWN"
+    buf = io.BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+    bold = wb.add_format({"bold": True})
+    money = wb.add_format({"num_format": "#,##0.00"})
+    ws = wb.add_worksheet("confirmation")
+    ws.set_column(0, 0, 26)
+    ws.set_column(1, 9, 14)
+    ws.write_row(0, 0, ["对账确认函", meta.get("company", "")], bold)
+    ws.write_row(1, 0, ["供应商", vendor])
+    ws.write_row(2, 0, ["对账期间", meta.get("period", "")])
+    ws.write_row(3, 0, ["待确认条数", len(rows)])
+    ws.write_row(5, 0, STATEMENT_HEADER, bold)
+    first = 6
+    for i, (kind, invno, ccy, a_inv, a_bill, diff) in enumerate(rows):
+        r = first + i
+        ws.write_row(r, 0, [kind, invno, ccy])
+        ws.write_row(r, 3, [a_inv, a_bill, diff], money)
+    last = first + max(len(rows), 1) - 1
+    # 与主数据模板相同的 ref 下拉校验
+    ws.data_validation(first, 7, last, 7, {"validate": "list", "source": "=ref!$B$1:$B$100"})
+    ws.data_validation(first, 8, last, 8, {"validate": "list", "source": "=ref!$D$1:$D$100"})
+    write_ref_sheet(wb)
+    wb.close()
+    return buf.getvalue()
+
+def _build_batch(batch: list, meta: dict) -> list:
+    return [(vendor, build_vendor_statement(vendor, rows, meta)) for vendor, rows in batch]
+
+def _safe_name(s) -> str:
+    if s is None or s != s:              # None / NaN
+        return "UNKNOWN"
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", str(s)).strip("_") or "UNKNOWN"
+
+def bulk_statements_zip(groups: list, meta: dict, workers: int = 4, batch_size: int = 50,
+                        progress=None) -> bytes:
+    """groups: [(vendor, rows), ...] → 每个供应商一个 xlsx 的 zip。
+
+    工作簿在进程池中并行生成（按批提交以摊薄进程间通信），完成一批写入一批 zip，
+    父进程只持有 zip 本身与在途批次。xlsx 已是压缩格式，zip 内直接 STORED。
+    """
+    out = io.BytesIO()
+    batches = [groups[i:i + batch_size] for i in range(0, len(groups), batch_size)]
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as zf:
+        if workers <= 1 or len(batches) <= 1:
+            _write_zip(zf, (_build_batch(b, meta) for b in batches), len(batches), progress)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as ex:
+                futures = [ex.submit(_build_batch, b, meta) for b in batches]
+                _write_zip(zf, (f.result() for f in as_completed(futures)), len(batches), progress)
+    return out.getvalue()
+
+def _write_zip(zf: zipfile.ZipFile, results, total: int, progress=None):
+    used = set()
+    for n, res in enumerate(results, 1):
+        for vendor, data in res:
+            # 不同供应商可能净化成同名（如 "A/B" 与 "A B"）：追加序号保证 zip 内文件名唯一
+            base = name = _safe_name(vendor)
+            k = 1
+            while name.upper() in used:
+                k += 1
+                name = f"{base}_{k}"
+            used.add(name.upper())
+            zf.writestr(f"{name}_statement.xlsx", data)
+        if progress: progress(n / total)
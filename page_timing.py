@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+页面加载计时：页面脚本开头创建 PageTimer，末尾调用 done()。
+区分冷启动（本进程内首次运行该页，含 pandas/plotly 等重模块的导入）与热重跑，
+耗时写入日志（logger "recon.timing"）并显示在侧边栏；本进程内的最近记录保存在 TIMINGS。
+仅依赖标准库与 streamlit——须在重模块之前导入，导入耗时才会计入冷启动。
+"""
+import logging
+import time
+from collections import deque
+
+import streamlit as st
+
+TIMINGS = deque(maxlen=1000)      # (page, "cold" / "warm", ms)
+_seen = set()
+log = logging.getLogger("recon.timing")
+
+class PageTimer:
+    def __init__(self, page: str):
+        self.page = page
+        self.cold = page not in _seen
+        _seen.add(page)
+        self.t0 = time.perf_counter()
+
+    def done(self) -> float:
+        """记录本次脚本运行耗时（ms）并在侧边栏显示；在 st.stop() 之前也可调用。"""
+        ms = (time.perf_counter() - self.t0) * 1000
+        kind = "cold" if self.cold else "warm"
+        TIMINGS.append((self.page, kind, ms))
+        log.info("page=%s load=%s ms=%.1f", self.page, kind, ms)
+        warm = [t for p, k, t in TIMINGS if p == self.page and k == "warm"]
+        tail = f"；热重跑中位 {sorted(warm)[len(warm) // 2]:.0f} ms（{len(warm)} 次）" if warm else ""
+        st.sidebar.caption(f"⏱ 本页加载 {ms:.0f} ms（{'冷启动' if self.cold else '热重跑'}）{tail}")
+        return ms
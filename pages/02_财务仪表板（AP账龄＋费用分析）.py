@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
+from page_timing import PageTimer
+_timer = PageTimer("02_财务仪表板（AP账龄＋费用分析）")   # 先于重模块导入，冷启动计入导入耗时
+import hashlib
 import io
+import time
 import numpy as np
 import pandas as pd
-import plotly.express as px
 import streamlit as st
+from ap_duplicates import detect_duplicate_invoices
 
 st.set_page_config(page_title="财务仪表板（AP 账龄＋费用分析）", page_icon="📊", layout="wide")
 st.title("财务仪表板（AP 账龄＋费用分析）")
@@ -56,6 +60,12 @@ def to_excel_bytes(sheets: dict):
             df.to_excel(writer, index=False, sheet_name=name[:31] or "Sheet1")
     return buf.getvalue()
 
+@st.cache_data(show_spinner=False)
+def sample_csv(name: str) -> bytes:
+    """示例 CSV 为静态资源：每个进程只生成一次。"""
+    df = {"expenses": sample_expenses, "ap_invoices": sample_ap_invoices, "vendors": sample_vendors}[name]()
+    return df.to_csv(index=False).encode("utf-8-sig")
+
 # ------------------ 侧边栏：上传 / 下载示例 ------------------
 with st.sidebar:
     st.header("数据源")
@@ -65,47 +75,190 @@ with st.sidebar:
     st.markdown("---")
     c1, c2, c3 = st.columns(3)
     with c1:
-        st.download_button("示例-费用", data=sample_expenses().to_csv(index=False).encode("utf-8-sig"),
+        st.download_button("示例-费用", data=sample_csv("expenses"),
                            file_name="expenses.csv", mime="text/csv")
     with c2:
-        st.download_button("示例-应付", data=sample_ap_invoices().to_csv(index=False).encode("utf-8-sig"),
+        st.download_button("示例-应付", data=sample_csv("ap_invoices"),
                            file_name="ap_invoices.csv", mime="text/csv")
     with c3:
-        st.download_button("示例-供应商", data=sample_vendors().to_csv(index=False).encode("utf-8-sig"),
+        st.download_button("示例-供应商", data=sample_csv("vendors"),
                            file_name="vendors.csv", mime="text/csv")
 
 # ------------------ 读取数据（无上传则用示例） ------------------
-def read_csv_or_sample(uf, fallback_fn, parse_dates=None):
-    if uf is None:
-        return fallback_fn()
-    return pd.read_csv(uf, parse_dates=parse_dates)
+# 解析/规范化/派生字段按上传内容哈希缓存：控件交互触发的重跑直接命中缓存，
+# 只有内容发生变化的文件才会重新解析，未变化的维表/事实表不受影响。
+SAMPLE_KEY = "sample"
 
-expenses = read_csv_or_sample(exp_file, sample_expenses, parse_dates=["Date"])
-ap = read_csv_or_sample(ap_file, sample_ap_invoices, parse_dates=["InvoiceDate","DueDate"])
-vendors = read_csv_or_sample(ven_file, sample_vendors)
+def upload_key(uf):
+    if uf is None:
+        return SAMPLE_KEY, None
+    raw = uf.getvalue()
+    return hashlib.sha1(raw).hexdigest(), raw
 
-# 规范字段
-for df in (expenses, ap, vendors):
+def normalize_vendor_code(df):
     if "VendorCode" in df.columns:
         df["VendorCode"] = df["VendorCode"].astype(str).str.upper().str.strip()
+    return df
+
+@st.cache_data(show_spinner=False)
+def load_expenses(key, _raw):
+    df = sample_expenses() if _raw is None else pd.read_csv(io.BytesIO(_raw), parse_dates=["Date"])
+    return normalize_vendor_code(df)
+
+@st.cache_data(show_spinner=False)
+def load_ap(key, _raw):
+    df = sample_ap_invoices() if _raw is None else pd.read_csv(io.BytesIO(_raw), parse_dates=["InvoiceDate","DueDate"])
+    df = normalize_vendor_code(df)
+    # Outstanding 只依赖应付文件本身，随解析结果一起缓存
+    df["Outstanding"] = (pd.to_numeric(df["Amount"], errors="coerce").fillna(0)
+                         - pd.to_numeric(df["PaidAmount"], errors="coerce").fillna(0))
+    return df
 
-# join 供应商信息
-expenses = expenses.merge(vendors, on="VendorCode", how="left")
-ap = ap.merge(vendors, on="VendorCode", how="left")
+@st.cache_data(show_spinner=False)
+def load_vendors(key, _raw):
+    df = sample_vendors() if _raw is None else pd.read_csv(io.BytesIO(_raw))
+    return normalize_vendor_code(df)
+
+@st.cache_data(show_spinner=False)
+def vendor_index(key, _raw):
+    # 维表按 VendorCode 建索引（重复编码取第一条），供事实表按键查找属性
+    return load_vendors(key, _raw).drop_duplicates("VendorCode").set_index("VendorCode")
+
+def lookup_vendor_attrs(df, vidx):
+    """按索引查找维表属性并挂到事实表上（等价于 left merge，但不复制/重排事实表）。"""
+    attrs = vidx.reindex(df["VendorCode"].to_numpy())
+    for c in attrs.columns:
+        if c not in df.columns:
+            df[c] = attrs[c].to_numpy()
+    return df
 
 # ------------------ 派生字段 / 账龄 ------------------
-ap["Outstanding"] = (pd.to_numeric(ap["Amount"], errors="coerce").fillna(0)
-                     - pd.to_numeric(ap["PaidAmount"], errors="coerce").fillna(0))
-ap["DaysPastDue"] = (pd.to_datetime("today").normalize() - pd.to_datetime(ap["DueDate"])).dt.days
-ap["DaysPastDue"] = ap["DaysPastDue"].fillna(0).astype(int)
-
-def bucketize(d):
-    if d <= 0: return "Not Due"
-    if d <= 30: return "1-30"
-    if d <= 60: return "31-60"
-    if d <= 90: return "61-90"
-    return "90+"
-ap["AgingBucket"] = ap["DaysPastDue"].apply(bucketize)
+AGING_BUCKETS = ["Not Due", "1-30", "31-60", "61-90", "90+"]
+
+def bucketize(days: pd.Series) -> pd.Series:
+    d = days.to_numpy()
+    conds = [d <= 0, d <= 30, d <= 60, d <= 90]
+    return pd.Series(np.select(conds, AGING_BUCKETS[:4], default=AGING_BUCKETS[4]), index=days.index)
+
+@st.cache_data(show_spinner=False)
+def vendor_orphans(exp_key, ap_key, ven_key, _tables: dict, _vidx):
+    """参照完整性：事实表中在供应商主数据里找不到的 VendorCode（按表汇总）。"""
+    rows = []
+    for table, df in _tables.items():
+        miss = df.loc[~df["VendorCode"].isin(_vidx.index), "VendorCode"].value_counts()
+        rows += [{"table": table, "column": "VendorCode", "value": v, "rows": int(c)} for v, c in miss.items()]
+    return pd.DataFrame(rows, columns=["table", "column", "value", "rows"])
+
+@st.cache_data(show_spinner=False)
+def enrich_expenses(exp_key, ven_key, _exp_raw, _ven_raw):
+    return lookup_vendor_attrs(load_expenses(exp_key, _exp_raw), vendor_index(ven_key, _ven_raw))
+
+@st.cache_data(show_spinner=False)
+def enrich_ap(ap_key, ven_key, asof, _ap_raw, _ven_raw):
+    df = lookup_vendor_attrs(load_ap(ap_key, _ap_raw), vendor_index(ven_key, _ven_raw))
+    dpd = (asof - pd.to_datetime(df["DueDate"])).dt.days
+    df["DaysPastDue"] = dpd.fillna(0).astype(int)
+    df["AgingBucket"] = bucketize(df["DaysPastDue"])
+    return df
+
+# ------------------ 账龄历史（多个截止日一次计算） ------------------
+# 每张发票在时间轴上是两个阶跃（InvoiceDate 记 +Amount、付款日记 -PaidAmount），
+# 在某个 Bucket 内的停留区间为 [DueDate+lo, DueDate+hi)。两者相乘后，每张发票对每个 Bucket
+# 只产生“进入/离开”两条带符号事件。事件按时间排序并累加一次后，
+# 任意多个截止日的余额都只需一次 searchsorted。
+AGING_EDGES = [1, 31, 61, 91]  # DaysPastDue 分界（天），与 bucketize 一致
+def _to_days(s: pd.Series) -> np.ndarray:
+    return pd.to_datetime(s).to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+def build_aging_events(df: pd.DataFrame, asof: pd.Timestamp) -> dict:
+    """构建各 Bucket 的有序事件时间与累计金额。
+
+    无 PaidDate 列（或为空）时，假定已付金额在 min(DueDate, 当前日期) 付款。
+    """
+    df = df[df["DueDate"].notna()]
+    due = _to_days(df["DueDate"])
+    inv = _to_days(pd.to_datetime(df["InvoiceDate"]).fillna(pd.to_datetime(df["DueDate"])))
+    paid = np.minimum(due, _to_days(pd.Series([asof]))[0])
+    if "PaidDate" in df.columns:
+        pd_days = pd.to_datetime(df["PaidDate"], errors="coerce")
+        paid = np.where(pd_days.notna(), pd_days.to_numpy(dtype="datetime64[D]").astype(np.int64), paid)
+    amt = pd.to_numeric(df["Amount"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    pay = pd.to_numeric(df["PaidAmount"], errors="coerce").fillna(0).to_numpy(dtype=float)
+
+    events = {}
+    lows, highs = [None] + AGING_EDGES, AGING_EDGES + [None]
+    for bucket, lo, hi in zip(AGING_BUCKETS, lows, highs):
+        times, weights = [], []
+        for start, w in ((inv, amt), (paid, -pay)):
+            enter = start if lo is None else np.maximum(start, due + lo)
+            times.append(enter); weights.append(w)
+            if hi is not None:
+                times.append(np.maximum(enter, due + hi)); weights.append(-w)
+        t = np.concatenate(times)
+        order = np.argsort(t, kind="stable")
+        events[bucket] = (t[order], np.concatenate([[0.0], np.cumsum(np.concatenate(weights)[order])]))
+    return events
+
+def eval_aging_events(events: dict, asof_dates: pd.DatetimeIndex) -> pd.DataFrame:
+    q = asof_dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    out = {b: cw[np.searchsorted(t, q, side="right")] for b, (t, cw) in events.items()}
+    return pd.DataFrame(out, index=pd.Index(asof_dates, name="AsOf")).round(2)
+
+@st.cache_data(show_spinner=False)
+def aging_history(ap_key, ven_key, asof, regions, months, _ap):
+    asof_dates = pd.date_range(end=asof, periods=months, freq="ME")
+    return eval_aging_events(build_aging_events(_ap, asof), asof_dates)
+
+# ------------------ 重复发票检测 ------------------
+@st.cache_data(show_spinner=False)
+def duplicate_candidates(ap_key, ven_key, regions, window_days, _ap):
+    return detect_duplicate_invoices(_ap, window_days)
+
+# ------------------ 现金需求预测 ------------------
+# 未付发票先压成“距今天数 + 金额 + 分组编码”三个数组并缓存；每次调整付款条件情景时
+# 只需做一次整数平移 + np.bincount 分桶累加，百万级未付项也在毫秒级完成。
+FORECAST_FREQ = {"日": "D", "周": "W-SUN", "月": "MS"}
+UNSPECIFIED = "未指定"
+
+@st.cache_data(show_spinner=False)
+def forecast_base(ap_key, ven_key, asof, regions, _ap):
+    open_items = _ap[(_ap["Outstanding"] > 0) & _ap["DueDate"].notna()]
+    ccy = open_items["Currency"] if "Currency" in open_items.columns else pd.Series(UNSPECIFIED, index=open_items.index)
+    region = open_items["Region"] if "Region" in open_items.columns else pd.Series(UNSPECIFIED, index=open_items.index)
+    return {
+        "due": _to_days(open_items["DueDate"]) - _to_days(pd.Series([asof]))[0],
+        "amount": open_items["Outstanding"].to_numpy(dtype=float),
+        "币种": pd.factorize(ccy.fillna(UNSPECIFIED).astype(str).str.upper().str.strip()),
+        "区域": pd.factorize(region.fillna(UNSPECIFIED).astype(str)),
+    }
+
+def cash_forecast(base: dict, split: str, horizon: int, shift_days: int, group_shift: dict,
+                  freq: str, asof: pd.Timestamp):
+    """返回 (各期×分组 付款预测, 超出预测期的金额)。已逾期未付按今日付款。"""
+    codes, labels = base[split]
+    labels = list(labels)
+    shift = shift_days + np.array([int(group_shift.get(l, 0)) for l in labels] or [0])[codes]
+    day = np.clip(base["due"] + shift, 0, None)
+    inside = day < horizon
+    grid = np.bincount(codes[inside] * horizon + day[inside], weights=base["amount"][inside],
+                       minlength=len(labels) * horizon).reshape(len(labels), horizon)
+    daily = pd.DataFrame(grid.T, index=pd.date_range(asof, periods=horizon, freq="D", name="PayDate"), columns=labels)
+    out = daily if freq == "D" else daily.resample(freq).sum()
+    return out, float(base["amount"][~inside].sum())
+
+exp_key, exp_raw = upload_key(exp_file)
+ap_key, ap_raw = upload_key(ap_file)
+ven_key, ven_raw = upload_key(ven_file)
+
+vendors = load_vendors(ven_key, ven_raw)
+expenses = enrich_expenses(exp_key, ven_key, exp_raw, ven_raw)
+asof = pd.Timestamp.today().normalize()
+ap = enrich_ap(ap_key, ven_key, asof, ap_raw, ven_raw)
+orphans = vendor_orphans(exp_key, ap_key, ven_key, {"expenses": expenses, "ap_invoices": ap},
+                         vendor_index(ven_key, ven_raw))
+if not orphans.empty:
+    with st.expander(f"⚠️ {orphans['value'].nunique()} 个 VendorCode 不在供应商主数据中（{orphans['rows'].sum()} 行）"):
+        st.dataframe(orphans, use_container_width=True, height=200)
 
 # ------------------ 顶部筛选 ------------------
 min_date = min(expenses["Date"].min(), ap["InvoiceDate"].min())
@@ -161,11 +314,61 @@ k4.metric("AP 90+", f"{ap_90p:,.0f}")
 
 st.divider()
 
+# ------------------ 图表负载控制 ------------------
+# 图表数据量随供应商/发票数增长时，前端渲染会被 Plotly JSON 拖垮。
+# 每张图按“负载预算”折算可渲染的点数：类别维度做 Top-N + 其他，时间序列在服务端降采样，
+# 点数较多的明细图改用 WebGL 渲染。导出的 Excel 仍保留完整数据。
+OTHER_LABEL = "其他（Other）"
+BYTES_PER_POINT = 60      # 粗略估计：单个数据点在 Plotly JSON 中的字节数
+WEBGL_MIN_POINTS = 1000   # 超过该点数时改用 WebGL trace
+
+with st.sidebar:
+    st.markdown("---")
+    st.header("图表设置")
+    top_n = st.slider("类别图 Top-N（其余合并为“其他”）", 5, 50, 15)
+    chart_budget_kb = st.number_input("单图负载预算（KB）", min_value=50, value=500, step=50)
+    trend_freq = st.radio("费用趋势粒度", ["月", "日"], horizontal=True)
+
+def point_budget(n_series: int = 1) -> int:
+    return max(int(chart_budget_kb * 1024 / BYTES_PER_POINT / max(n_series, 1)), 10)
+
+def render_mode(n_points: int) -> str:
+    return "webgl" if n_points > WEBGL_MIN_POINTS else "svg"
+
+def top_n_other(df: pd.DataFrame, cat_col: str, val_col: str, n: int) -> pd.DataFrame:
+    """按 val_col 合计保留前 n 个类别，其余类别合并为“其他”（其它维度列保持不变）。"""
+    totals = df.groupby(cat_col, sort=False)[val_col].sum()
+    if len(totals) <= n:
+        return df
+    keep = totals.abs().nlargest(n).index
+    out = df.assign(**{cat_col: df[cat_col].where(df[cat_col].isin(keep), OTHER_LABEL)})
+    by = [c for c in out.columns if c != val_col]
+    return out.groupby(by, as_index=False, sort=False)[val_col].sum()
+
+def downsample_series(df: pd.DataFrame, x: str, y: str, max_points: int) -> pd.DataFrame:
+    """min-max 分桶降采样：每个桶保留最小/最大值点，保证峰谷形状不丢失。"""
+    if len(df) <= max_points:
+        return df
+    df = df.sort_values(x).reset_index(drop=True)
+    bucket = np.arange(len(df)) * max(max_points // 2, 1) // len(df)
+    g = df[y].groupby(bucket)
+    idx = np.union1d(g.idxmin().to_numpy(), g.idxmax().to_numpy())
+    return df.iloc[idx]
+
 # ------------------ 图表区域 ------------------
-# 费用趋势（月）
+import plotly.express as px   # 到首个图表才导入（冷启动约 0.1 s）：上方筛选与 KPI 不必等待
+# 费用趋势（月/日）
 exp_month = (expenses_f.assign(Month=pd.to_datetime(expenses_f["Date"]).dt.to_period("M").dt.to_timestamp())
                         .groupby("Month", as_index=False)["Amount"].sum())
-fig1 = px.line(exp_month, x="Month", y="Amount", markers=True, title="费用趋势（月）")
+if trend_freq == "月":
+    trend, trend_x = exp_month, "Month"
+else:
+    trend = (expenses_f.assign(Day=pd.to_datetime(expenses_f["Date"]).dt.normalize())
+                       .groupby("Day", as_index=False)["Amount"].sum())
+    trend_x = "Day"
+trend_plot = downsample_series(trend, trend_x, "Amount", point_budget())
+fig1 = px.line(trend_plot, x=trend_x, y="Amount", markers=len(trend_plot) <= 200,
+               render_mode=render_mode(len(trend_plot)), title=f"费用趋势（{trend_freq}）")
 
 # 供应商未付Top10
 ap_vendor = (ap_f.groupby(["VendorCode","VendorName"], as_index=False)["Outstanding"].sum()
@@ -178,12 +381,26 @@ aging_pivot = (ap_f.pivot_table(index="VendorName", columns="AgingBucket",
                  .reset_index())
 # 为了可视化，转长表
 aging_long = aging_pivot.melt(id_vars="VendorName", var_name="Bucket", value_name="Amount")
-fig3 = px.bar(aging_long, x="VendorName", y="Amount", color="Bucket", title="账龄结构（供应商×Bucket）")
+# 图上只画 Top-N 供应商 + 其他，零值柱不参与渲染
+n_buckets = max(aging_long["Bucket"].nunique(), 1)
+aging_plot = top_n_other(aging_long, "VendorName", "Amount", min(top_n, point_budget(n_buckets)))
+aging_plot = aging_plot[aging_plot["Amount"] != 0]
+fig3 = px.bar(aging_plot, x="VendorName", y="Amount", color="Bucket", title="账龄结构（供应商×Bucket）",
+              category_orders={"Bucket": AGING_BUCKETS})
 
 # 费用按类别
 exp_cat = (expenses_f.groupby("Category", as_index=False)["Amount"].sum()
              .sort_values("Amount", ascending=False))
-fig4 = px.pie(exp_cat, names="Category", values="Amount", title="费用结构（类别）")
+fig4 = px.pie(top_n_other(exp_cat, "Category", "Amount", top_n), names="Category", values="Amount",
+              title="费用结构（类别）")
+
+# 发票散点（明细视图）：超预算时只画未付金额最大的发票
+scatter_src = ap_f[ap_f["Outstanding"] != 0]
+scatter_src = scatter_src.nlargest(point_budget(), "Outstanding") if len(scatter_src) > point_budget() else scatter_src
+fig5 = px.scatter(scatter_src, x="DaysPastDue", y="Outstanding", color="AgingBucket",
+                  hover_data=["InvoiceID", "VendorName"], render_mode=render_mode(len(scatter_src)),
+                  category_orders={"AgingBucket": AGING_BUCKETS},
+                  title=f"未付发票分布（逾期天数×未付金额，{len(scatter_src):,} / {int((ap_f['Outstanding'] != 0).sum()):,} 张）")
 
 # 布局展示
 g1, g2 = st.columns([1.2,1])
@@ -196,12 +413,68 @@ g3 = st.container()
 with g3:
     st.plotly_chart(fig2, use_container_width=True)
     st.plotly_chart(fig3, use_container_width=True)
+    st.plotly_chart(fig5, use_container_width=True)
+
+# 账龄历史趋势（月末快照）
+aging_hist = pd.DataFrame()
+if st.toggle("账龄历史模式（月末快照趋势）", value=False):
+    hist_months = st.slider("回看月数", 3, 60, 24)
+    aging_hist = aging_history(ap_key, ven_key, asof, tuple(reg), hist_months, ap_f)
+    hist_long = aging_hist.reset_index().melt(id_vars="AsOf", var_name="Bucket", value_name="Outstanding")
+    fig6 = px.area(hist_long, x="AsOf", y="Outstanding", color="Bucket",
+                   category_orders={"Bucket": AGING_BUCKETS}, title="账龄趋势（月末未付余额×Bucket）")
+    st.plotly_chart(fig6, use_container_width=True)
+    if "PaidDate" not in ap.columns:
+        st.caption("未提供 PaidDate 列：已付金额按 min(DueDate, 今日) 视为付款日。")
 
-# 明细表
-st.markdown("### 发票明细")
+# 明细表 / 重复发票检测
 detail_cols = ["InvoiceID","VendorName","Region","InvoiceDate","DueDate","Amount","PaidAmount","Outstanding","DaysPastDue","AgingBucket"]
-st.dataframe(ap_f[detail_cols].sort_values(["AgingBucket","DaysPastDue","Outstanding"], ascending=[True, False, False]),
-             use_container_width=True, height=280)
+tab_detail, tab_dup, tab_cash = st.tabs(["发票明细", "重复发票检测", "现金需求预测"])
+with tab_detail:
+    st.dataframe(ap_f[detail_cols].sort_values(["AgingBucket","DaysPastDue","Outstanding"], ascending=[True, False, False]),
+                 use_container_width=True, height=280)
+with tab_dup:
+    dup_window = st.slider("日期窗口（天）：同供应商同金额、发票日期相差不超过", 0, 30, 5)
+    dup_pairs = duplicate_candidates(ap_key, ven_key, tuple(reg), dup_window, ap_f)
+    d1, d2, d3 = st.columns(3)
+    d1.metric("疑似重复对", len(dup_pairs))
+    d2.metric("双方均已付款", 0 if dup_pairs.empty else int(dup_pairs["BothPaid"].sum()))
+    d3.metric("涉及金额（双付）", "0" if dup_pairs.empty else
+              f"{dup_pairs.loc[dup_pairs['BothPaid'], 'Amount'].sum():,.0f}")
+    if dup_pairs.empty:
+        st.success("未发现疑似重复发票。")
+    else:
+        st.dataframe(dup_pairs, use_container_width=True, height=280)
+
+with tab_cash:
+    fc1, fc2, fc3, fc4 = st.columns(4)
+    with fc1:
+        fc_freq = st.radio("粒度", list(FORECAST_FREQ), index=1, horizontal=True)
+    with fc2:
+        fc_split = st.radio("拆分维度", ["币种", "区域"], horizontal=True)
+    with fc3:
+        fc_horizon = st.slider("预测期（天）", 7, 365, 90)
+    with fc4:
+        fc_shift = st.number_input("付款条件整体顺延（天，可为负）", value=0, step=5)
+    fc_base = forecast_base(ap_key, ven_key, asof, tuple(reg), ap_f)
+    fc_groups = [str(x) for x in fc_base[fc_split][1]]
+    with st.expander(f"按{fc_split}单独顺延（情景）"):
+        grp_shift_df = st.data_editor(pd.DataFrame({fc_split: fc_groups, "shift_days": [0] * len(fc_groups)}),
+                                      disabled=[fc_split], use_container_width=True, hide_index=True,
+                                      key=f"fc_shift_{fc_split}")
+    grp_shift = dict(zip(grp_shift_df[fc_split], grp_shift_df["shift_days"].fillna(0)))
+    t0 = time.perf_counter()
+    cash_fc, beyond = cash_forecast(fc_base, fc_split, fc_horizon, int(fc_shift), grp_shift,
+                                    FORECAST_FREQ[fc_freq], asof)
+    fc_ms = (time.perf_counter() - t0) * 1000
+    c_1, c_2, c_3 = st.columns(3)
+    c_1.metric("预测期内付款", f"{cash_fc.to_numpy().sum():,.0f}")
+    c_2.metric("预测期外未付", f"{beyond:,.0f}")
+    c_3.metric("未付发票数", f"{len(fc_base['amount']):,}")
+    cash_long = cash_fc.reset_index().melt(id_vars="PayDate", var_name=fc_split, value_name="Amount")
+    fig7 = px.bar(cash_long, x="PayDate", y="Amount", color=fc_split, title=f"现金需求预测（按{fc_freq}×{fc_split}）")
+    st.plotly_chart(fig7, use_container_width=True)
+    st.caption(f"情景计算耗时 {fc_ms:.1f} ms；已逾期未付按今日付款计入。")
 
 # ------------------ 导出结果 ------------------
 st.subheader("下载汇总结果")
@@ -210,7 +483,11 @@ export_bytes = to_excel_bytes({
     "Expense_By_Category": exp_cat,
     "AP_Vendor_Outstanding": ap_vendor,
     "AP_Aging_Long": aging_long,
-    "AP_Detail": ap_f[detail_cols]
+    "AP_Detail": ap_f[detail_cols],
+    "AP_Cash_Forecast": cash_fc.reset_index(),
+    **({"Vendor_Orphans": orphans} if not orphans.empty else {}),
+    "AP_Duplicate_Candidates": dup_pairs if not dup_pairs.empty else pd.DataFrame({"msg":["无疑似重复"]}),
+    **({"AP_Aging_History": aging_hist.reset_index()} if not aging_hist.empty else {})
 })
 st.download_button(
     "下载结果包（Excel，多Sheet）",
@@ -218,3 +495,5 @@ st.download_button(
     file_name="ap_expense_dashboard.xlsx",
     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 )
+
+_timer.done()
@@ -1,45 +1,266 @@
 # -*- coding: utf-8 -*-
-import io, re
+from page_timing import PageTimer
+_timer = PageTimer("03_数据质量与数据字典")   # 先于重模块导入，冷启动计入导入耗时
+import base64, gzip, hashlib, io, json, operator, os, re, time, zlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import streamlit as st
+from distinct_sketch import distinct_add, distinct_count, distinct_init, distinct_registers, hash_values, hll_overlap
 
 st.set_page_config(page_title="数据质量与数据字典", page_icon="🧪", layout="wide")
 st.title("数据质量与数据字典")
 st.caption("上传 CSV/XLSX 自动生成字段画像、质量问题明细与可下载的数据字典（Excel 多 Sheet）")
 
-def read_any(file):
-    name = file.name.lower()
-    if name.endswith(".csv"):
-        return pd.read_csv(file)
-    return pd.read_excel(file)
+LARGE_FILE_BYTES = 200 * 1024 * 1024   # 超过该大小默认走分块流式处理
+CHUNK_ROWS = 200_000
+# 服务器端大文件目录（超出上传限制时使用）；未配置则不提供服务器文件选项。只能从该目录的列表中选择
+DATA_DIR = os.path.realpath(os.environ["RECON_DATA_DIR"]) if os.environ.get("RECON_DATA_DIR") else None
+DATA_EXTS = (".csv", ".xlsx", ".xls")
 
-def profile(df: pd.DataFrame) -> pd.DataFrame:
+def data_dir_files() -> list:
+    """DATA_DIR 下（含子目录）可读取的数据文件，返回相对路径。"""
+    if not DATA_DIR or not os.path.isdir(DATA_DIR):
+        return []
+    out = []
+    for root, _, names in os.walk(DATA_DIR):
+        out += [os.path.relpath(os.path.join(root, n), DATA_DIR) for n in names if n.lower().endswith(DATA_EXTS)]
+    return sorted(r for r in out if data_dir_path(r))
+
+def data_dir_path(rel: str):
+    """相对路径 → DATA_DIR 内的绝对路径；解析符号链接后越出 DATA_DIR 的一律拒绝。"""
+    path = os.path.realpath(os.path.join(DATA_DIR, rel))
+    return path if path.startswith(DATA_DIR + os.sep) and os.path.isfile(path) else None
+
+def _src_name(src) -> str:
+    return (src if isinstance(src, str) else src.name).lower()
+
+def read_any(file, nrows=None):
+    if not isinstance(file, str):
+        file.seek(0)
+    if _src_name(file).endswith(".csv"):
+        return pd.read_csv(file, nrows=nrows)
+    return pd.read_excel(file, nrows=nrows)
+
+def iter_chunks(src, chunksize=CHUNK_ROWS, usecols=None):
+    """按块读取 CSV（Excel 无法流式解析，整表作为一块）。src 为上传文件或本地路径。"""
+    if not isinstance(src, str):
+        src.seek(0)
+    if _src_name(src).endswith(".csv"):
+        yield from pd.read_csv(src, chunksize=chunksize, usecols=usecols)
+    else:
+        yield pd.read_excel(src, usecols=usecols)
+
+# ---------- 字段画像（分块单遍） ----------
+QUANTILE_GRID = np.linspace(0, 1, 21)   # 每块记录的分位点（用于分布漂移比较）
+TOP_VALUES_TRACKED = 1000               # 非数值列跨块合并时保留的高频值个数
+
+def _col_init() -> dict:
+    return {"dtypes": [], "rows": 0, "non_null": 0, "min": None, "max": None,
+            "sample": [], "distinct": distinct_init(), "kind": "category", "quantiles": [], "top": {}}
+
+def _col_update(acc: dict, s: pd.Series):
+    dtype = str(s.dtype)
+    if dtype not in acc["dtypes"]:
+        acc["dtypes"].append(dtype)
+    vals = s[s.notna()]
+    acc["rows"] += len(s)
+    acc["non_null"] += len(vals)
+    if vals.empty:
+        return
+    if len(acc["sample"]) < 3:
+        acc["sample"] += [x[:20] for x in vals.head(3 - len(acc["sample"])).astype(str)]
+    orderable = ((pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s))
+                 or pd.api.types.is_datetime64_any_dtype(s))
+    if orderable:
+        mn, mx = vals.min(), vals.max()
+        acc["min"] = mn if acc["min"] is None else min(acc["min"], mn)
+        acc["max"] = mx if acc["max"] is None else max(acc["max"], mx)
+        is_dt = pd.api.types.is_datetime64_any_dtype(s)
+        acc["kind"] = "datetime" if is_dt else "number"
+        num = vals.astype("int64") if is_dt else vals.astype(float)
+        acc["quantiles"].append((np.quantile(num.to_numpy(), QUANTILE_GRID), len(num)))
+    else:
+        top = acc["top"]
+        for v, c in vals.astype(str).value_counts().head(TOP_VALUES_TRACKED).items():
+            top[v] = top.get(v, 0) + int(c)
+        if len(top) > 2 * TOP_VALUES_TRACKED:
+            acc["top"] = dict(sorted(top.items(), key=lambda kv: -kv[1])[:TOP_VALUES_TRACKED])
+    distinct_add(acc["distinct"], vals.to_numpy())
+
+def profile_init() -> dict:
+    return {"rows": 0, "cols": {}}
+
+def profile_update(state: dict, chunk: pd.DataFrame):
+    state["rows"] += len(chunk)
+    for col in chunk.columns:
+        _col_update(state["cols"].setdefault(col, _col_init()), chunk[col])
+
+def profile_result(state: dict) -> pd.DataFrame:
+    n_rows, rows = state["rows"], []
+    for col, a in state["cols"].items():
+        nulls = n_rows - a["non_null"]
+        rows.append([col, "|".join(a["dtypes"]), a["non_null"], nulls, round(nulls * 100.0 / max(n_rows, 1), 2),
+                     distinct_count(a["distinct"]), "exact" if a["distinct"]["registers"] is None else "hll",
+                     "" if a["min"] is None else a["min"], "" if a["max"] is None else a["max"],
+                     ", ".join(a["sample"])])
+    cols = ["column","dtype","non_null","nulls","null_pct%","unique","unique_method","min","max","sample"]
+    return pd.DataFrame(rows, columns=cols)
+
+def profile_chunks(chunks) -> tuple[pd.DataFrame, int]:
+    """对数据块序列做一次遍历，累计每列的计数/空值/最值/样例/去重草图。返回 (画像表, 总行数)。"""
+    state = profile_init()
+    for chunk in chunks:
+        profile_update(state, chunk)
+    return profile_result(state), state["rows"]
+
+# ---------- 画像快照与漂移比较 ----------
+# 快照只保存聚合结果：计数/空值率/基数、折叠到 2^10 的 HLL 寄存器（约 1 KB/列）、
+# 21 个分位点（数值/日期列）或高频值计数（其它列），gzip JSON 每列约 1~3 KB。
+# 漂移比较只读取基线快照，不需要历史原始文件：数值列按基线分位区间算 PSI，类别列算高频值分布的总变差距离；
+# 两份 HLL 寄存器合并得到并集/交集基数，基数不变但值整体替换（如编码体系切换）也能发现。
+SNAPSHOT_DIR = "dq_snapshots"
+SNAPSHOT_HLL_P = 10
+TOP_VALUES_SNAPSHOT = 20
+
+def _merge_quantiles(parts: list) -> list:
+    """合并各块的分位点（按块行数加权）得到整体近似分位点。"""
+    vals = np.concatenate([q for q, _ in parts])
+    w = np.concatenate([np.full(len(q), n / len(q)) for q, n in parts])
+    order = np.argsort(vals, kind="stable")
+    cw = np.cumsum(w[order])
+    return np.interp(QUANTILE_GRID * cw[-1], cw, vals[order]).tolist()
+
+def build_snapshot(state: dict, dataset: str, source: str) -> dict:
+    cols = {}
+    for col, a in state["cols"].items():
+        reg = distinct_registers(a["distinct"], SNAPSHOT_HLL_P)
+        c = {"dtype": "|".join(a["dtypes"]), "non_null": a["non_null"], "nulls": state["rows"] - a["non_null"],
+             "distinct": distinct_count(a["distinct"]), "kind": a["kind"],
+             "hll": base64.b64encode(zlib.compress(reg.tobytes())).decode("ascii")}
+        if a["quantiles"]:
+            c["quantiles"] = _merge_quantiles(a["quantiles"])
+        if a["top"]:
+            c["top"] = dict(sorted(a["top"].items(), key=lambda kv: -kv[1])[:TOP_VALUES_SNAPSHOT])
+        cols[str(col)] = c
+    return {"dataset": dataset, "created_at": datetime.now().isoformat(timespec="seconds"),
+            "source": source, "rows": state["rows"], "columns": cols}
+
+def _snapshot_dir(dataset: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, re.sub(r"[^\w\-]+", "_", dataset) or "default")
+
+def save_snapshot(snap: dict) -> str:
+    os.makedirs(_snapshot_dir(snap["dataset"]), exist_ok=True)
+    path = os.path.join(_snapshot_dir(snap["dataset"]), snap["created_at"].replace(":", "") + ".json.gz")
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(snap, f, ensure_ascii=False, default=str)
+    return path
+
+def list_snapshots(dataset: str) -> list:
+    d = _snapshot_dir(dataset)
+    return sorted((f for f in os.listdir(d) if f.endswith(".json.gz")), reverse=True) if os.path.isdir(d) else []
+
+def load_snapshot(dataset: str, name: str) -> dict:
+    with gzip.open(os.path.join(_snapshot_dir(dataset), name), "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def _psi(cur_q: list, base_q: list) -> float:
+    edges = np.unique(base_q[1:-1])
+    share = lambda q: np.diff(np.r_[0.0, np.interp(edges, q, QUANTILE_GRID), 1.0])
+    b, c = np.clip(share(base_q), 1e-4, None), np.clip(share(cur_q), 1e-4, None)
+    return float(np.sum((c - b) * np.log(c / b)))
+
+def _tvd(cur: dict, base: dict) -> float:
+    share = lambda d: {k: v / max(d["non_null"], 1) for k, v in d.get("top", {}).items()}
+    c, b = share(cur), share(base)
+    keys = set(c) | set(b)
+    diff = sum(abs(c.get(k, 0) - b.get(k, 0)) for k in keys)
+    diff += abs((1 - sum(c.values())) - (1 - sum(b.values())))   # 其余值合并为“其他”
+    return 0.5 * diff
+
+def _hll_registers(col: dict):
+    return np.frombuffer(zlib.decompress(base64.b64decode(col["hll"])), dtype=np.uint8) if col.get("hll") else None
+
+def compare_snapshots(cur: dict, base: dict, null_pp: float, card_ratio: float, dist_thr: float,
+                      overlap_min: float) -> pd.DataFrame:
     rows = []
-    for col in df.columns:
-        s = df[col]
-        dtype = str(s.dtype)
-        non_null = int(s.notna().sum())
-        nulls = int(s.isna().sum())
-        null_pct = round(nulls * 100.0 / max(len(s),1), 2)
-        uniq = int(s.nunique(dropna=True))
-        sample = ", ".join(map(lambda x: str(x)[:20], s.dropna().astype(str).head(3)))
-        # 数值/日期的 min/max
-        mn = mx = ""
-        if np.issubdtype(s.dropna().dtype, np.number):
-            mn, mx = s.min(), s.max()
-        elif np.issubdtype(s.dropna().dtype, "datetime64[ns]"):
-            mn, mx = s.min(), s.max()
-        rows.append([col, dtype, non_null, nulls, null_pct, uniq, mn, mx, sample])
-    return pd.DataFrame(rows, columns=["column","dtype","non_null","nulls","null_pct%","unique","min","max","sample"])
-
-def find_dupes(df: pd.DataFrame, keys: list) -> pd.DataFrame:
-    if not keys: return pd.DataFrame()
-    g = df.groupby(keys, dropna=False).size().reset_index(name="count")
-    dkeys = g[g["count"]>1][keys]
-    if dkeys.empty: return pd.DataFrame()
-    mask = df.set_index(keys).index.isin(dkeys.set_index(keys).index)
-    return df[mask].copy()
+    for col in list(cur["columns"]) + [c for c in base["columns"] if c not in cur["columns"]]:
+        c, b = cur["columns"].get(col), base["columns"].get(col)
+        if c is None or b is None:
+            rows.append({"column": col, "flags": "缺失列" if c is None else "新增列"})
+            continue
+        null_c = c["nulls"] * 100.0 / max(cur["rows"], 1)
+        null_b = b["nulls"] * 100.0 / max(base["rows"], 1)
+        ratio = (c["distinct"] + 1) / (b["distinct"] + 1)
+        if c.get("quantiles") and b.get("quantiles"):
+            metric, dist = "PSI", _psi(c["quantiles"], b["quantiles"])
+        else:
+            metric, dist = "TVD", _tvd(c, b)
+        reg_c, reg_b = _hll_registers(c), _hll_registers(b)
+        jaccard = new_values = None
+        if reg_c is not None and reg_b is not None and len(reg_c) == len(reg_b):
+            union, inter = hll_overlap(reg_c, reg_b)
+            jaccard = min(inter / union, 1.0) if union else 1.0
+            new_values = max(union - b["distinct"], 0)   # 本次出现、基线没有的不同值个数
+        flags = []
+        if c["dtype"] != b["dtype"]: flags.append(f"类型变化 {b['dtype']}→{c['dtype']}")
+        if abs(null_c - null_b) > null_pp: flags.append("空值率漂移")
+        if ratio > card_ratio or ratio < 1 / card_ratio: flags.append("基数漂移")
+        if dist > dist_thr: flags.append("分布漂移")
+        if jaccard is not None and jaccard < overlap_min: flags.append("值域漂移")
+        rows.append({"column": col, "null_pct_base": round(null_b, 2), "null_pct_now": round(null_c, 2),
+                     "distinct_base": b["distinct"], "distinct_now": c["distinct"], "distinct_ratio": round(ratio, 3),
+                     "value_overlap": None if jaccard is None else round(jaccard, 3), "new_values_est": new_values,
+                     "dist_metric": metric, "dist_drift": round(dist, 4), "flags": "、".join(flags)})
+    return pd.DataFrame(rows)
+
+# ---------- 主键重复检测（64 位指纹 + 精确复核） ----------
+# 第一遍只保留每行主键元组的 64 位指纹（8 字节/行），排序后找出出现多次的指纹；
+# 第二遍只取指纹命中的候选行，按真实主键值精确分组，哈希碰撞在这一步被剔除。
+def key_hashes(chunk: pd.DataFrame, keys: list) -> np.ndarray:
+    h = np.zeros(len(chunk), dtype=np.uint64)
+    for k in keys:
+        h = (h * np.uint64(0x100000001B3)) ^ hash_values(chunk[k].to_numpy())
+    return h
+
+def dup_candidates(hash_parts: list) -> np.ndarray:
+    h = np.sort(np.concatenate(hash_parts)) if hash_parts else np.empty(0, dtype=np.uint64)
+    return np.unique(h[1:][h[1:] == h[:-1]])
+
+def resolve_dupes(chunks, keys: list, cand: np.ndarray) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """返回 (重复组：主键+count+rows, 重复行明细：原始列+_row)。_row 为 0 起的数据行号。"""
+    parts, offset = [], 0
+    for chunk in chunks:
+        h = key_hashes(chunk, keys)
+        hit = cand[np.minimum(np.searchsorted(cand, h), len(cand) - 1)] == h
+        if hit.any():
+            parts.append(chunk[hit].assign(_row=offset + np.flatnonzero(hit)))
+        offset += len(chunk)
+    if not parts:
+        return pd.DataFrame(), pd.DataFrame()
+    rows = pd.concat(parts, ignore_index=True)
+    g = rows.groupby(keys, dropna=False, sort=False)
+    gid, size = g.ngroup().to_numpy(), g["_row"].transform("size").to_numpy()
+    # 按组号+行号排序（不比较主键值本身，混合类型的主键列也安全），并剔除碰撞造成的单行组
+    order = np.lexsort((rows["_row"].to_numpy(), gid))
+    order = order[size[order] > 1]
+    if not len(order):
+        return pd.DataFrame(), pd.DataFrame()
+    rows, gid = rows.iloc[order].reset_index(drop=True), gid[order]
+    starts = np.flatnonzero(np.r_[True, gid[1:] != gid[:-1]])
+    counts = np.diff(np.r_[starts, len(gid)])
+    pos = rows["_row"].to_numpy()
+    groups = rows.loc[starts, keys].reset_index(drop=True).assign(
+        count=counts,
+        rows=[", ".join(map(str, pos[b:b + min(c, 20)])) + (" …" if c > 20 else "") for b, c in zip(starts, counts)])
+    return groups.sort_values("count", ascending=False, kind="stable", ignore_index=True), rows
+
+def find_dupes(df: pd.DataFrame, keys: list) -> tuple[pd.DataFrame, pd.DataFrame]:
+    if not keys: return pd.DataFrame(), pd.DataFrame()
+    cand = dup_candidates([key_hashes(df, keys)])
+    if not len(cand): return pd.DataFrame(), pd.DataFrame()
+    return resolve_dupes([df], keys, cand)
 
 def to_excel_bytes(sheets: dict) -> bytes:
     buf = io.BytesIO()
@@ -49,28 +270,266 @@ def to_excel_bytes(sheets: dict) -> bytes:
             d.to_excel(w, index=False, sheet_name=name[:31] or "Sheet1")
     return buf.getvalue()
 
+# ---------- 声明式校验规则引擎 ----------
+# 规则从 dq_rules.json（与 rules.json 同目录）读取，每条规则编译为“输入数据块 → 违规布尔掩码”的向量化函数；
+# 同一数据块上的各规则由线程池并行求值，正则只对去重后的取值计算一次再按编码回填。
+DQ_RULES_FILE = "dq_rules.json"
+DEFAULT_DQ_RULES = [
+    {"id": "invoice_no_format", "type": "regex", "column": "invoice_no",
+     "pattern": r"^[A-Za-z0-9\-\_/]{3,}$", "message": "invoice_no 格式非法"},
+    {"id": "vendor_code_format", "type": "regex", "column": "vendor_code",
+     "pattern": r"^[A-Za-z0-9]{3,}$", "message": "vendor_code 格式非法"},
+]
+MAX_ISSUES_PER_RULE = 100_000   # 每条规则最多保留的明细行（计数不受限）
+RULE_WORKERS = min(8, os.cpu_count() or 1)
+_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+        "==": operator.eq, "!=": operator.ne}
+
+def _rules_list(obj) -> list:
+    rules = obj["rules"]
+    if not isinstance(rules, list) or not all(isinstance(r, dict) for r in rules):
+        raise TypeError("rules 须为对象数组")
+    return rules
+
+def load_dq_rules(uploaded=None) -> list:
+    if uploaded is not None:
+        try:
+            return _rules_list(json.load(uploaded))
+        except (ValueError, KeyError, TypeError) as e:
+            st.sidebar.error(f"上传的 dq_rules.json 无法使用（{type(e).__name__}: {e}），已改用内置规则。")
+    try:
+        with open(DQ_RULES_FILE, "r", encoding="utf-8-sig") as f:
+            return _rules_list(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_DQ_RULES
+
+def _regex_mask(s: pd.Series, pattern: str) -> np.ndarray:
+    codes, uniques = pd.factorize(s)
+    bad = ~pd.Series(uniques.astype(str)).str.match(pattern).to_numpy(dtype=bool)
+    return (codes >= 0) & np.append(bad, False)[codes]
+
+def _range_mask(s: pd.Series, lo, hi) -> np.ndarray:
+    v = pd.to_numeric(s, errors="coerce")
+    bad = v.isna() & s.notna()   # 非数值
+    if lo is not None: bad |= v < lo
+    if hi is not None: bad |= v > hi
+    return bad.to_numpy()
+
+def _enum_mask(s: pd.Series, values: list, case_insensitive: bool) -> np.ndarray:
+    if case_insensitive:
+        s, values = s.astype("string").str.strip().str.upper(), [str(v).upper() for v in values]
+    return (s.notna() & ~s.isin(values)).to_numpy(dtype=bool)
+
+def _compare_mask(a: pd.Series, b: pd.Series, op) -> np.ndarray:
+    both = a.notna() & b.notna()
+    return (both & ~op(a, b).fillna(False)).to_numpy(dtype=bool)
+
+def compile_rule(rule: dict) -> dict:
+    """规则 dict → {id, columns, fn(chunk) -> 违规掩码, ...}；配置错误抛 ValueError。"""
+    kind = rule.get("type")
+    rid = rule.get("id") or f"{kind}:{rule.get('column') or rule.get('left') or rule.get('before')}"
+    if kind == "regex":
+        pattern = re.compile(rule["pattern"]).pattern
+        cols, fn = [rule["column"]], lambda c: _regex_mask(c[rule["column"]], pattern)
+    elif kind == "not_null":
+        cols, fn = [rule["column"]], lambda c: c[rule["column"]].isna().to_numpy()
+    elif kind == "range":
+        cols, fn = [rule["column"]], lambda c: _range_mask(c[rule["column"]], rule.get("min"), rule.get("max"))
+    elif kind == "enum":
+        cols = [rule["column"]]
+        fn = lambda c: _enum_mask(c[rule["column"]], rule["values"], bool(rule.get("case_insensitive")))
+    elif kind == "compare":
+        if rule["op"] not in _OPS:
+            raise ValueError(f"{rid}: 不支持的比较符 {rule['op']}")
+        cols = [rule["left"], rule["right"]]
+        fn = lambda c: _compare_mask(pd.to_numeric(c[rule["left"]], errors="coerce"),
+                                     pd.to_numeric(c[rule["right"]], errors="coerce"), _OPS[rule["op"]])
+    elif kind == "date_order":
+        cols, op = [rule["before"], rule["after"]], (operator.lt if rule.get("strict") else operator.le)
+        fn = lambda c: _compare_mask(pd.to_datetime(c[rule["before"]], errors="coerce"),
+                                     pd.to_datetime(c[rule["after"]], errors="coerce"), op)
+    else:
+        raise ValueError(f"{rid}: 未知规则类型 {kind}")
+    return {"id": rid, "columns": cols, "fn": fn, "severity": rule.get("severity", "error"),
+            "message": rule.get("message", rid)}
+
+def compile_rules(rules: list) -> tuple[list, list]:
+    compiled, errors = [], []
+    for r in rules:
+        try:
+            compiled.append(compile_rule(r))
+        except (KeyError, ValueError, re.error) as e:
+            errors.append(f"{r.get('id', r)}: {e}")
+    return compiled, errors
+
+def rules_init(compiled: list) -> dict:
+    return {"compiled": compiled, "counts": {r["id"]: 0 for r in compiled}, "issues": [], "skipped": set(),
+            "rows": 0}
+
+def rules_update(state: dict, chunk: pd.DataFrame, pool: ThreadPoolExecutor):
+    offset = state["rows"]
+    state["rows"] += len(chunk)
+    active = [r for r in state["compiled"] if all(c in chunk.columns for c in r["columns"])]
+    state["skipped"].update(r["id"] for r in state["compiled"] if r not in active)
+    for r, mask in zip(active, pool.map(lambda r: r["fn"](chunk), active)):
+        hit = np.flatnonzero(mask)
+        kept = MAX_ISSUES_PER_RULE - min(state["counts"][r["id"]], MAX_ISSUES_PER_RULE)
+        state["counts"][r["id"]] += len(hit)
+        hit = hit[:kept]
+        if len(hit):
+            state["issues"].append(pd.DataFrame({
+                "_row": offset + hit, "rule": r["id"], "column": "/".join(r["columns"]),
+                "value": chunk[r["columns"][0]].iloc[hit].astype(str).to_numpy(),
+                "severity": r["severity"], "message": r["message"]}))
+
+def rules_result(state: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    summary = pd.DataFrame([{"rule": r["id"], "columns": "/".join(r["columns"]), "severity": r["severity"],
+                             "violations": state["counts"][r["id"]],
+                             "status": "skipped（缺少列）" if r["id"] in state["skipped"] else "checked"}
+                            for r in state["compiled"]])
+    issues = pd.concat(state["issues"], ignore_index=True) if state["issues"] else pd.DataFrame()
+    return summary, issues
+
+# ---------- 参照完整性（主数据索引） ----------
+# 每个主数据键列只保留“规范化编码的 64 位哈希”的有序唯一数组（8 字节/编码），按文件内容缓存复用；
+# 事实表按块 searchsorted 批量判定是否存在。规范化/哈希只对每块去重后的取值做一次。
+@st.cache_data(show_spinner=False)
+def master_tables(file_key, name, _raw) -> dict:
+    """主数据文件 → {表名: DataFrame}；Excel 逐 Sheet 读取（跳过下拉项 ref 表）。"""
+    stem = os.path.splitext(name)[0]
+    if name.lower().endswith(".csv"):
+        return {stem: pd.read_csv(io.BytesIO(_raw), dtype=str)}
+    sheets = pd.read_excel(io.BytesIO(_raw), sheet_name=None, dtype=str)
+    return {f"{stem}:{name}": d for name, d in sheets.items() if name != "ref"}
+
+def _norm_code_hashes(values: pd.Index) -> np.ndarray:
+    return pd.util.hash_array(pd.Series(values).astype(str).str.strip().str.upper().to_numpy(dtype=object))
+
+@st.cache_data(show_spinner=False)
+def master_index(file_key, table, column, _df) -> np.ndarray:
+    return np.unique(_norm_code_hashes(pd.Index(_df[column].dropna().unique())))
+
+def _canon_field(name: str) -> str:
+    n = re.sub(r"[^0-9a-z]", "", str(name).lower())
+    return n[:-4] if n.endswith("code") and len(n) > 4 else n
+
+def ri_init(checks: list) -> dict:
+    return {"checks": checks, "checked": [0] * len(checks), "orphans": [{} for _ in checks]}
+
+def ri_update(state: dict, chunk: pd.DataFrame, offset: int):
+    for i, chk in enumerate(state["checks"]):
+        if chk["fact_column"] not in chunk.columns:
+            continue
+        codes, uniques = pd.factorize(chunk[chk["fact_column"]])
+        if not len(uniques):
+            continue
+        h, idx = _norm_code_hashes(uniques), chk["index"]
+        found = (idx[np.minimum(np.searchsorted(idx, h), len(idx) - 1)] == h) if len(idx) else np.zeros(len(h), bool)
+        state["checked"][i] += int((codes >= 0).sum())
+        miss_u = np.flatnonzero(~found)
+        if not len(miss_u):
+            continue
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        # factorize 按首次出现顺序编号：某位置是该编码首次出现 ⇔ 编码大于此前的最大编码
+        first_pos = np.flatnonzero(codes > np.maximum.accumulate(np.r_[-1, codes[:-1]]))
+        acc = state["orphans"][i]
+        for u in miss_u:
+            v = str(uniques[u])
+            c, r = acc.get(v, (0, offset + int(first_pos[u])))
+            acc[v] = (c + int(counts[u]), r)
+
+def ri_result(state: dict, fact_table: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    summary, orphans = [], []
+    for chk, n, acc in zip(state["checks"], state["checked"], state["orphans"]):
+        summary.append({"fact_table": fact_table, "fact_column": chk["fact_column"], "master": chk["master"],
+                        "master_column": chk["master_column"], "master_codes": len(chk["index"]),
+                        "checked": n, "orphan_rows": sum(c for c, _ in acc.values()), "orphan_codes": len(acc)})
+        orphans += [{"fact_table": fact_table, "fact_column": chk["fact_column"], "master": chk["master"],
+                     "value": v, "rows": c, "first_row": r} for v, (c, r) in acc.items()]
+    orphans = pd.DataFrame(orphans)
+    if not orphans.empty:
+        orphans = orphans.sort_values("rows", ascending=False, ignore_index=True)
+    return pd.DataFrame(summary), orphans
+
+NULL_DETAIL_MAX_ROWS = 10_000   # 流式模式下空值明细最多保留的行数
+
+with st.sidebar:
+    dq_file = st.file_uploader("上传 dq_rules.json（可选，默认读取仓库内置文件）", type=["json"])
+    master_files = st.file_uploader("上传主数据（vendors.csv / master_data_templates.xlsx，可多选）",
+                                    type=["csv","xlsx"], accept_multiple_files=True)
+compiled_rules, rule_errors = compile_rules(load_dq_rules(dq_file))
+for err in rule_errors:
+    st.sidebar.warning(f"规则无法编译，已跳过：{err}")
+
 left, right = st.columns([1.2, 1])
 with left:
     file = st.file_uploader("上传数据文件（CSV/XLSX）", type=["csv","xlsx","xls"])
+    server_files = data_dir_files()
+    local_pick = (st.selectbox("或：服务器数据目录中的文件（超出上传限制的大文件）", ["（不使用）"] + server_files)
+                  if server_files else "（不使用）")
+    src = file if file else (data_dir_path(local_pick) if local_pick != "（不使用）" else None)
+    if local_pick != "（不使用）" and not file and src is None:
+        st.warning(f"无法读取：{local_pick}")
     keys = st.multiselect("主键/唯一性检查字段（可多选）", [])
-    if file:
-        df = read_any(file)
-        st.success(f"读取成功：{df.shape[0]} 行 × {df.shape[1]} 列")
+    if src:
+        size = os.path.getsize(src) if isinstance(src, str) else src.size
+        stream = st.checkbox("大文件模式（分块流式处理，不整表载入内存）", value=size > LARGE_FILE_BYTES)
+        df = read_any(src, nrows=200 if stream else None)
         st.dataframe(df.head(10), use_container_width=True)
         # 根据文件列名更新 keys 选项
         keys = st.multiselect("主键/唯一性检查字段（可多选）", options=df.columns.tolist(), default=[df.columns[0]])
-        prof = profile(df)
-        dupes = find_dupes(df, keys)
-        null_detail = df.loc[:, df.columns[df.isna().any()]].copy()
-        # 规则示例：发票号与供应商编码的格式检查（可按需扩展）
-        rule_issues = []
-        if "invoice_no" in df.columns:
-            bad = ~df["invoice_no"].astype(str).str.match(r"^[A-Za-z0-9\-\_/]{3,}$", na=False)
-            if bad.any(): rule_issues.append(df.loc[bad, ["invoice_no"]].assign(rule="invoice_no 格式非法"))
-        if "vendor_code" in df.columns:
-            bad = ~df["vendor_code"].astype(str).str.match(r"^[A-Za-z0-9]{3,}$", na=False)
-            if bad.any(): rule_issues.append(df.loc[bad, ["vendor_code"]].assign(rule="vendor_code 格式非法"))
-        rule_df = pd.concat(rule_issues, ignore_index=True) if rule_issues else pd.DataFrame()
+        # 参照完整性：为每张主数据表选择键列，以及要校验的事实表字段（按字段名自动预选）
+        ri_checks = []
+        if master_files:
+            with st.expander("参照完整性检查（事实表字段 → 主数据键）", expanded=True):
+                for mi, mf in enumerate(master_files):
+                    raw = mf.getvalue()
+                    fkey = hashlib.sha1(raw).hexdigest()
+                    for table, mdf in master_tables(fkey, mf.name, raw).items():
+                        if mdf.empty:
+                            continue
+                        mcols = mdf.columns.tolist()
+                        guess = next((c for c in mcols if str(c).lower().replace("_", "").endswith("code")), mcols[0])
+                        mc1, mc2 = st.columns(2)
+                        mkey = mc1.selectbox(f"{table} 键列", mcols, index=mcols.index(guess), key=f"ri_key_{mi}_{table}")
+                        facts = mc2.multiselect(f"校验字段 → {table}.{mkey}", df.columns.tolist(),
+                                                default=[c for c in df.columns if _canon_field(c) == _canon_field(mkey)],
+                                                key=f"ri_fact_{mi}_{table}")
+                        ri_checks += [{"fact_column": c, "master": table, "master_column": mkey,
+                                       "index": master_index(fkey, table, mkey, mdf)} for c in facts]
+        if stream:
+            # 单次遍历文件：画像、主键列、规则异常、空值行同时累计
+            state, hash_parts, null_parts, null_rows = profile_init(), [], [], 0
+            rstate, ristate = rules_init(compiled_rules), ri_init(ri_checks)
+            with ThreadPoolExecutor(max_workers=RULE_WORKERS) as pool:
+                for chunk in iter_chunks(src):
+                    ri_update(ristate, chunk, state["rows"])
+                    profile_update(state, chunk)
+                    if keys: hash_parts.append(key_hashes(chunk, keys))
+                    rules_update(rstate, chunk, pool)
+                    if null_rows < NULL_DETAIL_MAX_ROWS:
+                        part = chunk[chunk.isna().any(axis=1)].head(NULL_DETAIL_MAX_ROWS - null_rows)
+                        null_parts.append(part); null_rows += len(part)
+            prof, n_rows = profile_result(state), state["rows"]
+            cand = dup_candidates(hash_parts)
+            # 仅当存在指纹重复时才做第二遍精确复核
+            dup_groups, dupes = (resolve_dupes(iter_chunks(src), keys, cand) if len(cand)
+                                 else (pd.DataFrame(), pd.DataFrame()))
+            null_detail = pd.concat(null_parts) if null_parts else pd.DataFrame()
+            null_detail = null_detail.loc[:, null_detail.isna().any()] if not null_detail.empty else null_detail
+        else:
+            state = profile_init()
+            profile_update(state, df)
+            prof, n_rows = profile_result(state), state["rows"]
+            dup_groups, dupes = find_dupes(df, keys)
+            null_detail = df.loc[:, df.columns[df.isna().any()]].copy()
+            rstate, ristate = rules_init(compiled_rules), ri_init(ri_checks)
+            with ThreadPoolExecutor(max_workers=RULE_WORKERS) as pool:
+                rules_update(rstate, df, pool)
+            ri_update(ristate, df, 0)
+        st.success(f"读取成功：{n_rows} 行 × {df.shape[1]} 列")
+        rule_summary, rule_df = rules_result(rstate)
+        ri_summary, ri_orphans = ri_result(ristate, os.path.basename(_src_name(src)))
 
         with right:
             st.markdown("### 字段画像（数据字典）")
@@ -79,15 +538,60 @@ with left:
             st.markdown("### 质量问题摘要")
             c1, c2, c3 = st.columns(3)
             c1.metric("空值列数", int((prof["nulls"]>0).sum()))
-            c2.metric("重复主键行", 0 if dupes.empty else dupes.shape[0])
-            c3.metric("规则异常数", 0 if rule_df.empty else rule_df.shape[0])
+            c2.metric("重复主键行", 0 if dupes.empty else dupes.shape[0],
+                      help=f"{0 if dup_groups.empty else dup_groups.shape[0]} 组重复主键")
+            c3.metric("规则异常数", 0 if rule_summary.empty else int(rule_summary["violations"].sum()))
+            if not rule_summary.empty:
+                with st.expander(f"规则执行摘要（{len(rule_summary)} 条规则）"):
+                    st.dataframe(rule_summary, use_container_width=True, height=240)
+            if not ri_summary.empty:
+                st.markdown("### 参照完整性（主数据缺失）")
+                st.dataframe(ri_summary, use_container_width=True, height=160)
+                if not ri_orphans.empty:
+                    st.dataframe(ri_orphans.head(1000), use_container_width=True, height=200)
+            if not dup_groups.empty:
+                with st.expander(f"重复主键组（{dup_groups.shape[0]} 组）"):
+                    st.dataframe(dup_groups, use_container_width=True, height=240)
+
+            st.markdown("### 画像快照与漂移")
+            dataset = st.text_input("数据集名称（快照按名称归档）",
+                                    os.path.splitext(os.path.basename(_src_name(src)))[0])
+            snapshot = build_snapshot(state, dataset, os.path.basename(_src_name(src)))
+            if st.button("保存本次画像快照"):
+                st.toast(f"已保存：{save_snapshot(snapshot)}", icon="💾")
+            history = list_snapshots(dataset)
+            drift = pd.DataFrame()
+            if history:
+                base_name = st.selectbox("对比基线（历史快照）", history)
+                with st.expander("漂移阈值"):
+                    th1, th2, th3, th4 = st.columns(4)
+                    null_pp = th1.number_input("空值率变化（百分点）", min_value=0.0, value=5.0, step=1.0)
+                    card_ratio = th2.number_input("基数倍数", min_value=1.0, value=1.5, step=0.1)
+                    dist_thr = th3.number_input("分布漂移（PSI/TVD）", min_value=0.0, value=0.2, step=0.05)
+                    overlap_min = th4.number_input("值域重合度下限（Jaccard）", min_value=0.0, max_value=1.0,
+                                                   value=0.5, step=0.05,
+                                                   help="本次与基线不同值集合的交集/并集（HLL 估计，约 ±3%）")
+                t0 = time.perf_counter()
+                base_snap = load_snapshot(dataset, base_name)
+                drift = compare_snapshots(snapshot, base_snap, null_pp, card_ratio, dist_thr, overlap_min)
+                st.caption(f"基线 {base_snap['created_at']}（{base_snap['rows']} 行）→ 本次 {snapshot['rows']} 行；"
+                           f"比较耗时 {(time.perf_counter() - t0) * 1000:.1f} ms")
+                st.dataframe(drift, use_container_width=True, height=240)
+            else:
+                st.caption("该数据集暂无历史快照，保存后即可在下次加载时比较漂移。")
 
             st.markdown("#### 下载完整报告")
             report = to_excel_bytes({
                 "data_dictionary": prof,
+                "duplicate_groups": dup_groups if not dup_groups.empty else pd.DataFrame({"msg":["无重复"]}),
                 "duplicates": dupes if not dupes.empty else pd.DataFrame({"msg":["无重复"]}),
                 "null_columns": null_detail if not null_detail.empty else pd.DataFrame({"msg":["无空值"]}),
+                **({"ri_summary": ri_summary,
+                    "ri_orphans": ri_orphans if not ri_orphans.empty else pd.DataFrame({"msg":["无主数据缺失"]})}
+                   if not ri_summary.empty else {}),
+                "rule_summary": rule_summary if not rule_summary.empty else pd.DataFrame({"msg":["未配置规则"]}),
                 "rule_issues": rule_df if not rule_df.empty else pd.DataFrame({"msg":["无规则异常"]}),
+                **({"drift": drift} if not drift.empty else {}),
                 "sample_data": df.head(200)
             })
             st.download_button(
@@ -98,3 +602,5 @@ with left:
             )
     else:
         st.info("请在左侧上传数据，或先到『对账自动化 Demo』导出差异表再回这里分析。")
+
+_timer.done()
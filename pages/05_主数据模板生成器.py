@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
+from page_timing import PageTimer
+_timer = PageTimer("05_主数据模板生成器")   # 先于重模块导入，冷启动计入导入耗时
 import io
-import pandas as pd
+import os
+from datetime import date
+
 import streamlit as st
 
+from master_templates import (ERROR_COLS, TEMPLATE_COLUMNS, TEMPLATE_EXAMPLES, bulk_statements_zip,
+                              ingest_templates, merge_master, statement_groups, write_ref_sheet)
+
 st.set_page_config(page_title="主数据模板生成器", page_icon="📘", layout="centered")
 st.title("主数据模板生成器")
 st.caption("一键生成供应商/成本中心/物料模板（含下拉校验、示例行）。下载为 Excel 发给业务同事填报。")
@@ -11,24 +18,15 @@ sheet_types = st.multiselect("选择要生成的模板 Sheet", ["供应商（ven
                              default=["供应商（vendors）","成本中心（cost_centers）"])
 
 def build_excel(selected: list) -> bytes:
+    import pandas as pd   # 仅生成/导入时需要，延迟导入以加快页面首开
     buf = io.BytesIO()
     with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
         wb = w.book
         # 维表/下拉项
-        dv_sheet = wb.add_worksheet("ref")
-        regions = ["CN","JP","US","EU"]
-        currency = ["CNY","JPY","USD","EUR"]
-        pay_terms = ["30","45","60","90"]
-        dv_sheet.write_column(0,0, regions)
-        dv_sheet.write_column(0,1, currency)
-        dv_sheet.write_column(0,2, pay_terms)
+        write_ref_sheet(wb)
 
         if "供应商（vendors）" in selected:
-            df = pd.DataFrame([{
-                "vendor_code":"V0001", "vendor_name":"示例供应商",
-                "region":"JP", "currency":"JPY", "payment_term":"30",
-                "bank_account":"XXXX-XXXX-XXXX", "swift":"ABCDEF12"
-            }])
+            df = pd.DataFrame([TEMPLATE_EXAMPLES["vendors"]])
             df.to_excel(w, index=False, sheet_name="vendors")
             ws = w.sheets["vendors"]
             # 下拉校验
@@ -37,15 +35,11 @@ def build_excel(selected: list) -> bytes:
             ws.data_validation(1,4, 1000,4, {"validate":"list","source":"=ref!$C$1:$C$100"})
 
         if "成本中心（cost_centers）" in selected:
-            df = pd.DataFrame([{
-                "cc_code":"CC1001","cc_name":"销售部","dept":"Sales","owner":"张三","status":"Active"
-            }])
+            df = pd.DataFrame([TEMPLATE_EXAMPLES["cost_centers"]])
             df.to_excel(w, index=False, sheet_name="cost_centers")
 
         if "物料（items）" in selected:
-            df = pd.DataFrame([{
-                "item_code":"ITM-001","item_name":"办公用品","uom":"PCS","category":"Office","status":"Active"
-            }])
+            df = pd.DataFrame([TEMPLATE_EXAMPLES["items"]])
             df.to_excel(w, index=False, sheet_name="items")
     return buf.getvalue()
 
@@ -54,3 +48,70 @@ if st.button("生成并下载 Excel 模板", type="primary"):
     st.download_button("下载主数据模板.xlsx", data=data,
         file_name="master_data_templates.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+# ---------- 回收模板批量导入 ----------
+st.divider()
+st.subheader("回收模板批量导入")
+st.caption("一次上传业务同事填回的多份 master_data_templates.xlsx：多进程只读流式解析，按 ref 下拉项与编码格式校验，"
+           "跨提交去重（同编码内容不同时以后上传者为准），输出合并主数据与错误报告。")
+
+def merge_report(merged: dict, errors: list) -> tuple:
+    """合并结果与错误/冲突 → (错误表, 合并主数据与错误报告 xlsx)。"""
+    import pandas as pd   # 仅校验合并时需要，延迟导入以加快页面首开
+    err_df = pd.DataFrame(errors, columns=ERROR_COLS)
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
+        for sheet, rows in merged.items():
+            pd.DataFrame(rows, columns=TEMPLATE_COLUMNS[sheet] + ["source_file"]).to_excel(w, index=False, sheet_name=sheet)
+        err_df.to_excel(w, index=False, sheet_name="errors")
+    return err_df, buf.getvalue()
+
+returned = st.file_uploader("上传回收的模板（可多选）", type=["xlsx"], accept_multiple_files=True)
+ingest_workers = st.number_input("解析进程数", min_value=1, max_value=os.cpu_count() or 1,
+                                 value=min(4, os.cpu_count() or 1), key="ingest_workers")
+if returned and st.button("校验并合并"):
+    bar = st.progress(0.0, text=f"正在解析 {len(returned)} 份模板…")
+    records, errors = ingest_templates([(f.name, f.getvalue()) for f in returned],
+                                       workers=int(ingest_workers), progress=bar.progress)
+    merged, conflicts = merge_master(records)
+    err_df, report = merge_report(merged, errors + conflicts)
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("文件数", len(returned))
+    m2.metric("合并后主数据行", sum(len(v) for v in merged.values()))
+    m3.metric("错误/冲突", len(err_df))
+    for sheet, rows in merged.items():
+        if rows:
+            st.markdown(f"**{sheet}**（{len(rows)} 行）")
+            st.dataframe(rows[:200], use_container_width=True)
+    if not err_df.empty:
+        st.markdown("**错误报告**")
+        st.dataframe(err_df.head(500), use_container_width=True)
+    st.download_button("下载合并主数据与错误报告.xlsx", data=report, file_name="master_data_merged.xlsx",
+                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+# ---------- 批量生成供应商对账确认函 ----------
+st.divider()
+st.subheader("批量生成供应商对账确认函")
+st.caption("上传『对账自动化 Demo』导出的 reconciliation_results.xlsx：按供应商各生成一份预填差异/缺失明细的确认函"
+           "（含同样的 ref 下拉校验），多进程并行生成并打包为 zip。")
+
+res_file = st.file_uploader("上传 reconciliation_results.xlsx", type=["xlsx"])
+sc1, sc2, sc3 = st.columns(3)
+company = sc1.text_input("我方公司名", "杭州××科技有限公司")
+period = sc2.text_input("对账期间", date.today().strftime("%Y-%m"))
+workers = sc3.number_input("并行进程数", min_value=1, max_value=os.cpu_count() or 1,
+                           value=min(4, os.cpu_count() or 1))
+if res_file is not None and st.button("批量生成确认函（zip）"):
+    groups = statement_groups(res_file)
+    if not groups:
+        st.warning("结果包中没有差异/缺失明细（02~04 Sheet），无需生成确认函。")
+    else:
+        bar = st.progress(0.0, text=f"正在生成 {len(groups)} 份确认函…")
+        data = bulk_statements_zip(groups, {"company": company, "period": period}, workers=int(workers),
+                                   progress=bar.progress)
+        st.success(f"已生成 {len(groups)} 份确认函（{len(data) / 1024 / 1024:.1f} MB）")
+        st.download_button("下载供应商确认函.zip", data=data, file_name=f"vendor_statements_{period}.zip",
+                           mime="application/zip")
+
+_timer.done()
@@ -1,98 +1,245 @@
 # -*- coding: utf-8 -*-
+from page_timing import PageTimer
+_timer = PageTimer("06_RPA_对账机器人_UiPath_Demo")   # 先于重模块导入，冷启动计入导入耗时
 import io
-import pandas as pd
+import json
+import os
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+
 import streamlit as st
 
 st.set_page_config(page_title="RPA 对账机器人 Demo（UiPath）", page_icon="🤖", layout="wide")
 st.title("RPA 对账机器人 Demo（UiPath）")
 st.caption("下载 UiPath 资产（Main.xaml + 示例 Excel），按步骤在本地 UiPath Studio 运行；本页提供讲解脚本与附件。")
 
-# --- 示例 Excel 构造 ---
+# --- 示例 Excel 构造（数据量极小，直接用 xlsxwriter 写出，页面无需加载 pandas） ---
 def demo_invoices():
-    df = pd.DataFrame({
+    return {
         "vendor":["V0001","V0001","V0003","V0005"],
         "invoice_no":["INV001","INV002","INV077","INV088"],
         "amount":[10000,5000,5600,1300],
         "currency":["JPY","JPY","JPY","CNY"]
-    })
-    return df
+    }
 
 def demo_ledger():
-    df = pd.DataFrame({
+    return {
         "vendor":["V0001","V0001","V0003"],
         "invoice_no":["INV001","INV002","INV077"],
         "amount":[10000,4800,5600],
         "currency":["JPY","JPY","JPY"]
-    })
-    return df
+    }
 
 def to_excel_bytes(sheets: dict):
+    """sheets: {"SheetName": {列名: [值, ...]}} → xlsx bytes"""
+    import xlsxwriter
     buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
-        for name, df in sheets.items():
-            df.to_excel(w, index=False, sheet_name=name[:31] or "Sheet1")
+    wb = xlsxwriter.Workbook(buf, {"in_memory": True})
+    for name, cols in sheets.items():
+        ws = wb.add_worksheet(name[:31] or "Sheet1")
+        for c, (header, values) in enumerate(cols.items()):
+            ws.write(0, c, header)
+            ws.write_column(1, c, values)
+    wb.close()
     return buf.getvalue()
 
-# --- 极简 Main.xaml（UiPath） ---
-Uipath_XAML = """<?xml version="1.0" encoding="utf-8"?>
+@st.cache_data(show_spinner=False)
+def demo_xlsx(kind: str, sheet: str) -> bytes:
+    """示例文件为静态资源：每个进程（每个 Sheet 名）只生成一次。"""
+    return to_excel_bytes({sheet: demo_invoices() if kind == "invoices" else demo_ledger()})
+
+# --- 由 rules.json 生成 Main.xaml（UiPath） ---
+DEFAULT_RULES = {
+    "datasets": {"left_name": "invoices", "right_name": "ledger"},
+    "column_mapping": {
+        "left": {"vendor": "vendor", "invoice_no": "invoice_no", "amount": "amount", "currency": "currency"},
+        "right": {"vendor": "vendor", "invoice_no": "invoice_no", "amount": "amount", "currency": "currency"},
+    },
+    "primary_key": ["vendor", "invoice_no", "currency"],
+    "tolerance": {"mode": "both", "absolute": {"value": 10.0, "per_currency": {"JPY": 10.0, "CNY": 5.0}},
+                  "percent": {"value": 0.5}},
+    "rounding": {"amount_decimals": 2},
+}
+
+def load_rules(file) -> dict:
+    """上传的 rules.json → 项目根目录 rules.json → 内置默认（与规则配置器同结构）。"""
+    try:
+        if file is not None:
+            return json.load(file)
+        if not os.path.exists("rules.json"):
+            return DEFAULT_RULES
+        with open("rules.json", "r", encoding="utf-8-sig") as f:   # 规则配置器导出的文件带 BOM
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        st.warning(f"rules.json 解析失败（{e}），已改用内置默认规则生成。")
+        return DEFAULT_RULES
+
+def _vb_str(s) -> str:
+    return '"' + str(s).replace('"', '""') + '"'
+
+def _vb_dec(x) -> str:
+    return format(Decimal(str(x)), "f") + "D"
+
+def _vb_cols(cols: list) -> str:
+    return "{" + ", ".join(_vb_str(c) for c in cols) + "}"
+
+def bot_diff_code(rules: dict) -> str:
+    """生成 InvokeCode 中的 VB.NET：复合键字典聚合 + O(1) 查找 + 容差判断，整体随行数线性。
+    primary_key 中有 column_mapping 未映射的字段时抛出 ValueError。"""
+    keys = rules.get("primary_key") or ["vendor", "invoice_no", "currency"]
+    mapping = rules.get("column_mapping", {})
+    left = {**DEFAULT_RULES["column_mapping"]["left"], **mapping.get("left", {})}
+    right = {**DEFAULT_RULES["column_mapping"]["right"], **mapping.get("right", {})}
+    unmapped = [k for k in keys if k not in left or k not in right]
+    if unmapped:
+        raise ValueError(f"primary_key 中的字段 {', '.join(map(str, unmapped))} 未在 column_mapping 中映射")
+    tol = rules.get("tolerance", {})
+    mode = tol.get("mode", "both")
+    per_ccy = tol.get("absolute", {}).get("per_currency", {}) or {}
+    decimals = int(rules.get("rounding", {}).get("amount_decimals", 2))
+    ccy_idx = keys.index("currency") if "currency" in keys else -1
+
+    abs_ok = "Math.Abs(a - b) <= If(absByCcy.ContainsKey(ccy), absByCcy(ccy), absDefault)"
+    pct_ok = "Math.Abs(a - b) / Math.Max(Math.Abs(b), 0.000000001D) <= pctTol"
+    within = {"absolute": abs_ok, "percent": pct_ok}.get(mode, f"({abs_ok}) AndAlso ({pct_ok})")
+    ccy_init = ", ".join("{" + f"{_vb_str(str(c).upper())}, {_vb_dec(v)}" + "}" for c, v in per_ccy.items())
+    key_cols = "\n".join(f"dtDiff.Columns.Add({_vb_str(k)})" for k in keys)
+    return f"""' 由 rules.json 自动生成：主键 {"+".join(keys)}，容差模式 {mode}
+Dim sep As String = ChrW(31)
+Dim absDefault As Decimal = {_vb_dec(tol.get("absolute", {}).get("value", 0.0))}
+Dim absByCcy As New Dictionary(Of String, Decimal){" From {" + ccy_init + "}" if ccy_init else ""}
+Dim pctTol As Decimal = {_vb_dec(float(tol.get("percent", {}).get("value", 0.0)) / 100.0)}
+Dim toDec As Func(Of Object, Decimal) = Function(v) If(IsDBNull(v) OrElse v.ToString.Trim = "", 0D, Convert.ToDecimal(v))
+Dim build As Func(Of DataTable, String(), String, Dictionary(Of String, Decimal)) =
+    Function(dt, cols, amt)
+        Dim d As New Dictionary(Of String, Decimal)(dt.Rows.Count)
+        For Each r As DataRow In dt.Rows
+            Dim k As String = String.Join(sep, cols.Select(Function(c) r(c).ToString.Trim.ToUpperInvariant))
+            Dim v As Decimal = toDec(r(amt))
+            Dim cur As Decimal
+            d(k) = If(d.TryGetValue(k, cur), cur + v, v)
+        Next
+        Return d
+    End Function
+Dim inv = build(dtInv, New String() {_vb_cols([left[k] for k in keys])}, {_vb_str(left["amount"])})
+Dim led = build(dtLed, New String() {_vb_cols([right[k] for k in keys])}, {_vb_str(right["amount"])})
+
+dtDiff = New DataTable("diff")
+{key_cols}
+dtDiff.Columns.Add("amount_inv", GetType(Decimal))
+dtDiff.Columns.Add("amount_bill", GetType(Decimal))
+dtDiff.Columns.Add("diff", GetType(Decimal))
+dtDiff.Columns.Add("status")
+Dim addRow As Action(Of String, Object, Object, String) =
+    Sub(k, ai, ab, st)
+        Dim vals As New List(Of Object)(k.Split(sep.Chars(0)))
+        vals.Add(ai) : vals.Add(ab)
+        vals.Add(If(ai Is Nothing OrElse ab Is Nothing, CType(Nothing, Object), CDec(ai) - CDec(ab)))
+        vals.Add(st)
+        dtDiff.Rows.Add(vals.ToArray())
+    End Sub
+dtDiff.BeginLoadData()
+For Each kv In inv
+    Dim a As Decimal = Math.Round(kv.Value, {decimals})
+    Dim bRaw As Decimal
+    If Not led.TryGetValue(kv.Key, bRaw) Then
+        addRow(kv.Key, a, Nothing, "Missing_Bill")
+        Continue For
+    End If
+    Dim b As Decimal = Math.Round(bRaw, {decimals})
+    Dim ccy As String = {"kv.Key.Split(sep.Chars(0))(" + str(ccy_idx) + ")" if ccy_idx >= 0 else '""'}
+    If Not ({within}) Then addRow(kv.Key, a, b, "Mismatch")
+Next
+For Each kv In led
+    If Not inv.ContainsKey(kv.Key) Then addRow(kv.Key, Nothing, Math.Round(kv.Value, {decimals}), "Missing_Invoice")
+Next
+dtDiff.EndLoadData()"""
+
+def build_main_xaml(rules: dict) -> str:
+    """Workbook 级 ReadRange/WriteRange（不启动 Excel 进程）+ InvokeCode 字典对账 + 一次性整表写出。"""
+    ds = {**DEFAULT_RULES["datasets"], **rules.get("datasets", {})}
+    code = escape(bot_diff_code(rules), {'"': "&quot;", "\n": "&#xA;"})
+    return f"""<?xml version="1.0" encoding="utf-8"?>
 <Activity x:Class="Main" xmlns="http://schemas.microsoft.com/netfx/2009/xaml/activities"
  xmlns:x="http://schemas.microsoft.com/winfx/2006/xaml"
  xmlns:ui="http://schemas.uipath.com/workflow/activities"
- xmlns:m="clr-namespace:Microsoft.VisualBasic;assembly=System"
+ xmlns:sd="clr-namespace:System.Data;assembly=System.Data"
  DisplayName="Main">
  <Sequence DisplayName="AP Reconciliation">
-  <ui:ExcelApplicationScope DisplayName="Open Invoices.xlsx" WorkbookPath="[in_InvoicePath]">
-   <ui:ReadRange DisplayName="Read Invoices" SheetName="invoices" Range="A1" AddHeaders="True" DataTable="[dtInv]" />
-  </ui:ExcelApplicationScope>
-  <ui:ExcelApplicationScope DisplayName="Open Ledger.xlsx" WorkbookPath="[in_LedgerPath]">
-   <ui:ReadRange DisplayName="Read Ledger" SheetName="ledger" Range="A1" AddHeaders="True" DataTable="[dtLed]" />
-  </ui:ExcelApplicationScope>
-  <!-- 计算差异：发票存在于发票表但不在台账 或 金额不相等 -->
-  <Assign DisplayName="Build Diff">
-    <Assign.To>
-      <OutArgument x:TypeArguments="x:Object">[dtDiff]</OutArgument>
-    </Assign.To>
-    <Assign.Value>
-      [ (From inv In dtInv.AsEnumerable()
-         Group Join led In dtLed.AsEnumerable()
-         On inv("invoice_no").ToString Equals led("invoice_no").ToString
-         Into j=Group
-         From l In j.DefaultIfEmpty()
-         Where l Is Nothing OrElse CDec(inv("amount")) &lt;&gt; CDec(If(l Is Nothing, 0, l("amount")))
-         Select inv).CopyToDataTable() ]
-    </Assign.Value>
-  </Assign>
-  <ui:ExcelApplicationScope DisplayName="Write Diff" WorkbookPath="[out_DiffPath]">
-    <ui:WriteRange DisplayName="Write Diff" DataTable="[dtDiff]" SheetName="diff" StartingCell="A1" AddHeaders="True" />
-  </ui:ExcelApplicationScope>
+  <Sequence.Variables>
+   <Variable x:TypeArguments="x:String" Name="in_InvoicePath" Default="Invoices.xlsx" />
+   <Variable x:TypeArguments="x:String" Name="in_LedgerPath" Default="Ledger.xlsx" />
+   <Variable x:TypeArguments="x:String" Name="out_DiffPath" Default="Diff.xlsx" />
+   <Variable x:TypeArguments="sd:DataTable" Name="dtInv" />
+   <Variable x:TypeArguments="sd:DataTable" Name="dtLed" />
+   <Variable x:TypeArguments="sd:DataTable" Name="dtDiff" />
+  </Sequence.Variables>
+  <!-- Workbook 级读取：直接解析 xlsx，无需 Excel 进程 -->
+  <ui:ReadRange DisplayName="Read Invoices" WorkbookPath="[in_InvoicePath]" SheetName={quoteattr(ds["left_name"])} Range="" AddHeaders="True" DataTable="[dtInv]" />
+  <ui:ReadRange DisplayName="Read Ledger" WorkbookPath="[in_LedgerPath]" SheetName={quoteattr(ds["right_name"])} Range="" AddHeaders="True" DataTable="[dtLed]" />
+  <!-- 复合键字典对账（规则来自 rules.json） -->
+  <ui:InvokeCode DisplayName="Build Diff (dictionary join + tolerance)" Language="VBNet" Code="{code}">
+   <ui:InvokeCode.Arguments>
+    <InArgument x:TypeArguments="sd:DataTable" x:Key="dtInv">[dtInv]</InArgument>
+    <InArgument x:TypeArguments="sd:DataTable" x:Key="dtLed">[dtLed]</InArgument>
+    <OutArgument x:TypeArguments="sd:DataTable" x:Key="dtDiff">[dtDiff]</OutArgument>
+   </ui:InvokeCode.Arguments>
+  </ui:InvokeCode>
+  <!-- 整表一次写出 -->
+  <ui:WriteRange DisplayName="Write Diff" WorkbookPath="[out_DiffPath]" SheetName="diff" StartingCell="A1" AddHeaders="True" DataTable="[dtDiff]" />
  </Sequence>
 </Activity>
 """
 
+@st.cache_data(show_spinner=False)
+def cached_xaml(rules_json: str) -> str:
+    """同一份规则只生成一次 XAML（按规则内容缓存）。"""
+    return build_main_xaml(json.loads(rules_json))
+
+with st.sidebar:
+    rules_file = st.file_uploader("规则文件 rules.json（可选）", type=["json"])
+rules = load_rules(rules_file)
+datasets = {**DEFAULT_RULES["datasets"], **rules.get("datasets", {})}
+try:
+    Uipath_XAML = cached_xaml(json.dumps(rules, sort_keys=True, ensure_ascii=False))
+except ValueError as e:
+    st.error(f"无法按 rules.json 生成 Main.xaml：{e}")
+    Uipath_XAML = None
+
 with st.sidebar:
     st.subheader("一键下载资产")
     st.download_button("下载示例 Invoices.xlsx",
-        data=to_excel_bytes({"invoices": demo_invoices()}),
+        data=demo_xlsx("invoices", datasets["left_name"]),
         file_name="Invoices.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
     st.download_button("下载示例 Ledger.xlsx",
-        data=to_excel_bytes({"ledger": demo_ledger()}),
+        data=demo_xlsx("ledger", datasets["right_name"]),
         file_name="Ledger.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    st.download_button("下载 UiPath Main.xaml", data=Uipath_XAML.encode("utf-8"),
-        file_name="Main.xaml", mime="application/xml")
+    if Uipath_XAML is not None:
+        st.download_button("下载 UiPath Main.xaml", data=Uipath_XAML.encode("utf-8"),
+            file_name="Main.xaml", mime="application/xml")
+
+if Uipath_XAML is not None:
+    with st.expander("查看生成的对账代码（InvokeCode / VB.NET）"):
+        st.caption(f"主键：{' + '.join(rules.get('primary_key') or DEFAULT_RULES['primary_key'])}；"
+                   f"容差模式：{rules.get('tolerance', {}).get('mode', 'both')}（键值去空格、转大写后比较，与对账页一致）")
+        st.code(bot_diff_code(rules), language="vbnet")
 
 st.markdown("### 本地运行步骤（UiPath Studio）")
 st.markdown("""
 1. 新建空白流程 **AP_Recon**，把下载的 **Main.xaml** 覆盖到项目根目录。
-2. 在 **Variables** 面板新增：`in_InvoicePath`、`in_LedgerPath`、`out_DiffPath`（String）。
-3. 在流程开始处给 3 个变量赋值（或使用 **Arguments** 配置）：  
+2. 确认项目依赖含 **UiPath.Excel.Activities**（使用 Workbook 级 Read/Write Range，机器人端无需安装或启动 Excel）。
+3. Main.xaml 已内置变量及默认值（可在 **Variables** 面板修改，或改为 **Arguments**）：  
    - `in_InvoicePath`: `Invoices.xlsx`  
    - `in_LedgerPath`: `Ledger.xlsx`  
    - `out_DiffPath`: `Diff.xlsx`
-4. 运行后生成 `Diff.xlsx`，即为差异清单（缺失或金额不一致）。
+4. 运行后生成 `Diff.xlsx`，即为差异清单（status：Mismatch / Missing_Bill / Missing_Invoice）。
+   比对主键、字段映射、容差与舍入均取自上传（或项目根目录）的 **rules.json**，改规则后重新下载即可。
 5. 演示讲解要点：**批量可扩展 / 与 Orchestrator 结合 / 可换 OCR 模块做票据字段抽取**。
 """)
 
 st.markdown("### 面试讲解脚本（30 秒）")
 st.info("“RPA 端负责**文件读写与自动比对**、异常导出；你现在看到的 Streamlit 端提供**对外展示与交互**。上线后，财务只需把两份表丢进机器人目录，系统 1 分钟给出差异表。”")
+
+_timer.done()
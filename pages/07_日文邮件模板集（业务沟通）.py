@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
-import streamlit as st
+from page_timing import PageTimer
+_timer = PageTimer("07_日文邮件模板集（业务沟通）")   # 先于重模块导入，冷启动计入导入耗时
 from datetime import date
 
+import streamlit as st
+
+from mail_merge import (BULK_TEMPLATES, aging_rows, build_messages, eml_zip, load_contacts, mismatch_rows,
+                        send_batched)
+
 st.set_page_config(page_title="日文邮件模板集（业务沟通）", page_icon="📧", layout="centered")
 st.title("日文邮件模板集（业务沟通）")
 
@@ -82,3 +88,60 @@ f"""{vendor} {person}
 body = jp[scene]
 st.text_area("メール本文（日本語）", body, height=300)
 st.download_button("TXT ダウンロード", body.encode("utf-8"), file_name="mail_jp.txt")
+
+# ---------- 一括差し込み（Bulk mail-merge） ----------
+st.divider()
+st.subheader("一括差し込み / 批量邮件合并")
+st.caption("上传对账结果（02_Mismatches）或应付明细，按供应商分组，每个供应商一封邮件（明细逐行列出），"
+           "打包为 .eml zip 下载；可选通过 SMTP 分批发送（同一批复用一个连接）。")
+bulk_scene = st.radio("テンプレート", list(BULK_TEMPLATES), horizontal=True)
+bc1, bc2 = st.columns(2)
+if bulk_scene == "金額差異のご確認":
+    src_file = bc1.file_uploader("对账结果 reconciliation_results.xlsx", type=["xlsx"])
+    within = 0
+else:
+    src_file = bc1.file_uploader("应付明细 CSV（InvoiceID, VendorCode, DueDate, Amount[, PaidAmount]）", type=["csv"])
+    within = bc1.number_input("到期前提醒天数", 0, 90, 7)
+contacts_file = bc2.file_uploader("联系人 CSV（vendor, email, person）", type=["csv"])
+sender = bc2.text_input("差出人メールアドレス", "ap@example.com")
+
+with st.expander("SMTP 送信（任意）"):
+    do_send = st.checkbox("生成后同时发送（跳过无邮箱的供应商）")
+    sm1, sm2, sm3 = st.columns(3)
+    smtp_host = sm1.text_input("SMTP Host", "localhost")
+    smtp_port = sm2.number_input("Port", 1, 65535, 1025)
+    smtp_batch = sm3.number_input("每连接发送封数", 1, 1000, 100)
+    sm4, sm5, sm6 = st.columns(3)
+    smtp_user = sm4.text_input("用户名（可空）", "")
+    smtp_pass = sm5.text_input("密码", "", type="password")
+    smtp_tls = sm6.checkbox("STARTTLS")
+    st.caption("本地测试可先启动替身服务器：python -m aiosmtpd -n -l localhost:1025")
+
+if src_file is not None and st.button("一括生成（.eml zip）"):
+    try:
+        rows = (mismatch_rows(src_file) if bulk_scene == "金額差異のご確認"
+                else aging_rows(src_file, today, int(within), ccy))
+    except (ValueError, KeyError) as e:
+        st.error(f"无法读取 {src_file.name}：{e}")
+        rows = None
+    if rows is None:
+        pass
+    elif rows.empty:
+        st.info("没有需要通知的明细。")
+    else:
+        msgs = build_messages(rows, bulk_scene, sender, load_contacts(contacts_file),
+                              {"myco": myco, "myper": myper, "today": today})
+        no_mail = sum(1 for _, m in msgs if not m["To"])
+        st.success(f"已生成 {len(msgs)} 封邮件（{len(rows)} 行明细）；无邮箱 {no_mail} 家。")
+        st.text_area("プレビュー（1通目）", msgs[0][1].get_content(), height=240)
+        st.download_button("下载 .eml（zip）", eml_zip(msgs), file_name=f"mails_{today}.zip",
+                           mime="application/zip")
+        if do_send:
+            bar = st.progress(0.0, text="SMTP 发送中…")
+            sent, failed = send_batched(msgs, smtp_host, int(smtp_port), int(smtp_batch),
+                                        smtp_user, smtp_pass, smtp_tls, progress=bar.progress)
+            st.write(f"已发送 {sent} 封，失败 {len(failed)} 封。")
+            if failed:
+                st.dataframe([dict(zip(("vendor", "to", "error"), f)) for f in failed], use_container_width=True)
+
+_timer.done()
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from page_timing import PageTimer
+_timer = PageTimer("08_双语SOP（对账流程）")   # 先于重模块导入，冷启动计入导入耗时
 import io
 import streamlit as st
 
@@ -9,6 +11,7 @@ lang = st.radio("语言 / Language", ["中文", "日本語", "双语"], horizont
 scope = st.multiselect("流程范围（可选）", ["发票接收与校验","账单/台账准备","自动对账与复核","异常沟通与闭环","归档与交接"],
                        default=["发票接收与校验","自动对账与复核","异常沟通与闭环"])
 
+@st.cache_data(show_spinner=False)
 def sop_cn():
     return f"""# 对账流程 SOP（中文）
 ## 1. 发票接收与校验
@@ -37,6 +40,7 @@ def sop_cn():
 - 每月复盘改进点
 """
 
+@st.cache_data(show_spinner=False)
 def sop_jp():
     return """# 照合手順書（日本語）
 
@@ -74,3 +78,5 @@ st.markdown(md)
 st.download_button("下载为 Markdown（.md）", data=md.encode("utf-8"),
                    file_name="SOP_AP_Reconciliation.md",
                    mime="text/markdown")
+
+_timer.done()
@@ -2,19 +2,26 @@
 """
 规则引擎配置器（第 9 页）
 用途：通过可视化表单生成对账规则 rules.json，供“对账自动化 Demo”页面读取并应用。
-仅依赖：streamlit、pandas（可选，仅用于表格编辑），标准库 json/datetime/io。
+仅依赖：streamlit、pandas、numpy（表格编辑与容差模拟），标准库 json/datetime/io。
 """
+from page_timing import PageTimer
+_timer = PageTimer("09_规则引擎配置器")   # 先于重模块导入，冷启动计入导入耗时
 import json
 import io
+import os
+from contextlib import closing
 from datetime import datetime
 from typing import List, Dict, Any
 
+import numpy as np
 import streamlit as st
 import pandas as pd
 
+from recon_history import HISTORY_DB, connect as history_connect, list_runs, run_results
+
 st.set_page_config(page_title="规则引擎配置器（对账）", page_icon="🧩", layout="wide")
 st.title("🧩 规则引擎配置器（对账）")
-st.caption("定义【主键/字段映射/容差/日期/舍入/供应商别名/币种汇率/重复处理/模糊匹配】并导出为 rules.json。\
+st.caption("定义【主键/字段映射/容差/日期/舍入/供应商别名/币种汇率/重复处理/模糊匹配/发票号容错】并导出为 rules.json。\
 可导入既有 rules.json 进行编辑。")
 
 # -------------------- 工具函数 --------------------
@@ -83,6 +90,14 @@ def _rules_default() -> Dict[str, Any]:
             "fields": ["vendor"],
             "threshold": 0.9  # 0~1
         },
+        # 发票号规范化与容错（对账页在精确匹配后对单边行按编辑距离配对）
+        "invoice_no": {
+            "canonicalize": True,
+            "separators": "-_/. ",
+            "prefixes": [],
+            "fuzzy_max_edits": 1,
+            "fuzzy_require_amount": True
+        },
         # 其它
         "options": {
             "allow_negative_amount": True,
@@ -178,6 +193,165 @@ per_ccy_df = st.data_editor(per_ccy_df, num_rows="dynamic", use_container_width=
                             column_config={"currency": st.column_config.TextColumn("币种", help="如 JPY/CNY/USD/EUR")},
                             key="abs_per_ccy")
 
+# -------------------- 容差模拟（what-if） --------------------
+SIM_ABS_GRID = [0, 0.01, 0.1, 1, 5, 10, 50, 100, 500, 1000]
+SIM_PCT_GRID = [0, 0.01, 0.05, 0.1, 0.5, 1, 2, 5]          # 单位：%
+SIM_LEAF = 256                                              # merge-sort tree 最小块：更短的前缀尾部直接线性计数
+
+def _sim_frame(source: str, data: bytes | None) -> pd.DataFrame:
+    """历史批次或上传的对账结果（对账页导出的 00_Merged / CSV）→ currency, amount_inv, amount_bill。"""
+    cols = ["currency", "amount_inv", "amount_bill"]
+    if source.startswith("run:"):        # run:<run_id>:<content_hash>
+        with closing(history_connect()) as con:
+            return run_results(con, int(source.split(":")[1]))[cols]
+    buf = io.BytesIO(data)
+    if source.lower().endswith(".csv"):
+        return pd.read_csv(buf, usecols=cols)
+    try:
+        return pd.read_excel(buf, sheet_name="00_Merged", usecols=cols)
+    except ValueError:
+        buf.seek(0)
+        return pd.read_excel(buf, usecols=cols)
+
+def _prefix_tree(ranks: np.ndarray) -> dict:
+    """merge-sort tree：{块长: 该层各对齐块分别升序后的数组}，块长为 SIM_LEAF 起的 2 的幂。
+    上一层已是两段有序，稳定排序（timsort）按归并完成，每层 O(n)。"""
+    tree, size = {}, SIM_LEAF
+    while size <= len(ranks):
+        m = len(ranks) // size * size
+        src = tree.get(size // 2, ranks)
+        tree[size] = np.sort(src[:m].reshape(-1, size), axis=1, kind="stable").ravel()
+        size *= 2
+    return tree
+
+def _prefix_count(s: dict, k: int, t) -> np.ndarray:
+    """按 |差额| 排序的前 k 行中相对差额名次 < t 的条数（t 可为数组）：
+    前缀按二进制拆成各层对齐块，每块二分一次，O(log² n)。"""
+    t = np.asarray(t, dtype=s["rank_by_abs"].dtype)          # 与块同类型，否则 searchsorted 会整块转换
+    cnt, pos = np.zeros(t.shape, dtype=np.int64), 0
+    for size in sorted(s["tree"], reverse=True):
+        if k - pos >= size:
+            cnt += np.searchsorted(s["tree"][size][pos:pos + size], t, side="left")
+            pos += size
+    tail = s["rank_by_abs"][pos:k]                            # 不足 SIM_LEAF 行
+    return cnt + (tail[:, None] < t.ravel()).sum(0).reshape(t.shape)
+
+def _rel_rank(s: dict, pct) -> np.ndarray:
+    """百分比容差 → 相对差额名次阈值：相对差额 ≤ pct/100 ⇔ 名次 < 该值。"""
+    return np.searchsorted(s["rel"], np.asarray(pct, float) / 100, side="right")
+
+@st.cache_resource(show_spinner="载入数据并预计算差额…", max_entries=4)
+def sim_prepare(source: str, decimals: int, _data: bytes | None = None) -> dict:
+    """两边都有金额的行按币种预计算：|差额| 升序、相对差额升序、按 |差额| 排序后的相对差额名次
+    及其 merge-sort tree，以及整张网格的累计匹配数。结果按 source 缓存并在各会话间共享（只读，不可修改）；
+    历史批次的 source 带内容哈希，批次删除后 run_id 被复用也不会取到旧结果。"""
+    df = _sim_frame(source, _data)
+    both = df.dropna(subset=["amount_inv", "amount_bill"])
+    a = both["amount_inv"].to_numpy(float)
+    b = both["amount_bill"].to_numpy(float)
+    diff = np.round(np.abs(a - b), decimals)
+    rel = diff / np.maximum(np.abs(b), 1e-9)                 # rules.json 的 amounts_equal 语义：以账单金额为基数
+    ccy = both["currency"].astype(str).str.strip().str.upper().to_numpy()
+    abs_grid, pct_grid = np.array(SIM_ABS_GRID, float), np.array(SIM_PCT_GRID, float) / 100
+    by_ccy = {}
+    for c in np.unique(ccy):
+        m = ccy == c
+        order = np.argsort(diff[m], kind="stable")
+        rel_by_abs = rel[m][order]
+        s = {"abs": diff[m][order], "rel": np.sort(rel_by_abs)}
+        # both 模式按 |差额| 前缀数相对差额：名次（int32，比较与原值等价）建 merge-sort tree
+        s["rank_by_abs"] = np.searchsorted(s["rel"], rel_by_abs, side="left").astype(np.int32)
+        s["tree"] = _prefix_tree(s["rank_by_abs"])
+        # both 模式的网格：每行按两个网格各二分一次落入单元格，二维累加即得每个组合的匹配数
+        ia = np.searchsorted(abs_grid, s["abs"], side="left")
+        ip = np.searchsorted(pct_grid, rel_by_abs, side="left")
+        keep = (ia < len(abs_grid)) & (ip < len(pct_grid))
+        cells = np.bincount(ia[keep] * len(pct_grid) + ip[keep], minlength=abs_grid.size * pct_grid.size)
+        s["grid_both"] = cells.reshape(abs_grid.size, pct_grid.size).cumsum(0).cumsum(1)
+        by_ccy[c] = s
+    return {"by_ccy": by_ccy, "one_sided": len(df) - len(both)}
+
+def sim_within(s: dict, mode: str, abs_tol: float, pct: float) -> int:
+    """某币种在给定容差下视为匹配的条数（二分查找；both 模式为 O(log² n)）。"""
+    if mode == "absolute":
+        return int(np.searchsorted(s["abs"], abs_tol, side="right"))
+    if mode == "percent":
+        return int(np.searchsorted(s["rel"], pct / 100, side="right"))
+    k = np.searchsorted(s["abs"], abs_tol, side="right")     # both：|差额| 前缀内再数相对差额
+    return int(_prefix_count(s, k, _rel_rank(s, pct)))
+
+def sim_grid(sim: dict, mode: str, per_ccy: dict) -> pd.DataFrame:
+    """整张网格（行=全局绝对容差，列=百分比容差）的匹配条数；有币种覆盖的币种绝对容差固定为覆盖值。"""
+    total = np.zeros((len(SIM_ABS_GRID), len(SIM_PCT_GRID)), dtype=np.int64)
+    for c, s in sim["by_ccy"].items():
+        if mode == "absolute":
+            hits = np.searchsorted(s["abs"], per_ccy.get(c, SIM_ABS_GRID), side="right")
+            total += np.broadcast_to(np.reshape(hits, (-1, 1)), total.shape)
+        elif mode == "percent":
+            total += np.searchsorted(s["rel"], np.array(SIM_PCT_GRID) / 100, side="right")
+        elif c in per_ccy:
+            k = np.searchsorted(s["abs"], per_ccy[c], side="right")
+            total += _prefix_count(s, k, _rel_rank(s, SIM_PCT_GRID))
+        else:
+            total += s["grid_both"]
+    return pd.DataFrame(total, index=[f"≤ {v:g}" for v in SIM_ABS_GRID],
+                        columns=[f"≤ {v:g}%" for v in SIM_PCT_GRID])
+
+def sim_panel(decimals: int):
+    """容差模拟面板；decimals 取“3) 日期/舍入”中舍入位数控件的当前值。"""
+    sim_sources = ["（不加载）"]
+    if os.path.exists(HISTORY_DB):
+        with closing(history_connect()) as con:
+            runs = list_runs(con)
+        run_labels = {f"run:{r.run_id}:{r.content_hash}": f"历史批次 #{r.run_id}（{r.run_date}，{r.n_rows:,} 行）"
+                      for r in runs.itertuples()}
+        sim_sources += list(run_labels)
+    else:
+        run_labels = {}
+    sim_pick = st.selectbox("数据来源", sim_sources, format_func=lambda v: run_labels.get(v, v),
+                            help=f"历史批次来自『对账自动化 Demo』写入的 {HISTORY_DB}；也可上传该页导出的对账结果包")
+    sim_file = st.file_uploader("或上传对账结果（reconciliation_results.xlsx 的 00_Merged / CSV）",
+                                type=["xlsx", "csv"], key="sim_file")
+    sim = None
+    if sim_file is not None:
+        sim = sim_prepare(f"{sim_file.file_id}:{sim_file.name}", decimals, sim_file.getvalue())
+    elif sim_pick != "（不加载）":
+        sim = sim_prepare(sim_pick, decimals)
+
+    if sim is not None and not sim["by_ccy"]:
+        st.info("所选数据中没有两边都有金额的行。")
+    elif sim is not None:
+        sim_per_ccy = {str(r["currency"]).upper(): float(r["abs_tolerance"])
+                       for r in _df_from_editor(per_ccy_df, ["currency", "abs_tolerance"])
+                       if str(r.get("currency", "")).strip() not in ("", "nan") and pd.notna(r["abs_tolerance"])}
+        rows = []
+        for c, s in sim["by_ccy"].items():
+            tol_c = sim_per_ccy.get(c, float(abs_val))
+            hit = sim_within(s, tol_mode, tol_c, float(pct_val))
+            rows.append({"currency": c, "abs_tolerance": tol_c, "pairs": len(s["abs"]),
+                         "matched": hit, "mismatch": len(s["abs"]) - hit})
+        cur = pd.DataFrame(rows)
+        pairs, matched = int(cur["pairs"].sum()), int(cur["matched"].sum())
+        s1, s2, s3, s4 = st.columns(4)
+        s1.metric("两边都有的行", f"{pairs:,}")
+        s2.metric("匹配（当前容差）", f"{matched:,}")
+        s3.metric("差异（当前容差）", f"{pairs - matched:,}")
+        s4.metric("单边行（不受容差影响）", f"{sim['one_sided']:,}")
+        st.dataframe(cur, use_container_width=True, hide_index=True)
+
+        st.markdown(f"**容差网格（模式：{tol_mode}；行=全局绝对容差，列=百分比容差）**")
+        grid = sim_grid(sim, tol_mode, sim_per_ccy)
+        g1, g2 = st.tabs(["匹配条数", "差异条数"])
+        g1.dataframe(grid, use_container_width=True)
+        g2.dataframe(pairs - grid, use_container_width=True)
+        st.caption("按本页规则（rules.json）的容差语义预览：差额按规则舍入位数取整，模式 absolute / percent / both"
+                   "（both 须两项同时满足），百分比以账单金额为基数。『对账自动化 Demo』页侧边栏阈值的判定不同"
+                   "（任一阈值满足即匹配，百分比以两边金额绝对值较大者为基数），两者结果可能不一致。"
+                   "各币种的差额预先排序并缓存，调整上方容差只做二分查找，不重新对账。")
+
+# 面板位置在此，内容等舍入位数控件（位于其后）创建后再填入
+sim_box = st.expander("🔬 容差模拟（what-if）：用已有对账结果预览当前容差的匹配/差异条数", expanded=False)
+
 # -------------------- 日期 & 舍入 --------------------
 st.subheader("3) 日期/舍入")
 row2 = st.columns([1,1,1,1])
@@ -190,6 +364,9 @@ with row2[2]:
 with row2[3]:
     strip_spaces = st.checkbox("去除空格再匹配", value=bool(st.session_state["rules"]["options"].get("strip_spaces", True)))
 
+with sim_box:
+    sim_panel(int(decs))
+
 # -------------------- 供应商别名 --------------------
 st.subheader("4) 供应商别名映射")
 alias_df_default = pd.DataFrame(st.session_state["rules"].get("vendor_alias", []))
@@ -204,7 +381,7 @@ alias_df = st.data_editor(alias_df_default, num_rows="dynamic", use_container_wi
 st.subheader("5) 币种与汇率（可选）")
 c1, c2 = st.columns([1,3])
 with c1:
-    base = st.text_input("基础币种（base）", value=st.session_state["rules"]["currency"].get("base","CNY"))
+    base = st.text_input("基础币种（base）", value=st.session_state["rules"]["currency"].get("base","CNY"), key="fx_base")
 with c2:
     fx_dict = st.session_state["rules"]["currency"].get("fx", {})
     fx_df = pd.DataFrame([{"currency": k, "to_base": v} for k, v in fx_dict.items()]) if fx_dict else pd.DataFrame(columns=["currency","to_base"])
@@ -225,6 +402,19 @@ with c4:
 with c5:
     threshold = st.slider("模糊阈值（0~1）", 0.0, 1.0, float(st.session_state["rules"]["fuzzy_match"]["threshold"]), 0.01)
 
+inv_no = {**_rules_default()["invoice_no"], **st.session_state["rules"].get("invoice_no", {})}
+c6, c7, c8, c9 = st.columns([1,1,1,1])
+with c6:
+    inv_canon = st.checkbox("发票号规范化", value=bool(inv_no["canonicalize"]), help="去掉分隔符与前缀后再匹配")
+    inv_seps = st.text_input("分隔符（逐字符）", inv_no["separators"], disabled=not inv_canon)
+with c7:
+    inv_prefixes = st.text_input("去除前缀（逗号分隔）", ",".join(inv_no["prefixes"]), disabled=not inv_canon)
+with c8:
+    inv_edits = st.selectbox("发票号容错（编辑距离）", [0, 1, 2], index=min(max(int(inv_no["fuzzy_max_edits"]), 0), 2),
+                             help="0 = 关闭；精确匹配后的单边行在同一供应商+币种内配对，如 1NV001 ↔ INV001")
+with c9:
+    inv_amount = st.checkbox("容错配对须金额在容差内", value=bool(inv_no["fuzzy_require_amount"]))
+
 # -------------------- 汇总 / 生成 JSON --------------------
 st.subheader("7) 生成 rules.json")
 # 将编辑器的内容汇总为规则对象
@@ -242,7 +432,7 @@ rules_obj = {
         "absolute": {
             "value": float(abs_val),
             "per_currency": {str(row["currency"]).upper(): float(row["abs_tolerance"])
-                             for row in _df_from_editor(st.session_state.get("abs_per_ccy"), ["currency","abs_tolerance"])
+                             for row in _df_from_editor(per_ccy_df, ["currency","abs_tolerance"])
                              if str(row.get("currency","")).strip() != ""}
         },
         "percent": {"value": float(pct_val)}
@@ -257,6 +447,13 @@ rules_obj = {
                for r in _df_from_editor(fx_df, ["currency","to_base"]) if str(r.get("currency","")).strip() != ""}
     },
     "fuzzy_match": {"enabled": bool(fuzzy_on), "fields": ["vendor"], "threshold": float(threshold)},
+    "invoice_no": {
+        "canonicalize": bool(inv_canon),
+        "separators": inv_seps,
+        "prefixes": [p.strip().upper() for p in inv_prefixes.split(",") if p.strip()],
+        "fuzzy_max_edits": int(inv_edits),
+        "fuzzy_require_amount": bool(inv_amount)
+    },
     "options": {"allow_negative_amount": bool(allow_neg), "strip_spaces": bool(strip_spaces)}
 }
 
@@ -286,3 +483,5 @@ if st.button("保存为本页临时草稿（会话）"):
     st.toast("已保存到会话（刷新/切页仍可回填）", icon="💡")
 
 st.info("提示：下载的 rules.json 可放在仓库根目录或上传到“对账自动化 Demo”页面，由代码读取。")
+
+_timer.done()
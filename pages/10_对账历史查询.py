@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from page_timing import PageTimer
+_timer = PageTimer("10_对账历史查询")   # 先于重模块导入，冷启动计入导入耗时
+import os
+import time
+from contextlib import closing
+from datetime import date, timedelta
+
+import streamlit as st
+
+from recon_history import (HISTORY_DB, STATUSES, connect, delete_run, key_history, list_runs,
+                           open_items_age, open_items_index, status_trend)
+
+st.set_page_config(page_title="对账历史查询", page_icon="🗂️", layout="wide")
+st.title("对账历史查询")
+st.caption(f"『对账自动化 Demo』每次运行的合并结果保存在本地 SQLite（{HISTORY_DB}，按供应商/发票号/日期/状态建索引）。"
+           "本页检索某供应商/发票的历史、未结项挂账天数与各状态趋势。")
+
+if not os.path.exists(HISTORY_DB):
+    st.info("历史库尚未创建：先在『对账自动化 Demo』页完成一次对账（侧边栏勾选保存结果到历史库）。", icon="📄")
+    _timer.done()
+    st.stop()
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, (time.perf_counter() - t0) * 1000
+
+with closing(connect()) as con:
+    runs = list_runs(con)
+    if runs.empty:
+        st.info("历史库中暂无批次。", icon="📄")
+        _timer.done()
+        st.stop()
+
+    k1, k2, k3 = st.columns(3)
+    k1.metric("批次数", len(runs))
+    k2.metric("累计明细行", f"{int(runs['n_rows'].sum()):,}")
+    k3.metric("日期范围", f"{runs['run_date'].min()} ~ {runs['run_date'].max()}")
+
+    # ---------- 过滤条件 ----------
+    with st.sidebar:
+        st.header("过滤")
+        q_vendor = st.text_input("供应商（精确）", "").strip().upper()
+        q_invoice = st.text_input("发票号（精确）", "").strip().upper()
+        first = date.fromisoformat(runs["run_date"].min())
+        rng = st.date_input("批次日期", (max(first, date.today() - timedelta(days=365)), date.today()))
+        d_from, d_to = (rng[0], rng[-1]) if rng else (None, None)   # 选择区间过程中可能只有起点
+        q_status = st.multiselect("状态", STATUSES, default=[s for s in STATUSES if s != "Matched"])
+
+    tab_open, tab_carry, tab_hist, tab_trend, tab_runs = st.tabs(
+        ["未结项挂账", "跨期未达项索引", "明细检索", "趋势", "批次记录"])
+
+    with tab_open:
+        # 全量未结项需扫描全部历史，不随每次交互自动计算
+        if not q_vendor and not st.button("计算全部供应商的未结项（历史量大时需数秒）"):
+            st.info("在侧边栏输入供应商可即时查询；或点击上方按钮计算全部供应商。")
+        else:
+            items, ms = timed(open_items_age, con, vendor=q_vendor or None)
+            if q_invoice:
+                items = items[items["invoice_no"] == q_invoice]
+            st.caption(f"各键最近一次出现仍未匹配的条目；open_since = 自上次匹配以来首次出现异常的批次日期（查询 {ms:.1f} ms）")
+            o1, o2, o3 = st.columns(3)
+            o1.metric("未结项", len(items))
+            o2.metric("平均挂账天数", f"{items['days_open'].mean():.0f}" if len(items) else "-")
+            o3.metric("最长挂账天数", int(items["days_open"].max()) if len(items) else "-")
+            st.dataframe(items, use_container_width=True, height=420)
+
+    with tab_carry:
+        idx, ms = timed(open_items_index, con, vendor=q_vendor or None)
+        if q_invoice:
+            idx = idx[idx["invoice_no"] == q_invoice]
+        st.caption(f"对账页『跨期结转未达项』维护的单边未匹配行（side：inv=仅发票方，bill=仅账单方），"
+                   f"下期对账时优先核销（查询 {ms:.1f} ms）")
+        c1, c2 = st.columns(2)
+        c1.metric("仍未结", len(idx))
+        c2.metric("挂账金额合计", f"{idx['amount'].sum():,.2f}")
+        st.dataframe(idx, use_container_width=True, height=420)
+
+    with tab_hist:
+        hist, ms = timed(key_history, con, q_vendor or None, q_invoice or None, d_from, d_to, q_status)
+        st.caption(f"{len(hist):,} 行（最多显示 5000 行，新批次在前；查询 {ms:.1f} ms）")
+        st.dataframe(hist, use_container_width=True, height=420)
+
+    with tab_trend:
+        # 各页签内容每次都会执行：趋势查询与 plotly 导入放在开关后，未打开时不产生开销
+        if not st.toggle("显示趋势图", value=False):
+            st.info("打开上方开关后按当前过滤条件生成趋势图。")
+        else:
+            trend, ms = timed(status_trend, con, q_vendor or None, d_from, d_to)
+            st.caption(f"查询 {ms:.1f} ms")
+            if trend.empty:
+                st.info("所选范围内没有数据。")
+            else:
+                import plotly.express as px
+                trend = trend[trend["status"].isin(q_status or STATUSES)]
+                fig = px.line(trend, x="run_date", y="n", color="status", markers=True,
+                              labels={"run_date": "批次日期", "n": "条数", "status": "状态"})
+                st.plotly_chart(fig, use_container_width=True)
+                fig2 = px.bar(trend[trend["status"] != "Matched"], x="run_date", y="abs_diff", color="status",
+                              labels={"run_date": "批次日期", "abs_diff": "差额绝对值合计", "status": "状态"})
+                st.plotly_chart(fig2, use_container_width=True)
+
+    with tab_runs:
+        st.dataframe(runs, use_container_width=True, height=320)
+        r1, r2 = st.columns([1, 3])
+        del_id = r1.selectbox("删除批次", runs["run_id"].tolist())
+        if r2.button("删除所选批次（含明细）"):
+            delete_run(con, del_id)
+            st.rerun()
+
+_timer.done()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+对账核心（供“对账自动化 Demo”页面调用）：规范化、重复聚合、外连接对账、发票号容错配对。
+金额一律为整数“最小货币单位”（Int64，缺失即 NA、不当作 0），scale = 10 ** 小数位数；
+容差阈值 abs_thr 为常规单位，比较时按 scale 换算。仅依赖 numpy 与 pandas。
+"""
+import numpy as np
+import pandas as pd
+
+from invoice_match import canonical_invoice, fuzzy_pairs
+from recon_ingest import SOURCE_COLS
+
+DEFAULT_SCALE = 100                  # 2 位小数
+AMOUNT_COLS = ["amount", "amount_inv", "amount_bill", "diff"]
+OUTCOMES = ["Matched", "Mismatch", "Missing_Invoice", "Missing_Bill"]
+NORM_COLS = ["vendor", "invoice_no_raw", "match_key", "amount", "currency"]
+MATCH_COLS = ["vendor", "match_key", "currency"]    # 对账键：发票号用规范化后的 match_key，原值保留在 invoice_no_raw
+
+def to_minor(values, scale: int = DEFAULT_SCALE) -> pd.Series:
+    """金额 → 最小单位整数（Int64）；无法解析的值为缺失（不再当作 0）。"""
+    return (pd.to_numeric(values, errors="coerce") * scale).round().astype("Int64")
+
+def to_major(df: pd.DataFrame, scale: int = DEFAULT_SCALE) -> pd.DataFrame:
+    """最小单位 → 金额，仅用于展示/导出/入库（返回新表，原表不变）。"""
+    return df.assign(**{c: df[c].astype("Float64") / scale for c in AMOUNT_COLS if c in df.columns})
+
+def normalize_df(df, mapping, invoice_canon=None, scale: int = DEFAULT_SCALE) -> pd.DataFrame:
+    """发票号去空格、转大写后存 invoice_no_raw；match_key 为匹配用的键，
+    invoice_canon: (分隔符, 前缀列表) 时再规范化，为 None 时与 invoice_no_raw 相同。"""
+    vendor, invno, amt, curr = mapping
+    invoice_no = df[invno].astype(str).str.strip().str.upper()
+    # 只取映射的 4 列（及来源标注）构造新表（不整表复制、不修改原表），原始表随即可回收
+    return pd.DataFrame({
+        "vendor":     df[vendor].astype(str).str.strip().str.upper(),
+        "invoice_no_raw": invoice_no,
+        "match_key":  canonical_invoice(invoice_no, *invoice_canon) if invoice_canon else invoice_no,
+        "amount":     to_minor(df[amt], scale),
+        "currency":   df[curr].astype(str).str.strip().str.upper(),
+        **{c: df[c] for c in SOURCE_COLS if c in df.columns},
+    })
+
+def aggregate_duplicates(df):
+    # 记录重复（用于报告）
+    dup_mask = df.duplicated(subset=MATCH_COLS, keep=False)
+    dups = df.loc[dup_mask].sort_values(MATCH_COLS)
+    # 聚合（同键的原发票号取首个）
+    g = df.groupby(MATCH_COLS, as_index=False)
+    agg = g["amount"].sum(min_count=1)
+    agg.insert(1, "invoice_no_raw", g["invoice_no_raw"].first()["invoice_no_raw"].to_numpy())
+    return agg, dups
+
+def within_tolerance(a, b, abs_thr=0.0, pct_thr=0.0, scale: int = DEFAULT_SCALE):
+    """最小单位整数金额 → 是否在容差内：绝对值（常规单位，按 scale 换算）或 百分比，取更宽松的一方作为容忍。"""
+    return np.abs(a - b) <= np.maximum(round(abs_thr * scale), np.maximum(np.abs(a), np.abs(b)) * pct_thr)
+
+def reconcile(inv_df, bill_df, abs_thr=0.0, pct_thr=0.0, scale: int = DEFAULT_SCALE):
+    """外连接对账（金额为最小单位整数）→ (merged, {结果: 行索引})。
+
+    缺失方由合并指示列判定，不再从“金额==0”推断（0 金额行也能正确匹配）；
+    一次向量化得出每行结果写入 status 列，各结果分区只保存行索引，用时再 merged.loc[...]。
+    """
+    merged = inv_df.merge(bill_df, on=MATCH_COLS, how="outer", suffixes=("_inv","_bill"), indicator=True)
+    side = merged.pop("_merge").cat.codes.to_numpy()      # 0=left_only（仅发票） 1=right_only（仅账单） 2=both
+    # 展示/入库用的发票号：原值（发票方优先），两边原值均保留在 invoice_no_raw_inv / _bill
+    merged.insert(1, "invoice_no", merged["invoice_no_raw_inv"].fillna(merged["invoice_no_raw_bill"]))
+    a = merged["amount_inv"].to_numpy("int64", na_value=0)
+    b = merged["amount_bill"].to_numpy("int64", na_value=0)
+    na = merged["amount_inv"].isna().to_numpy() | merged["amount_bill"].isna().to_numpy()
+    diff = a - b
+    merged["diff"] = pd.arrays.IntegerArray(diff, na)
+
+    within = (side == 2) & ~na & within_tolerance(a, b, abs_thr, pct_thr, scale)   # 两边都在但金额无法解析的行记为差异
+    merged["within_tolerance"] = within
+
+    # 结果编码与 OUTCOMES 顺序一致：0 Matched / 1 Mismatch / 2 Missing_Invoice / 3 Missing_Bill
+    codes = np.select([side == 0, side == 1, within], [3, 2, 0], 1).astype(np.int8)
+    merged["status"] = pd.Categorical.from_codes(codes, categories=OUTCOMES)
+    return merged, outcome_index(merged)
+
+def fuzzy_match(merged, parts, max_edits, abs_thr=0.0, pct_thr=0.0, require_amount=True, scale: int = DEFAULT_SCALE):
+    """精确匹配后的单边行在同一 (vendor, currency) 内按编辑距离容错配对 → (merged, 配对行索引)。
+
+    配上的“仅发票”行补入账单金额并重新判定结果，对应的“仅账单”行删除；
+    fuzzy_from 记录账单侧原发票号，edit_distance 记录差异处数。
+    """
+    inv_only = merged.loc[parts["Missing_Bill"], ["vendor", "currency", "match_key", "amount_inv"]]
+    bill_only = merged.loc[parts["Missing_Invoice"], ["vendor", "currency", "match_key", "amount_bill"]]
+    a = dict(zip(inv_only.index, inv_only["amount_inv"]))
+    b = dict(zip(bill_only.index, bill_only["amount_bill"]))
+    def accept(l, r):
+        return pd.notna(a[l]) and pd.notna(b[r]) and bool(within_tolerance(a[l], b[r], abs_thr, pct_thr, scale))
+    pairs = fuzzy_pairs(zip(inv_only.index, zip(inv_only["vendor"], inv_only["currency"]), inv_only["match_key"]),
+                        zip(bill_only.index, zip(bill_only["vendor"], bill_only["currency"]), bill_only["match_key"]),
+                        max_edits, accept if require_amount else None)
+    if not pairs:
+        return merged, merged.index[:0]
+    li, ri, dist = (list(x) for x in zip(*pairs))
+    for c in ["amount_bill", "invoice_no_raw_bill"]:
+        merged.loc[li, c] = merged.loc[ri, c].to_numpy()
+    merged["fuzzy_from"] = pd.Series(merged.loc[ri, "invoice_no"].to_numpy(), index=li)
+    merged["edit_distance"] = pd.Series(dist, index=li, dtype="Int64")
+    merged = merged.drop(index=ri)
+    # Int64 掩码运算：不要求金额一致时，任一方金额缺失则差额为 NA、不判为容差内（不以 0 代入）
+    x, y = merged.loc[li, "amount_inv"], merged.loc[li, "amount_bill"]
+    within = within_tolerance(x, y, abs_thr, pct_thr, scale).fillna(False).to_numpy(bool)
+    merged.loc[li, "diff"] = x - y
+    merged.loc[li, "within_tolerance"] = within
+    merged.loc[li, "status"] = np.where(within, "Matched", "Mismatch")
+    return merged, pd.Index(li)
+
+def outcome_index(merged) -> dict:
+    """按 status 一次稳定排序切分 → {结果: 行索引}。"""
+    codes = merged["status"].cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(OUTCOMES) + 1))
+    return {o: merged.index[order[bounds[i]:bounds[i + 1]]] for i, o in enumerate(OUTCOMES)}
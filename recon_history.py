@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+对账历史库：把每次对账的合并结果写入本地 SQLite，供“对账历史查询”页面检索与做趋势；
+同库维护跨期未达项（open items）索引，新一期对账先与往期未达项匹配。
+对账页与查询页共用本模块；仅依赖：sqlite3（标准库）与 pandas。
+"""
+import hashlib
+import json
+import re
+import sqlite3
+from datetime import date, datetime
+
+import pandas as pd
+
+HISTORY_DB = "recon_history.sqlite"
+STATUSES = ["Matched", "Mismatch", "Missing_Invoice", "Missing_Bill"]
+RESULT_COLS = ["vendor", "invoice_no", "currency", "amount_inv", "amount_bill", "diff", "status"]
+KEY_COLS = ["vendor", "invoice_no", "currency"]
+PERIOD_RE = re.compile(r"\d{4}-(0[1-9]|1[0-2])")   # 期间 YYYY-MM：各处按字符串比较先后，格式必须一致
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id        INTEGER PRIMARY KEY,
+    run_date      TEXT NOT NULL,            -- YYYY-MM-DD
+    run_at        TEXT NOT NULL,
+    label         TEXT,
+    content_hash  TEXT NOT NULL,
+    abs_thr REAL, pct_thr REAL,
+    n_rows INTEGER, n_matched INTEGER, n_mismatch INTEGER, n_missing_inv INTEGER, n_missing_bill INTEGER,
+    UNIQUE (run_date, content_hash)         -- 同一天重复提交相同结果只记一次
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id      INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    run_date    TEXT NOT NULL,              -- 冗余自 runs：按日期过滤/排序无需 JOIN
+    vendor      TEXT NOT NULL,
+    invoice_no  TEXT NOT NULL,
+    currency    TEXT NOT NULL,
+    amount_inv  REAL,
+    amount_bill REAL,
+    diff        REAL,
+    status      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_results_key     ON results (vendor, invoice_no, currency, run_date, status);
+CREATE INDEX IF NOT EXISTS ix_results_invoice ON results (invoice_no, run_date);
+CREATE INDEX IF NOT EXISTS ix_results_date    ON results (run_date, status);
+CREATE INDEX IF NOT EXISTS ix_results_status  ON results (status, vendor, run_date);
+CREATE INDEX IF NOT EXISTS ix_results_run     ON results (run_id);
+
+-- 跨期未达项：只存单边未匹配的行，主键即查找键（WITHOUT ROWID，聚簇存储、无额外行号索引）
+CREATE TABLE IF NOT EXISTS open_items (
+    vendor        TEXT NOT NULL,
+    invoice_no    TEXT NOT NULL,
+    currency      TEXT NOT NULL,
+    side          TEXT NOT NULL,            -- inv = 仅发票方有；bill = 仅账单方有
+    amount        REAL,                     -- 金额无法解析时为 NULL
+    opened_period TEXT NOT NULL,            -- 首次挂账期间（YYYY-MM）
+    last_period   TEXT NOT NULL,            -- 最近一次出现的期间
+    closed_period TEXT,                     -- 被后续期间匹配核销的期间；NULL = 仍未结
+    PRIMARY KEY (vendor, invoice_no, currency, side)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_open_opened ON open_items (opened_period);
+CREATE INDEX IF NOT EXISTS ix_open_closed ON open_items (closed_period);
+"""
+SCHEMA_VERSION = 1                          # PRAGMA user_version；1 = open_items.amount 可为 NULL
+
+def _migrate(con: sqlite3.Connection) -> None:
+    """旧库升级：CREATE TABLE IF NOT EXISTS 不会改动已有表，按 user_version 重建。"""
+    if con.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    notnull = {r[1]: r[3] for r in con.execute("PRAGMA table_info(open_items)")}
+    script = ""
+    if notnull.get("amount"):
+        # 0 → 1：open_items.amount 去掉 NOT NULL（SQLite 不支持 ALTER COLUMN，复制后换表）
+        cols = ", ".join(notnull)
+        script = ("ALTER TABLE open_items RENAME TO open_items_v0;"
+                  "DROP INDEX IF EXISTS ix_open_opened; DROP INDEX IF EXISTS ix_open_closed;"
+                  f"{SCHEMA}"
+                  f"INSERT INTO open_items ({cols}) SELECT {cols} FROM open_items_v0;"
+                  "DROP TABLE open_items_v0;")
+    con.executescript(f"BEGIN; {script} PRAGMA user_version = {SCHEMA_VERSION}; COMMIT;")
+
+def connect(path: str = HISTORY_DB) -> sqlite3.Connection:
+    """打开（必要时建表建索引）历史库。WAL 模式下查询页读取不阻塞对账页写入。"""
+    con = sqlite3.connect(path, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA foreign_keys=ON")
+    con.executescript(SCHEMA)
+    _migrate(con)
+    return con
+
+def _content_hash(results: pd.DataFrame, meta: dict) -> str:
+    h = hashlib.sha1(pd.util.hash_pandas_object(results[RESULT_COLS], index=False).to_numpy().tobytes())
+    h.update(json.dumps(meta, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+def save_run(con: sqlite3.Connection, results: pd.DataFrame, abs_thr: float = 0.0, pct_thr: float = 0.0,
+             label: str = "", run_date: date = None) -> tuple:
+    """写入一次对账结果（含 RESULT_COLS 的合并表）→ (run_id, 是否新写入)。
+
+    Streamlit 每次交互都会重跑脚本，按 (日期, 内容哈希) 去重，重跑不会产生重复批次。
+    """
+    run_date = (run_date or date.today()).isoformat()
+    digest = _content_hash(results, {"abs_thr": abs_thr, "pct_thr": pct_thr})
+    counts = results["status"].value_counts()
+    with con:
+        cur = con.execute(
+            "INSERT OR IGNORE INTO runs (run_date, run_at, label, content_hash, abs_thr, pct_thr, n_rows,"
+            " n_matched, n_mismatch, n_missing_inv, n_missing_bill) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            (run_date, datetime.now().isoformat(timespec="seconds"), label, digest, float(abs_thr),
+             float(pct_thr), len(results), *(int(counts.get(s, 0)) for s in STATUSES)))
+        if cur.rowcount == 0:
+            run_id = con.execute("SELECT run_id FROM runs WHERE run_date=? AND content_hash=?",
+                                 (run_date, digest)).fetchone()[0]
+            return run_id, False
+        run_id = cur.lastrowid
+        con.executemany(
+            "INSERT INTO results (run_id, run_date, vendor, invoice_no, currency, amount_inv, amount_bill,"
+            " diff, status) VALUES (?,?,?,?,?,?,?,?,?)",
+            ((run_id, run_date, *row) for row in
+             results[RESULT_COLS].astype(object).where(results[RESULT_COLS].notna(), None)
+             .itertuples(index=False, name=None)))
+    return run_id, True
+
+def list_runs(con: sqlite3.Connection) -> pd.DataFrame:
+    return pd.read_sql_query("SELECT * FROM runs ORDER BY run_id DESC", con)
+
+def delete_run(con: sqlite3.Connection, run_id: int):
+    with con:
+        con.execute("DELETE FROM runs WHERE run_id=?", (int(run_id),))
+
+def run_results(con: sqlite3.Connection, run_id: int) -> pd.DataFrame:
+    """单个批次的全部明细（RESULT_COLS），供容差模拟等离线分析。"""
+    return pd.read_sql_query(f"SELECT {', '.join(RESULT_COLS)} FROM results WHERE run_id = ?", con,
+                             params=(int(run_id),))
+
+def _where(vendor=None, invoice_no=None, date_from=None, date_to=None, statuses=None, alias="") -> tuple:
+    a = f"{alias}." if alias else ""
+    conds, params = [], []
+    if vendor:
+        conds.append(f"{a}vendor = ?"); params.append(vendor)
+    if invoice_no:
+        conds.append(f"{a}invoice_no = ?"); params.append(invoice_no)
+    if date_from:
+        conds.append(f"{a}run_date >= ?"); params.append(str(date_from))
+    if date_to:
+        conds.append(f"{a}run_date <= ?"); params.append(str(date_to))
+    if statuses:
+        conds.append(f"{a}status IN ({','.join('?' * len(statuses))})"); params.extend(statuses)
+    return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+def key_history(con: sqlite3.Connection, vendor=None, invoice_no=None, date_from=None, date_to=None,
+                statuses=None, limit: int = 5000) -> pd.DataFrame:
+    """明细检索：按供应商 / 发票号 / 日期 / 状态过滤，新批次在前。"""
+    where, params = _where(vendor, invoice_no, date_from, date_to, statuses)
+    sql = (f"SELECT run_date, run_id, {', '.join(RESULT_COLS)} FROM results{where}"
+           f" ORDER BY run_date DESC, run_id DESC LIMIT {int(limit)}")
+    return pd.read_sql_query(sql, con, params=params)
+
+def open_items_age(con: sqlite3.Connection, vendor=None, asof: date = None) -> pd.DataFrame:
+    """每个键最近一次出现仍未匹配的条目，及其“自上次匹配以来首次出现异常”的日期与挂账天数。"""
+    where, params = _where(vendor=vendor)
+    sql = f"""
+    WITH latest AS (
+        SELECT vendor, invoice_no, currency, MAX(run_id) AS run_id FROM results{where}
+        GROUP BY vendor, invoice_no, currency
+    )
+    SELECT r.vendor, r.invoice_no, r.currency, r.status, r.amount_inv, r.amount_bill, r.diff,
+           r.run_date AS last_seen,
+           (SELECT MIN(h.run_date) FROM results h
+             WHERE h.vendor = r.vendor AND h.invoice_no = r.invoice_no AND h.currency = r.currency
+               AND h.status <> 'Matched'
+               AND h.run_date > COALESCE((SELECT MAX(m.run_date) FROM results m
+                                           WHERE m.vendor = r.vendor AND m.invoice_no = r.invoice_no
+                                             AND m.currency = r.currency AND m.status = 'Matched'), '')
+           ) AS open_since
+    FROM latest l
+    JOIN results r ON r.run_id = l.run_id AND r.vendor = l.vendor
+                  AND r.invoice_no = l.invoice_no AND r.currency = l.currency
+    WHERE r.status <> 'Matched'
+    ORDER BY open_since, r.vendor, r.invoice_no
+    """
+    df = pd.read_sql_query(sql, con, params=params)
+    asof = pd.Timestamp(asof or date.today())
+    df["days_open"] = (asof - pd.to_datetime(df["open_since"])).dt.days
+    return df
+
+def status_trend(con: sqlite3.Connection, vendor=None, date_from=None, date_to=None) -> pd.DataFrame:
+    """按批次日期 × 状态汇总条数与差额绝对值，用于趋势图。"""
+    where, params = _where(vendor, None, date_from, date_to)
+    sql = (f"SELECT run_date, status, COUNT(*) AS n, SUM(ABS(diff)) AS abs_diff FROM results{where}"
+           f" GROUP BY run_date, status ORDER BY run_date")
+    return pd.read_sql_query(sql, con, params=params)
+
+# -------------------- 跨期未达项结转 --------------------
+def carry_forward(con: sqlite3.Connection, period: str, missing_inv: pd.DataFrame, missing_bill: pd.DataFrame,
+                  abs_thr: float = 0.0, pct_thr: float = 0.0, vendors=None) -> tuple:
+    """本期单边行先与往期未达项匹配，并就地更新索引 → (结转配对行, 剩余 missing_inv, 剩余 missing_bill)。
+    period 须为 YYYY-MM，否则抛出 ValueError。
+
+    missing_inv：账单有、发票无（本期只有 bill 方）；missing_bill：发票有、账单无（本期只有 inv 方）。
+    结转配对行沿用原行索引，另带 carried_from（对方挂账期间），可直接回填合并表。
+    同一期间重复执行是幂等的：先撤销该期间此前对 vendors（本次对账涉及的全部供应商，
+    缺省取单边行中的供应商）的核销/新挂账，再重新应用——按供应商分文件对账互不覆盖；
+    早于本期已核销的记录不再可能被撤销，随即清除，索引只随“仍未结”的条数增长。
+    """
+    if not valid_period(period):
+        raise ValueError(f"对账期间须为 YYYY-MM：{period!r}")
+    own = pd.concat([
+        missing_bill[KEY_COLS].assign(side="inv", amount=missing_bill["amount_inv"]),
+        missing_inv[KEY_COLS].assign(side="bill", amount=missing_inv["amount_bill"]),
+    ])
+    opposite = own["side"].map({"inv": "bill", "bill": "inv"})
+    vendors = own["vendor"].unique() if vendors is None else vendors
+    with con:
+        _undo_period(con, period, vendors)
+        con.execute("DELETE FROM open_items WHERE closed_period < ?", (period,))
+        # 候选键写入临时表，与主键做索引连接，只读取命中的未达项
+        con.execute("CREATE TEMP TABLE IF NOT EXISTS cf_keys "
+                    "(idx INTEGER, vendor TEXT, invoice_no TEXT, currency TEXT, side TEXT)")
+        con.execute("DELETE FROM temp.cf_keys")
+        con.executemany("INSERT INTO temp.cf_keys VALUES (?,?,?,?,?)",
+                        zip(own.index.tolist(), own["vendor"], own["invoice_no"], own["currency"], opposite))
+        hits = pd.read_sql_query(
+            "SELECT c.idx, o.amount, o.opened_period FROM temp.cf_keys c JOIN open_items o"
+            " ON o.vendor = c.vendor AND o.invoice_no = c.invoice_no AND o.currency = c.currency AND o.side = c.side"
+            " WHERE o.closed_period IS NULL AND o.opened_period < ?", con, params=(period,)).set_index("idx")
+        con.executemany(
+            "UPDATE open_items SET closed_period = ? WHERE vendor = ? AND invoice_no = ? AND currency = ? AND side = ?",
+            ((period, *key) for key in zip(own.loc[hits.index, "vendor"], own.loc[hits.index, "invoice_no"],
+                                           own.loc[hits.index, "currency"], opposite.loc[hits.index])))
+        # 未命中的本期单边行挂账；已挂账的同键只刷新金额与期间范围（补跑较早期间时首次挂账期间前移），
+        # 始终 opened_period ≤ last_period
+        rest = own.drop(index=hits.index)
+        con.executemany(
+            "INSERT INTO open_items (vendor, invoice_no, currency, side, amount, opened_period, last_period)"
+            " VALUES (?,?,?,?,?,?,?)"
+            " ON CONFLICT (vendor, invoice_no, currency, side) DO UPDATE SET"
+            " amount = excluded.amount,"
+            " opened_period = CASE WHEN open_items.closed_period IS NULL"
+            "                      THEN MIN(open_items.opened_period, excluded.opened_period)"
+            "                      ELSE excluded.opened_period END,"
+            " last_period = CASE WHEN open_items.closed_period IS NULL"
+            "                    THEN MAX(open_items.last_period, excluded.last_period)"
+            "                    ELSE excluded.last_period END,"
+            " closed_period = NULL",
+            ((*row, period, period) for row in rest[KEY_COLS + ["side", "amount"]].astype(object)
+             .where(rest[KEY_COLS + ["side", "amount"]].notna(), None).itertuples(index=False, name=None)))
+
+    carried = pd.concat([missing_bill, missing_inv]).loc[hits.index.rename(None)].copy()
+    from_bill = own.loc[hits.index, "side"].eq("inv")      # 本期是发票方 → 对方金额来自往期账单
+    carried.loc[from_bill, "amount_bill"] = hits.loc[from_bill, "amount"]
+    carried.loc[~from_bill, "amount_inv"] = hits.loc[~from_bill, "amount"]
+    carried["diff"] = carried["amount_inv"] - carried["amount_bill"]
+    base = carried[["amount_inv", "amount_bill"]].abs().max(axis=1)
+    carried["within_tolerance"] = carried["diff"].abs() <= (base * pct_thr).clip(lower=abs_thr)
+    carried["carried_from"] = hits["opened_period"]
+    return (carried, missing_inv.drop(index=hits.index, errors="ignore"),
+            missing_bill.drop(index=hits.index, errors="ignore"))
+
+def valid_period(period) -> bool:
+    return isinstance(period, str) and PERIOD_RE.fullmatch(period) is not None
+
+def _undo_period(con: sqlite3.Connection, period: str, vendors):
+    """撤销某期间此前对 vendors 的核销/新挂账（调用方负责事务）。"""
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS cf_vendors (vendor TEXT PRIMARY KEY)")
+    con.execute("DELETE FROM temp.cf_vendors")
+    con.executemany("INSERT OR IGNORE INTO temp.cf_vendors VALUES (?)", ((v,) for v in vendors))
+    scope = "vendor IN (SELECT vendor FROM temp.cf_vendors)"
+    con.execute(f"DELETE FROM open_items WHERE opened_period = ? AND {scope}", (period,))
+    con.execute(f"UPDATE open_items SET closed_period = NULL WHERE closed_period = ? AND {scope}", (period,))
+
+def undo_carry(con: sqlite3.Connection, period: str, vendors):
+    """撤回一次结转（如同一批文件先按错误期间结转、随后改正期间）。"""
+    with con:
+        _undo_period(con, period, vendors)
+
+def open_items_index(con: sqlite3.Connection, vendor=None) -> pd.DataFrame:
+    """当前仍未结的跨期未达项（按主键前缀过滤供应商）。"""
+    where, params = _where(vendor=vendor)
+    where = (where + " AND" if where else " WHERE") + " closed_period IS NULL"
+    return pd.read_sql_query(f"SELECT * FROM open_items{where} ORDER BY opened_period, vendor, invoice_no",
+                             con, params=params)
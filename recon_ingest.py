@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+对账输入读取（供“对账自动化 Demo”页面调用）：每一侧可上传多个文件，Excel 可选多个工作表。
+各（文件, 工作表）在进程池中并行解析（openpyxl 为纯 Python，多线程受 GIL 限制），
+每行标注来源文件与工作表，按上传顺序拼接并统一同名列的类型。
+CSV 按字节样本识别编码（UTF-8 / Shift_JIS(cp932) / GBK(gb18030)），按列映射只读所需列、
+键列直接按文本读取（免去类型推断，也保留前导 0）；装有 pyarrow 时用其多线程解析器。
+放在独立模块中，进程池子进程才能按模块名导入 worker 函数（页面脚本本身无法被子进程导入）。
+"""
+import importlib.util
+import io
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SOURCE_COLS = ["source_file", "source_sheet"]
+EXCEL_COST = 30                          # 每字节解析耗时：压缩的 xlsx 经 openpyxl 约为 CSV（C 解析器）的数十倍
+PARALLEL_MIN_COST = 32 * 1024 * 1024     # 估算总耗时低于此值时进程启动开销（约 1~3 秒）大于收益，顺序读取
+ENCODINGS = ["utf-8", "cp932", "gb18030"]   # cp932 / gb18030 分别是 Shift_JIS / GBK 的超集
+SAMPLE_BYTES = 64 * 1024
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+def is_excel(name: str) -> bool:
+    return name.lower().endswith((".xlsx", ".xls"))
+
+def _cost(name: str, data: bytes) -> int:
+    return len(data) * (EXCEL_COST if is_excel(name) else 1)
+
+def sheet_names(name: str, data: bytes) -> list:
+    """Excel → 工作表名列表；CSV → [None]。"""
+    if not is_excel(name):
+        return [None]
+    with pd.ExcelFile(io.BytesIO(data)) as xf:
+        return list(xf.sheet_names)
+
+# -------------------- 编码识别 --------------------
+def _decodes(sample: bytes, encoding: str, truncated: bool) -> str:
+    """能解码则返回文本，否则 None；样本截断处的半个多字节字符不算错误。"""
+    try:
+        return sample.decode(encoding)
+    except UnicodeDecodeError as e:
+        if truncated and e.start >= len(sample) - 3:
+            return _decodes(sample[:e.start], encoding, False)
+        return None
+
+def detect_encoding(data: bytes) -> str:
+    """按前 64KB 判断 CSV 编码。
+
+    UTF-8 能严格解码即取 UTF-8（带 BOM 为 utf-8-sig）；否则 cp932 与 gb18030 常常都能解码，
+    按 cp932 解码结果中全角字符（假名/汉字/全角符号）的占比区分——GBK 文本被当作 cp932 解码时
+    大多落成半角片假名。
+    """
+    if data.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    sample = data[:SAMPLE_BYTES]
+    truncated = len(data) > SAMPLE_BYTES
+    if _decodes(sample, "utf-8", truncated) is not None:
+        return "utf-8"
+    jp = _decodes(sample, "cp932", truncated)
+    if jp is None:
+        return "gb18030"
+    wide = [ch for ch in jp if ord(ch) > 0x7F]
+    full = sum(1 for ch in wide if not 0xFF61 <= ord(ch) <= 0xFF9F)
+    if full >= 0.5 * len(wide) or _decodes(sample, "gb18030", truncated) is None:
+        return "cp932"
+    return "gb18030"
+
+# -------------------- 读取 --------------------
+def read_source(name: str, data: bytes, sheet=None, nrows=None, usecols=None, text_cols=(),
+                encoding=None) -> pd.DataFrame:
+    """读取单个来源。usecols：只读这些列；text_cols：按文本读取的列；encoding：CSV 编码（缺省自动识别）。
+    编码与内容不符时抛出 ValueError（含文件名与编码）。"""
+    buf = io.BytesIO(data)
+    dtype = {c: str for c in text_cols} or None
+    if is_excel(name):
+        return pd.read_excel(buf, sheet_name=sheet if sheet is not None else 0, nrows=nrows,
+                             usecols=usecols, dtype=dtype)
+    encoding = encoding or detect_encoding(data)
+    try:
+        if nrows is None and CSV_ENGINE == "pyarrow":
+            try:
+                return pd.read_csv(buf, engine="pyarrow", usecols=usecols, dtype=dtype, encoding=encoding)
+            except UnicodeDecodeError:   # 编码不符 C 解析器同样失败，不必重读
+                raise
+            except ValueError:   # pyarrow 不接受的不规整文件（如行内列数不一）退回 C 解析器给出常规报错
+                buf.seek(0)
+        return pd.read_csv(buf, nrows=nrows, usecols=usecols, dtype=dtype, encoding=encoding)
+    except UnicodeDecodeError as e:   # 多为手动指定的编码与文件不符
+        raise ValueError(f"{name} 无法按 {encoding} 解码（第 {e.start} 字节），请改选其它编码或自动识别") from e
+
+def source_columns(sources: list, encoding=None) -> pd.Index:
+    """各来源表头的并集（保持首次出现顺序），只读表头，用于列映射。"""
+    cols = []
+    for name, data, sheet in sources:
+        cols += [c for c in read_source(name, data, sheet, nrows=0, encoding=encoding).columns if c not in cols]
+    return pd.Index(cols)
+
+def _read_tagged(name: str, data: bytes, sheet, columns=None, text_cols=(), encoding=None) -> pd.DataFrame:
+    usecols = None
+    if columns:
+        # 映射列取自各来源表头的并集：缺列的来源直接报错，不以 NaN 补齐（否则规范化后成为键 "NAN"）
+        header = read_source(name, data, sheet, nrows=0, encoding=encoding).columns
+        missing = [c for c in dict.fromkeys(columns) if c not in header]
+        if missing:
+            where = f"{name}（工作表 {sheet}）" if sheet is not None else name
+            raise ValueError(f"{where} 缺少映射列：{', '.join(map(str, missing))}")
+        usecols = list(dict.fromkeys(columns))
+    df = read_source(name, data, sheet, usecols=usecols, text_cols=text_cols, encoding=encoding)
+    return df.assign(source_file=name, source_sheet=sheet or "")
+
+def _as_text(s: pd.Series) -> pd.Series:
+    """数值/日期列转文本；整数值的浮点（Excel 常见）写成整数，缺失保持缺失。"""
+    if s.dtype == object:
+        return s
+    out = s.astype(str).astype(object)
+    if s.dtype.kind == "f":
+        whole = s.notna() & (s % 1 == 0)
+        out[whole] = s[whole].astype("int64").astype(str)
+    return out.where(s.notna(), np.nan)
+
+def harmonize(frames: list) -> list:
+    """同名列在各来源中类型不一致时统一：都是数值则交给 concat 提升；否则统一为文本，
+    避免 1001 与 "1001" 拼接后在规范化时变成 "1001.0" / "1001" 两个键。"""
+    kinds = {}
+    for df in frames:
+        for c, dt in df.dtypes.items():
+            kinds.setdefault(c, set()).add(dt.kind)
+    mixed = [c for c, k in kinds.items() if len(k) > 1 and not k <= set("iuf")]
+    if not mixed:
+        return frames
+    return [df.assign(**{c: _as_text(df[c]) for c in mixed if c in df.columns}) for df in frames]
+
+def ingest(sources: list, columns=None, text_cols=(), encoding=None, workers: int = None) -> pd.DataFrame:
+    """sources: [(文件名, bytes, 工作表或 None), ...] → 拼接后的原始表（含 source_file / source_sheet）。
+
+    columns：只读取这些列（列映射），任一来源缺少其中的列时抛出 ValueError；text_cols：按文本读取的键列；encoding：CSV 编码（缺省逐个文件识别）。
+
+    按估算耗时从大到小提交到进程池，总耗时接近最大单个来源的解析时间；结果仍按原顺序拼接。
+    """
+    workers = workers or os.cpu_count() or 1
+    cost = [_cost(name, data) for name, data, _ in sources]
+    if workers <= 1 or len(sources) <= 1 or sum(cost) < PARALLEL_MIN_COST:
+        frames = [_read_tagged(*s, columns, text_cols, encoding) for s in sources]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sources)), mp_context=mp.get_context("spawn")) as ex:
+            largest_first = sorted(range(len(sources)), key=lambda i: -cost[i])
+            futures = {i: ex.submit(_read_tagged, *sources[i], columns, text_cols, encoding) for i in largest_first}
+            frames = [futures[i].result() for i in range(len(sources))]
+    out = pd.concat(harmonize(frames), ignore_index=True)
+    out[SOURCE_COLS] = out[SOURCE_COLS].astype("category")
+    return out
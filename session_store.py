@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+会话数据仓：多人共用一台服务器时，按会话登记大表（对账结果等）的内存占用，
+超出单会话上限或全局预算时，把空闲最久的表落盘（pickle），再次访问时透明读回。
+进程内全局生效（所有会话共用一个登记表）；仅依赖标准库与 pandas。
+
+由服务器统一开关与配置（环境变量），不由各用户在页面上选择：
+  RECON_MEMORY_MODE        1 = 启用（默认 0：不登记，对账页每次重跑照常计算）
+  RECON_MEMORY_BUDGET_MB   全局常驻上限（默认 1024）
+  RECON_SESSION_LIMIT_MB   单会话常驻上限（默认 256）
+  RECON_IDLE_SECONDS       超过该时长未访问的会话优先落盘（默认 600）
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+MB = 1024 * 1024
+ENABLED = os.environ.get("RECON_MEMORY_MODE", "0").strip().lower() in ("1", "true", "yes", "on")
+MEMORY_BUDGET = int(os.environ.get("RECON_MEMORY_BUDGET_MB", 1024)) * MB
+SESSION_LIMIT = int(os.environ.get("RECON_SESSION_LIMIT_MB", 256)) * MB
+IDLE_SECONDS = int(os.environ.get("RECON_IDLE_SECONDS", 600))
+PURGE_SECONDS = 24 * 3600                # 落盘文件超过一天未访问即删除（会话多半已关闭）
+SPILL_DIR = os.path.join(tempfile.gettempdir(), "recon_spill")
+
+_lock = threading.RLock()
+_entries = {}                            # (session, name) → {"obj", "path", "bytes", "used"}
+
+def nbytes(obj) -> int:
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    return 0
+
+def _spill(key, e):
+    if e["obj"] is None:
+        return
+    if e["path"] is None:                # 内容不变，只需落盘一次
+        d = os.path.join(SPILL_DIR, key[0])
+        os.makedirs(d, exist_ok=True)
+        e["path"] = os.path.join(d, f"{key[1]}.pkl")
+        pd.to_pickle(e["obj"], e["path"])
+    e["obj"] = None
+
+def _resident(session=None) -> int:
+    return sum(e["bytes"] for k, e in _entries.items()
+               if e["obj"] is not None and (session is None or k[0] == session))
+
+def _enforce(keep=None):
+    """先压单会话上限，再按“空闲会话优先、其余最久未用优先”压全局预算；keep 为正在使用的条目。"""
+    now = time.time()
+    by_lru = sorted((k for k, e in _entries.items() if e["obj"] is not None and k != keep),
+                    key=lambda k: _entries[k]["used"])
+    for k in by_lru:
+        if _resident(k[0]) > SESSION_LIMIT:
+            _spill(k, _entries[k])
+    last_used = {}
+    for k, e in _entries.items():
+        last_used[k[0]] = max(last_used.get(k[0], 0), e["used"])
+    idle_first = sorted(by_lru, key=lambda k: (now - last_used[k[0]] < IDLE_SECONDS, _entries[k]["used"]))
+    for k in idle_first:
+        if _resident() <= MEMORY_BUDGET:
+            break
+        _spill(k, _entries[k])
+    # 长期无人访问的落盘文件清理
+    for k in [k for k, e in _entries.items() if e["obj"] is None and now - e["used"] > PURGE_SECONDS]:
+        _drop(k)
+
+def _drop(key):
+    e = _entries.pop(key, None)
+    if e and e["path"] and os.path.exists(e["path"]):
+        os.remove(e["path"])
+
+def put(session: str, name: str, obj):
+    """登记（替换）会话中的一张表，并按预算落盘其他空闲表。单表即超过会话上限时直接落盘。"""
+    key = (session, name)
+    with _lock:
+        _drop(key)
+        e = _entries[key] = {"obj": obj, "path": None, "bytes": nbytes(obj), "used": time.time()}
+        if e["bytes"] > SESSION_LIMIT:
+            _spill(key, e)
+            _enforce()
+        else:
+            _enforce(keep=key)
+
+def get(session: str, name: str):
+    """取回表；已落盘的透明读回（可能触发其他表落盘）。不存在返回 None。"""
+    key = (session, name)
+    with _lock:
+        e = _entries.get(key)
+        if e is None:
+            return None
+        e["used"] = time.time()
+        if e["obj"] is None:
+            if not e["path"] or not os.path.exists(e["path"]):
+                _entries.pop(key)
+                return None
+            obj = pd.read_pickle(e["path"])
+            if e["bytes"] > SESSION_LIMIT:   # 超限的表每次从盘读取，不常驻
+                return obj
+            e["obj"] = obj
+            _enforce(keep=key)
+        return e["obj"]
+
+def drop_session(session: str):
+    with _lock:
+        for k in [k for k in _entries if k[0] == session]:
+            _drop(k)
+        shutil.rmtree(os.path.join(SPILL_DIR, session), ignore_errors=True)
+
+def session_usage(session: str) -> tuple:
+    """→ (常驻字节, 已落盘字节)"""
+    with _lock:
+        mine = [e for k, e in _entries.items() if k[0] == session]
+        return (sum(e["bytes"] for e in mine if e["obj"] is not None),
+                sum(e["bytes"] for e in mine if e["obj"] is None))
+
+def usage() -> pd.DataFrame:
+    """各会话的常驻/落盘字节与最近访问时间（运维查看用）。"""
+    with _lock:
+        rows = {}
+        for (s, _), e in _entries.items():
+            r = rows.setdefault(s, {"session": s, "resident_mb": 0.0, "spilled_mb": 0.0, "last_used": 0.0})
+            r["resident_mb" if e["obj"] is not None else "spilled_mb"] += e["bytes"] / MB
+            r["last_used"] = max(r["last_used"], e["used"])
+    df = pd.DataFrame(list(rows.values()), columns=["session", "resident_mb", "spilled_mb", "last_used"])
+    df["last_used"] = pd.to_datetime(df["last_used"], unit="s")
+    return df
+
+def total_resident() -> int:
+    with _lock:
+        return _resident()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""ap_duplicates 重复发票：窗口内同供应商同金额成对、发票号完全/近似/不同的分类、缺失值跳过。"""
+import pandas as pd
+
+from ap_duplicates import detect_duplicate_invoices
+
+def _ap(rows):
+    return pd.DataFrame(rows, columns=["InvoiceID", "VendorCode", "InvoiceDate", "Amount", "PaidAmount"]).assign(
+        InvoiceDate=lambda d: pd.to_datetime(d["InvoiceDate"]))
+
+def _pairs(out):
+    return {(a, b): t for a, b, t in zip(out["InvoiceID_1"], out["InvoiceID_2"], out["MatchType"])}
+
+def test_pairs_only_within_window_same_vendor_and_amount():
+    out = detect_duplicate_invoices(_ap([
+        ["INV-001", "V1", "2025-01-01", 1000.00, 0],
+        ["inv001",  "V1", "2025-01-05", 1000.00, 0],     # 4 天后，去分隔符后同号
+        ["INV-001", "V1", "2025-01-08", 1000.00, 0],     # 同号
+        ["X-9",     "V1", "2025-03-01", 1000.00, 0],     # 超出窗口
+        ["INV-002", "V2", "2025-01-02", 1000.00, 0],     # 不同供应商
+        ["INV-003", "V1", "2025-01-02", 1000.01, 0],     # 金额差 1 分
+    ]), window_days=7)
+    assert _pairs(out) == {
+        ("INV-001", "inv001"): "发票号近似（去分隔符后相同）",
+        ("INV-001", "INV-001"): "完全重复（发票号相同）",
+        ("inv001", "INV-001"): "发票号近似（去分隔符后相同）",
+    }
+    assert sorted(out["DaysApart"]) == [3, 4, 7]
+
+def test_different_invoice_numbers_and_paid_pairs_first():
+    out = detect_duplicate_invoices(_ap([
+        ["A1", "V1", "2025-02-01", 500, 0],
+        ["B7", "V1", "2025-02-03", 500, 0],
+        ["C1", "V2", "2025-02-01", 200, 200],
+        ["D4", "V2", "2025-02-02", 200, 200],
+    ]), window_days=30)
+    assert out["MatchType"].tolist() == ["同供应商同金额（发票号不同）"] * 2
+    assert out["BothPaid"].tolist() == [True, False]                 # 双方均已付款的排在前面
+    assert out.loc[0, "InvoiceID_1"] == "C1"
+
+def test_missing_amount_or_date_is_skipped():
+    out = detect_duplicate_invoices(_ap([
+        ["A1", "V1", "2025-02-01", None, 0],
+        ["A1", "V1", "2025-02-01", None, 0],
+        ["B1", "V1", None, 300, 0],
+        ["B1", "V1", "2025-02-01", 300, 0],
+    ]), window_days=30)
+    assert out.empty
+    assert detect_duplicate_invoices(_ap([]), window_days=30).empty
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""distinct_sketch 精确 → HyperLogLog 切换：阈值内精确、越过阈值转寄存器、折叠与直接计算一致。"""
+import numpy as np
+import pytest
+
+import distinct_sketch
+from distinct_sketch import (distinct_add, distinct_count, distinct_init, distinct_registers, hll_estimate, hll_fold,
+                             hll_overlap)
+
+@pytest.fixture
+def small_limit(monkeypatch):
+    monkeypatch.setattr(distinct_sketch, "EXACT_DISTINCT_LIMIT", 1000)
+
+def test_exact_below_limit_across_chunks(small_limit):
+    state = distinct_init()
+    distinct_add(state, np.arange(600))
+    distinct_add(state, np.arange(300, 900).astype(float))    # 分块间 int→float 不重复计数
+    distinct_add(state, np.array(["a", "b", "a"], dtype=object))
+    assert state["registers"] is None
+    assert distinct_count(state) == 902
+
+def test_switches_to_hll_over_limit(small_limit):
+    state = distinct_init()
+    for start in range(0, 50_000, 5_000):
+        distinct_add(state, np.arange(start, start + 5_000))
+        distinct_add(state, np.arange(start, start + 5_000))     # 重复值不影响估计
+    assert state["registers"] is not None and len(state["hashes"]) == 0
+    assert len(state["registers"]) == 1 << distinct_sketch.HLL_P
+    assert distinct_count(state) == pytest.approx(50_000, rel=0.03)
+
+def test_switch_keeps_values_seen_before_it(small_limit):
+    state = distinct_init()
+    distinct_add(state, np.arange(1000))
+    assert state["registers"] is None
+    distinct_add(state, np.arange(1000, 1001))                 # 第 1001 个值触发切换，此前的值并入寄存器
+    assert state["registers"] is not None
+    assert distinct_count(state) == pytest.approx(1001, rel=0.02)
+
+def _direct(values, p):
+    reg = np.zeros(1 << p, dtype=np.uint8)
+    distinct_sketch._hll_add(reg, distinct_sketch.hash_values(values), p)
+    return reg
+
+def test_snapshot_registers_match_direct_computation(small_limit):
+    values = np.arange(20_000)
+    exact = distinct_init()
+    distinct_add(exact, values[:900])
+    assert np.array_equal(distinct_registers(exact, 10), _direct(values[:900], 10))
+    hll = distinct_init()
+    distinct_add(hll, values)
+    assert hll["registers"] is not None
+    folded = hll_fold(hll["registers"], 10)
+    assert np.array_equal(folded, _direct(values, 10))
+    assert hll_estimate(folded) == pytest.approx(20_000, rel=0.1)
+
+def test_overlap_of_shifted_ranges():
+    a, b = _direct(np.arange(0, 30_000), 10), _direct(np.arange(20_000, 50_000), 10)
+    union, inter = hll_overlap(a, b)
+    assert union == pytest.approx(50_000, rel=0.1)
+    assert inter == pytest.approx(10_000, abs=0.1 * 50_000)
+    assert hll_overlap(a, a) == (hll_estimate(a), hll_estimate(a))
+    small_a, small_b = _direct(np.arange(100), 10), _direct(np.arange(200, 300), 10)
+    assert hll_overlap(small_a, small_b)[1] <= 3                 # 互不相交的小集合：线性计数下几乎为 0
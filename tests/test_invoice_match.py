@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""invoice_match 容错配对：一对一、有歧义不配。"""
+from invoice_match import edit_distance, fuzzy_pairs
+
+G = ("V1", "JPY")
+
+def test_unique_candidate_is_paired():
+    assert fuzzy_pairs([(0, G, "INV0010")], [(1, G, "INV0011")], 1) == [(0, 1, 1)]
+
+def test_ambiguous_at_distance_1_is_not_paired():
+    assert fuzzy_pairs([(0, G, "INV0010")], [(1, G, "INV0011"), (2, G, "INV0012")], 1) == []
+
+def test_ambiguous_label_is_not_paired_at_larger_distance():
+    left = [(0, G, "INV0010")]
+    right = [(1, G, "INV0011"), (2, G, "INV0012"), (3, G, "INV0099")]
+    assert fuzzy_pairs(left, right, 2) == []
+
+def test_closer_pair_wins_and_others_continue():
+    left = [(0, G, "INV0010"), (1, G, "INV0020")]
+    right = [(2, G, "INV0010X"), (3, G, "INV0031")]
+    assert sorted(fuzzy_pairs(left, right, 2)) == [(0, 2, 1), (1, 3, 2)]
+
+def test_groups_and_short_keys_are_separate():
+    assert fuzzy_pairs([(0, G, "INV0010")], [(1, ("V2", "JPY"), "INV0011")], 1) == []
+    assert fuzzy_pairs([(0, G, "12")], [(1, G, "13")], 1) == []
+
+def test_edit_distance_counts_transposition_and_caps_at_limit():
+    assert edit_distance("INV0012", "INV0021", 2) == 1
+    assert edit_distance("ABCDEF", "UVWXYZ", 2) == 3
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""mail_merge 批量邮件：缺失供应商记为 UNKNOWN（不出现 "nan" 收件方）、应付明细的列校验与默认值。"""
+import io
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from mail_merge import aging_rows, build_messages, mismatch_rows
+
+META = {"myco": "自社", "myper": "担当", "today": "2026/10/19"}
+
+def _mismatches_xlsx(rows: list) -> io.BytesIO:
+    buf = io.BytesIO()
+    pd.DataFrame(rows, columns=["vendor", "invoice_no", "currency", "amount_inv", "amount_bill", "diff"]
+                 ).to_excel(buf, index=False, sheet_name="02_Mismatches")
+    buf.seek(0)
+    return buf
+
+def test_mismatch_rows_missing_vendor_is_unknown():
+    rows = mismatch_rows(_mismatches_xlsx([["V1", "INV1", "JPY", 100, 90, 10],
+                                           [None, "INV2", "JPY", 50, None, None]]))
+    assert rows["vendor"].tolist() == ["V1", "UNKNOWN"]
+    assert rows.loc[1, "amount_bill"] == "-"
+    contacts = {"UNKNOWN": ("", "ご担当者 様"), "V1": ("v1@example.com", "田中 様")}
+    msgs = build_messages(rows, "金額差異のご確認", "ap@example.com", contacts, META)
+    assert [v for v, _ in msgs] == ["UNKNOWN", "V1"]
+    assert msgs[0][1].get_content().startswith("UNKNOWN ご担当者 様")
+    assert "nan" not in msgs[0][1].get_content()
+
+def test_aging_rows_vendor_fallback_and_defaults():
+    csv = io.StringIO("InvoiceID,VendorCode,VendorName,DueDate,Amount\n"
+                      "A1,C1,Tokyo,2026-10-01,100\n"
+                      "A2,C2,,2026-10-01,200\n"
+                      "A3,,,2026-10-01,300\n"
+                      "A4,C4,Osaka,2027-01-01,400\n")
+    rows = aging_rows(csv, date(2026, 10, 19), 7, "CNY")
+    assert rows["vendor"].tolist() == ["Tokyo", "C2", "UNKNOWN"]       # 期日が遠い A4 は対象外
+    assert set(rows["currency"]) == {"CNY"}
+    assert rows["status"].tolist() == ["18日超過"] * 3
+
+def test_aging_rows_requires_columns():
+    with pytest.raises(ValueError, match="VendorCode"):
+        aging_rows(io.StringIO("InvoiceID,DueDate,Amount\nA1,2026-10-01,100\n"), date(2026, 10, 19), 7, "JPY")
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""master_templates 批量确认函：缺失供应商记为 UNKNOWN、zip 内文件名唯一。"""
+import io
+import zipfile
+
+import openpyxl
+import pandas as pd
+
+from master_templates import bulk_statements_zip, statement_groups
+
+def _results_xlsx(rows: list) -> io.BytesIO:
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
+        pd.DataFrame(rows, columns=["vendor", "invoice_no", "currency", "amount_inv", "amount_bill", "diff"]
+                     ).to_excel(w, index=False, sheet_name="02_Mismatches")
+    buf.seek(0)
+    return buf
+
+def test_missing_vendor_becomes_unknown_statement():
+    groups = statement_groups(_results_xlsx([
+        ["V1", "INV1", "JPY", 100, 90, 10],
+        [None, "INV2", "JPY", 50, 40, 10],
+    ]))
+    assert [v for v, _ in groups] == ["UNKNOWN", "V1"]
+    with zipfile.ZipFile(io.BytesIO(bulk_statements_zip(groups, {"period": "2026-10"}, workers=1))) as zf:
+        assert sorted(zf.namelist()) == ["UNKNOWN_statement.xlsx", "V1_statement.xlsx"]
+        ws = openpyxl.load_workbook(io.BytesIO(zf.read("UNKNOWN_statement.xlsx"))).active
+    assert ws["B2"].value == "UNKNOWN"
+    assert ws["B7"].value == "INV2"
+
+def test_colliding_vendor_names_get_suffixes():
+    groups = [("A/B", []), ("A B", []), (None, []), (float("nan"), [])]
+    with zipfile.ZipFile(io.BytesIO(bulk_statements_zip(groups, {}, workers=1))) as zf:
+        assert zf.namelist() == ["A_B_statement.xlsx", "A_B_2_statement.xlsx",
+                                 "UNKNOWN_statement.xlsx", "UNKNOWN_2_statement.xlsx"]
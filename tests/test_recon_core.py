@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""recon_core 金额路径：最小单位 Int64、0 金额、缺失金额、容差、重复聚合。"""
+import sqlite3
+
+import pandas as pd
+
+from recon_core import aggregate_duplicates, fuzzy_match, reconcile, to_minor
+from recon_history import SCHEMA_VERSION, connect
+
+def _side(rows):
+    """(vendor, invoice_no, amount[最小单位]) → 已规范化、已聚合的一方。"""
+    df = pd.DataFrame({
+        "vendor": [r[0] for r in rows],
+        "invoice_no_raw": [r[1] for r in rows],
+        "match_key": [r[1] for r in rows],
+        "amount": pd.array([r[2] for r in rows], dtype="Int64"),
+        "currency": "JPY",
+    })
+    return aggregate_duplicates(df)[0]
+
+def _status(merged):
+    return dict(zip(merged["invoice_no"], merged["status"].astype(str)))
+
+def test_to_minor_rounds_and_keeps_unparsable_as_na():
+    s = to_minor(pd.Series(["12.34", "0", "-1.2", "7", "abc", None]))
+    assert str(s.dtype) == "Int64"
+    assert s.iloc[:4].tolist() == [1234, 0, -120, 700]
+    assert s.iloc[4:].isna().all()                      # 无法解析 ≠ 0
+    assert to_minor(pd.Series([1.5]), scale=1).tolist() == [2]
+
+def test_zero_amount_rows_match_and_missing_sides_come_from_merge():
+    inv = _side([("V1", "A", 0), ("V1", "B", 500)])
+    bill = _side([("V1", "A", 0), ("V1", "C", 700)])
+    merged, parts = reconcile(inv, bill)
+    assert _status(merged) == {"A": "Matched", "B": "Missing_Bill", "C": "Missing_Invoice"}
+    assert [len(parts[o]) for o in ["Matched", "Mismatch", "Missing_Invoice", "Missing_Bill"]] == [1, 0, 1, 1]
+
+def test_na_amount_is_mismatch_with_na_diff():
+    merged, _ = reconcile(_side([("V1", "A", None), ("V1", "B", 1000)]),
+                          _side([("V1", "A", 0), ("V1", "B", 990)]))
+    assert _status(merged) == {"A": "Mismatch", "B": "Mismatch"}
+    diff = merged.set_index("invoice_no")["diff"]
+    assert str(diff.dtype) == "Int64"
+    assert pd.isna(diff["A"]) and diff["B"] == 10
+
+def test_tolerance_takes_the_looser_of_abs_and_pct():
+    inv = _side([("V1", "A", 100_000), ("V1", "B", 1000)])
+    bill = _side([("V1", "A", 99_000), ("V1", "B", 990)])
+    # 绝对容差 0.10（=10 最小单位）放过 B；1% 按两边较大者放过 A
+    assert _status(reconcile(inv, bill, abs_thr=0.10)[0]) == {"A": "Mismatch", "B": "Matched"}
+    assert _status(reconcile(inv, bill, pct_thr=0.01)[0]) == {"A": "Matched", "B": "Matched"}
+    assert _status(reconcile(inv, bill, abs_thr=0.09, pct_thr=0.001)[0]) == {"A": "Mismatch", "B": "Mismatch"}
+
+def test_fuzzy_pair_without_amount_check_keeps_na_diff():
+    merged, parts = reconcile(_side([("V1", "INV0010", None), ("V1", "INV0020", 1000)]),
+                              _side([("V1", "INV0011", 500), ("V1", "INV0021", 1000)]))
+    merged, paired = fuzzy_match(merged, parts, 1, require_amount=False)
+    assert len(paired) == 2 and len(merged) == 2
+    rows = merged.set_index("invoice_no")
+    assert rows.loc["INV0010", "status"] == "Mismatch"
+    assert pd.isna(rows.loc["INV0010", "diff"]) and not rows.loc["INV0010", "within_tolerance"]   # 不以 0 代入
+    assert rows.loc["INV0020", "status"] == "Matched" and rows.loc["INV0020", "diff"] == 0
+    assert str(merged["diff"].dtype) == "Int64"
+    # 要求金额一致时缺失金额的一方不参与配对
+    merged, parts = reconcile(_side([("V1", "INV0010", None)]), _side([("V1", "INV0011", 500)]))
+    assert len(fuzzy_match(merged, parts, 1)[1]) == 0
+
+def test_aggregate_duplicates_sums_and_reports():
+    df = pd.DataFrame({
+        "vendor": ["V1", "V1", "V1"], "invoice_no_raw": ["A-1", "a1", "B"], "match_key": ["A1", "A1", "B"],
+        "amount": pd.array([100, 250, None], dtype="Int64"), "currency": "JPY",
+    })
+    agg, dups = aggregate_duplicates(df)
+    row = agg.set_index("match_key").loc["A1"]
+    assert row["amount"] == 350 and row["invoice_no_raw"] == "A-1"
+    assert pd.isna(agg.set_index("match_key").loc["B", "amount"])     # 全部缺失仍为缺失，不是 0
+    assert len(dups) == 2
+
+def test_old_history_db_is_migrated(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    old = sqlite3.connect(path)
+    old.executescript("""
+        CREATE TABLE open_items (vendor TEXT NOT NULL, invoice_no TEXT NOT NULL, currency TEXT NOT NULL,
+            side TEXT NOT NULL, amount REAL NOT NULL, opened_period TEXT NOT NULL, last_period TEXT NOT NULL,
+            closed_period TEXT, PRIMARY KEY (vendor, invoice_no, currency, side)) WITHOUT ROWID;
+        INSERT INTO open_items VALUES ('V1', 'INV1', 'JPY', 'inv', 1.0, '2025-01', '2025-01', NULL);
+    """)
+    old.close()
+    con = connect(path)
+    assert con.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    con.execute("INSERT INTO open_items VALUES ('V1', 'INV2', 'JPY', 'inv', NULL, '2025-02', '2025-02', NULL)")
+    assert con.execute("SELECT COUNT(*) FROM open_items").fetchone()[0] == 2
+    con.close()
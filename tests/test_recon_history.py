@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""recon_history 跨期结转：按期间幂等、跨期核销、补跑较早期间、撤回错误期间。"""
+import pandas as pd
+import pytest
+
+from recon_history import carry_forward, connect, undo_carry
+
+COLS = ["vendor", "invoice_no", "currency", "amount_inv", "amount_bill"]
+
+@pytest.fixture
+def con(tmp_path):
+    c = connect(str(tmp_path / "history.sqlite"))
+    yield c
+    c.close()
+
+def _frame(rows, start=0):
+    return pd.DataFrame(rows, columns=COLS, index=range(start, start + len(rows)))
+
+def _open_items(con):
+    return con.execute("SELECT invoice_no, side, amount, opened_period, last_period, closed_period"
+                       " FROM open_items ORDER BY invoice_no, side").fetchall()
+
+def _period_1(con, period="2025-03"):
+    """本期只有发票方 INV100 → 挂账 side=inv。"""
+    return carry_forward(con, period, _frame([]), _frame([["V1", "INV100", "JPY", 100.0, None]]))
+
+def _period_2(con, period="2025-04"):
+    """下期只有账单方 INV100 → 与往期未达项核销。"""
+    return carry_forward(con, period, _frame([["V1", "INV100", "JPY", None, 100.0]], start=10), _frame([]))
+
+def test_unmatched_rows_are_opened(con):
+    carried, rest_inv, rest_bill = _period_1(con)
+    assert carried.empty and rest_inv.empty and len(rest_bill) == 1
+    assert _open_items(con) == [("INV100", "inv", 100.0, "2025-03", "2025-03", None)]
+
+def test_later_period_carries_and_closes(con):
+    _period_1(con)
+    carried, rest_inv, rest_bill = _period_2(con)
+    assert carried.index.tolist() == [10] and rest_inv.empty and rest_bill.empty
+    row = carried.loc[10]
+    assert (row["amount_inv"], row["amount_bill"], row["diff"]) == (100.0, 100.0, 0.0)
+    assert bool(row["within_tolerance"]) and row["carried_from"] == "2025-03"
+    assert _open_items(con) == [("INV100", "inv", 100.0, "2025-03", "2025-03", "2025-04")]
+
+def test_rerunning_a_period_is_idempotent(con):
+    _period_1(con)
+    first = _period_2(con)[0]
+    before = _open_items(con)
+    again = _period_2(con)[0]
+    assert _open_items(con) == before
+    pd.testing.assert_frame_equal(first, again)
+
+def test_same_period_does_not_match_itself(con):
+    _period_1(con, "2025-04")
+    carried, rest_inv, _ = _period_2(con, "2025-04")
+    assert carried.empty and len(rest_inv) == 1
+
+def test_earlier_period_keeps_opened_not_after_last(con):
+    _period_1(con, "2026-10")
+    _period_1(con, "2025-03")
+    (_, _, _, opened, last, closed), = _open_items(con)
+    assert (opened, last, closed) == ("2025-03", "2026-10", None)
+
+def test_undo_wrong_period_then_repost(con):
+    _period_1(con, "2026-10")                   # 误按当月结转
+    undo_carry(con, "2026-10", ["V1"])
+    assert _open_items(con) == []
+    _period_1(con, "2025-03")
+    carried = _period_2(con)[0]
+    assert carried.index.tolist() == [10]
+
+@pytest.mark.parametrize("period", ["", "2025-3", "2025-13", "2025/03", "202503"])
+def test_invalid_period_is_rejected(con, period):
+    with pytest.raises(ValueError):
+        _period_1(con, period)
+    assert _open_items(con) == []
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""recon_ingest 编码识别与读取回退：UTF-8/BOM/cp932/gb18030、样本截断、编码不符、缺列、不规整文件。"""
+import pytest
+
+from recon_ingest import SAMPLE_BYTES, detect_encoding, ingest, read_source
+
+JA = "仕入先,請求書番号,金額,通貨\n株式会社サンプル,INV-001,1000,JPY\nテスト商事,INV-002,2500,JPY\n"
+ZH = "供应商,发票号,金额,币种\n上海示例有限公司,INV-001,1000,CNY\n北京测试贸易,INV-002,2500,CNY\n"
+
+@pytest.mark.parametrize("data, expected", [
+    (JA.encode("utf-8"), "utf-8"),
+    (b"\xef\xbb\xbf" + JA.encode("utf-8"), "utf-8-sig"),
+    (JA.encode("cp932"), "cp932"),
+    (ZH.encode("gb18030"), "gb18030"),
+    (b"vendor,invoice_no\nV1,A\n", "utf-8"),
+])
+def test_detect_encoding(data, expected):
+    assert detect_encoding(data) == expected
+
+def _strict(data, enc):
+    try:
+        return data.decode(enc)
+    except UnicodeDecodeError:
+        return None
+
+def test_multibyte_char_cut_at_sample_end_is_not_an_error():
+    for enc in ["utf-8", "cp932"]:
+        data = next(d for d in (("a" * p + "請求書" * 25000).encode(enc) for p in range(3))
+                    if not _strict(d[:SAMPLE_BYTES], enc))   # 第 64KB 处正好截断一个多字节字符
+        assert detect_encoding(data) == enc
+
+def test_read_source_detects_and_reads_text_columns():
+    df = read_source("ja.csv", JA.encode("cp932"), text_cols=["請求書番号"])
+    assert list(df.columns) == ["仕入先", "請求書番号", "金額", "通貨"]
+    assert df["仕入先"].tolist() == ["株式会社サンプル", "テスト商事"]
+    assert df["金額"].tolist() == [1000, 2500]
+
+def test_read_source_wrong_encoding_names_file_and_encoding():
+    with pytest.raises(ValueError, match=r"ja\.csv.*utf-8"):
+        read_source("ja.csv", JA.encode("cp932"), encoding="utf-8")
+
+def test_ragged_csv_falls_back_to_c_parser_error():
+    data = b"a,b\n1,2\n3,4,5\n"
+    with pytest.raises(ValueError) as e:
+        read_source("ragged.csv", data)
+    assert not isinstance(e.value.__cause__, UnicodeDecodeError)
+
+def test_ingest_reads_mapped_columns_and_rejects_missing():
+    sources = [("a.csv", b"vendor,invoice_no,amount,extra\nV1,1001,10,x\n", None),
+               ("b.csv", b"vendor,invoice_no,amount\nV2,B-2,20\n", None)]
+    df = ingest(sources, columns=["vendor", "invoice_no", "amount"], text_cols=["invoice_no"])
+    assert list(df.columns) == ["vendor", "invoice_no", "amount", "source_file", "source_sheet"]
+    assert df["invoice_no"].tolist() == ["1001", "B-2"]
+    assert df["source_file"].astype(str).tolist() == ["a.csv", "b.csv"]
+    with pytest.raises(ValueError, match="b.csv.*extra"):
+        ingest(sources, columns=["vendor", "extra"])